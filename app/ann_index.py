@@ -0,0 +1,222 @@
+import json
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from app.quantization import QUANTIZATIONS, int8_scores, quantize_int8
+
+
+IVF_DIR = "ivf"
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def default_list_count(rows: int) -> int:
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray, batch_size: int = 65_536) -> np.ndarray:
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), batch_size):
+        block = np.asarray(matrix[start : start + batch_size], dtype=np.float32)
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    matrix: np.ndarray,
+    n_lists: int,
+    iterations: int = 20,
+    samples_per_list: int = 64,
+    seed: int = 0,
+) -> np.ndarray:
+    """Spherical k-means on a sample of unit-length rows."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), n_lists * samples_per_list)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        order = np.argsort(assignments, kind="stable")
+        filled = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = normalize(np.add.reduceat(sample[order], starts, axis=0))
+        # reseed empty lists from random sample rows rather than letting them die
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+@dataclass(frozen=True)
+class IVFIndex:
+    """Inverted-file index: rows grouped by nearest centroid, stored contiguously per list.
+
+    A query scores the centroids, then only the rows of the `probes` closest lists.
+    """
+
+    version: int
+    quantization: str
+    centroids: np.ndarray
+    offsets: np.ndarray
+    ids: np.ndarray
+    vectors: np.ndarray
+    scales: np.ndarray | None
+    # ids sorted, and their positions in `ids`, for scoring an explicit candidate set
+    sorted_ids: np.ndarray
+    id_order: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _scores(self, rows: slice | np.ndarray, query: np.ndarray) -> np.ndarray:
+        if self.quantization == "int8":
+            return int8_scores(self.vectors[rows], self.scales[rows], query)
+        return np.asarray(self.vectors[rows], dtype=np.float32) @ query
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        probes: int,
+        candidate_ids: np.ndarray | None = None,
+    ) -> list[tuple[int, float]]:
+        """Approximate top-k for a unit-length query."""
+        if not len(self) or top_k <= 0:
+            return []
+
+        if candidate_ids is not None:
+            found = np.searchsorted(self.sorted_ids, candidate_ids)
+            present = found < len(self.sorted_ids)
+            found = found[present]
+            found = found[self.sorted_ids[found] == candidate_ids[present]]
+            positions = np.sort(self.id_order[found])
+            scores = self._scores(positions, query) if len(positions) else np.empty(0, dtype=np.float32)
+        else:
+            probes = min(probes, len(self.centroids))
+            lists = np.argpartition(self.centroids @ query, -probes)[-probes:]
+            ranges = [(self.offsets[i], self.offsets[i + 1]) for i in lists if self.offsets[i + 1] > self.offsets[i]]
+            if not ranges:
+                return []
+            positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([self._scores(slice(start, end), query) for start, end in ranges])
+
+        if not len(scores):
+            return []
+        k = min(top_k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(self.ids[positions[i]]), float(scores[i])) for i in top]
+
+
+def build_ivf(
+    version: int,
+    ids: np.ndarray,
+    matrix: np.ndarray,
+    n_lists: int | None = None,
+    quantization: str = "none",
+    seed: int = 0,
+) -> IVFIndex:
+    """Cluster unit-length `matrix` rows (aligned with `ids`) into `n_lists` inverted lists."""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unsupported quantization: {quantization!r}")
+    n_lists = min(n_lists or default_list_count(len(matrix)), len(matrix)) or 1
+
+    if len(matrix):
+        centroids = train_centroids(matrix, n_lists, seed=seed)
+        assignments = assign_lists(matrix, centroids)
+    else:
+        centroids = np.zeros((1, matrix.shape[1] if matrix.ndim == 2 else 0), dtype=np.float32)
+        assignments = np.empty(0, dtype=np.int32)
+
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=offsets[1:])
+    list_ids = np.asarray(ids, dtype=np.int64)[order]
+    vectors = np.asarray(matrix, dtype=np.float32)[order]
+    scales = None
+    if quantization == "int8":
+        vectors, scales = quantize_int8(vectors)
+
+    id_order = np.argsort(list_ids, kind="stable")
+    return IVFIndex(
+        version=version,
+        quantization=quantization,
+        centroids=centroids,
+        offsets=offsets,
+        ids=list_ids,
+        vectors=vectors,
+        scales=scales,
+        sorted_ids=list_ids[id_order],
+        id_order=id_order,
+    )
+
+
+ARRAYS = ("centroids", "offsets", "ids", "vectors", "scales", "sorted_ids", "id_order")
+
+
+def save_ivf(index: IVFIndex, index_dir: str | Path) -> Path:
+    """Write the index into a fresh directory, then move it over the previous one."""
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=index_dir, prefix=f"{IVF_DIR}.tmp-"))
+    for name in ARRAYS:
+        array = getattr(index, name)
+        if array is not None:
+            np.save(staging / f"{name}.npy", array)
+    meta = {"version": index.version, "quantization": index.quantization, "count": len(index)}
+    (staging / "meta.json").write_text(json.dumps(meta))
+    staging.chmod(0o755)
+
+    target = index_dir / IVF_DIR
+    if target.exists():
+        retired = target.with_name(f"{IVF_DIR}.old-{staging.name.rsplit('-', 1)[-1]}")
+        target.rename(retired)
+        staging.rename(target)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        staging.rename(target)
+    return target
+
+
+def read_meta(index_dir: str | Path) -> dict | None:
+    try:
+        return json.loads((Path(index_dir) / IVF_DIR / "meta.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def load_ivf(index_dir: str | Path) -> IVFIndex | None:
+    """Memory-map a saved index; row data is paged in by the OS as lists are probed."""
+    meta = read_meta(index_dir)
+    if meta is None:
+        return None
+    directory = Path(index_dir) / IVF_DIR
+    try:
+        arrays = {
+            name: np.load(directory / f"{name}.npy", mmap_mode="r")
+            for name in ARRAYS
+            if (directory / f"{name}.npy").exists()
+        }
+        return IVFIndex(
+            version=int(meta["version"]),
+            quantization=meta["quantization"],
+            centroids=np.array(arrays["centroids"]),
+            offsets=np.array(arrays["offsets"]),
+            ids=arrays["ids"],
+            vectors=arrays["vectors"],
+            scales=arrays.get("scales"),
+            sorted_ids=arrays["sorted_ids"],
+            id_order=arrays["id_order"],
+        )
+    except (OSError, KeyError, ValueError):
+        return None
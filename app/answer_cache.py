@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    question: str
+    chunk_ids: tuple[int, ...]
+    # digest of the history and summary the answer was written for
+    conversation: str
+    answer: str
+
+
+class SemanticAnswerCache:
+    """Answers keyed by question embedding, reused for near-identical questions.
+
+    An entry only matches when the new question is at least `threshold` cosine-similar,
+    retrieval returned the same chunk ids and the conversation before it is the same, so
+    a follow-up question is never answered for another chat's history. All entries
+    belong to one index version and are dropped when the index changes.
+    """
+
+    def __init__(self, threshold: float = 0.97, max_entries: int = 2000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version: int | None = None
+        self._matrix: np.ndarray | None = None
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._free: list[int] = []
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, index_version: int) -> None:
+        if index_version != self._version:
+            self._version = index_version
+            self._entries.clear()
+            self._free = list(range(self.max_entries))[::-1]
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray | None:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def lookup(
+        self,
+        query_embedding: Sequence[float],
+        chunk_ids: Sequence[int],
+        conversation: str,
+        index_version: int,
+    ) -> str | None:
+        query = self._unit(query_embedding)
+        with self._lock:
+            self._check_version(index_version)
+            if query is None or not self._entries or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            slots = np.fromiter(self._entries.keys(), dtype=np.int64, count=len(self._entries))
+            scores = self._matrix[slots] @ query
+            wanted = tuple(chunk_ids)
+            for i in np.argsort(scores)[::-1]:
+                if scores[i] < self.threshold:
+                    break
+                slot = int(slots[i])
+                entry = self._entries[slot]
+                if entry.chunk_ids == wanted and entry.conversation == conversation:
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        question: str,
+        query_embedding: Sequence[float],
+        chunk_ids: Sequence[int],
+        conversation: str,
+        answer: str,
+        index_version: int,
+    ) -> None:
+        query = self._unit(query_embedding)
+        if query is None:
+            return
+        with self._lock:
+            self._check_version(index_version)
+            if self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                self._matrix = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+                self._entries.clear()
+                self._free = list(range(self.max_entries))[::-1]
+
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot, _ = self._entries.popitem(last=False)
+            self._matrix[slot] = query
+            self._entries[slot] = CachedAnswer(question, tuple(chunk_ids), conversation, answer)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,234 @@
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+from app.config import settings
+from app.tokens import count_tokens
+
+
+RESUME_SECTIONS = {
+    "summary",
+    "professional summary",
+    "profile",
+    "objective",
+    "experience",
+    "work experience",
+    "professional experience",
+    "employment history",
+    "education",
+    "skills",
+    "technical skills",
+    "core competencies",
+    "projects",
+    "certifications",
+    "certificates",
+    "awards",
+    "publications",
+    "languages",
+    "interests",
+    "references",
+    "contact",
+}
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+WORD = re.compile(r"\S+")
+
+
+@dataclass(frozen=True)
+class Chunk:
+    text: str
+    # character offsets of the chunk's first and last block in the source text
+    start: int
+    end: int
+    token_count: int
+
+    @property
+    def content_hash(self) -> str:
+        return chunk_hash(self.text)
+
+
+@dataclass(frozen=True)
+class Block:
+    text: str
+    start: int
+    end: int
+    tokens: int
+    heading: bool = False
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_params(target_tokens: int | None = None, max_tokens: int | None = None) -> str:
+    """Identifies the chunking configuration, so changing it re-chunks every file."""
+    target_tokens = target_tokens or settings.chunk_target_tokens
+    max_tokens = max_tokens or settings.chunk_max_tokens
+    return f"tokens:{target_tokens}:{max_tokens}"
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > 80:
+        return False
+    if line.startswith("#"):
+        return True
+    if line.rstrip(":").strip().casefold() in RESUME_SECTIONS:
+        return True
+    words = line.split()
+    return line.isupper() and len(words) <= 6 and any(c.isalpha() for c in line)
+
+
+def iter_blocks(lines: Iterable[str], model: str, max_tokens: int | None = None) -> Iterator[Block]:
+    """Paragraphs and headings with their offsets, read one line at a time.
+
+    Lines must keep their line endings so offsets line up with the source text. With `max_tokens`,
+    a paragraph is cut as soon as it outgrows the budget, so text without blank lines is not
+    buffered whole; only its unfinished last piece is held back.
+    """
+    offset = 0
+    start = end = 0
+    paragraph: list[str] = []
+    paragraph_tokens = 0
+
+    def flush() -> Iterator[Block]:
+        nonlocal paragraph_tokens
+        if paragraph:
+            text = "".join(paragraph).strip()
+            yield Block(text, start, end, count_tokens(text, model))
+            paragraph.clear()
+            paragraph_tokens = 0
+
+    def cut() -> Iterator[Block]:
+        nonlocal start, paragraph_tokens
+        joined = "".join(paragraph)
+        lead = len(joined) - len(joined.lstrip())
+        text = joined.strip()
+        *pieces, last = split_block(Block(text, start, end, count_tokens(text, model)), max_tokens, model)
+        yield from pieces
+        # the last piece may end mid-sentence, so it stays in the buffer with the lines still to come
+        paragraph[:] = [joined[lead + last.start - start :]]
+        start = last.start
+        paragraph_tokens = last.tokens
+
+    for line in lines:
+        stripped = line.strip()
+        lead = len(line) - len(line.lstrip())
+        if not stripped:
+            yield from flush()
+        elif is_heading(stripped):
+            yield from flush()
+            yield Block(stripped, offset + lead, offset + lead + len(stripped), count_tokens(stripped, model), True)
+        else:
+            if not paragraph:
+                start = offset + lead
+            paragraph.append(line)
+            paragraph_tokens += count_tokens(line, model)
+            end = offset + len(line.rstrip())
+            if max_tokens and paragraph_tokens > max_tokens:
+                yield from cut()
+        offset += len(line)
+    yield from flush()
+
+
+def split_block(block: Block, max_tokens: int, model: str, first_max_tokens: int | None = None) -> Iterator[Block]:
+    """Cut an oversized paragraph at sentence ends, falling back to word boundaries.
+
+    `first_max_tokens` caps the first piece instead, leaving room for headings it is packed with.
+    """
+    pieces: list[tuple[int, int]] = []
+    position = 0
+    for match in SENTENCE_END.finditer(block.text):
+        pieces.append((position, match.start()))
+        position = match.end()
+    pieces.append((position, len(block.text)))
+
+    limit = min(max_tokens, first_max_tokens or max_tokens)
+    units: list[tuple[int, int, int]] = []
+    for start, end in pieces:
+        tokens = count_tokens(block.text[start:end], model)
+        if tokens <= limit:
+            units.append((start, end, tokens))
+            continue
+        for word in WORD.finditer(block.text, start, end):
+            units.append((word.start(), word.end(), count_tokens(word.group(), model)))
+
+    current_start = current_end = None
+    current_tokens = 0
+    for start, end, tokens in units:
+        if current_start is not None and current_tokens + tokens > limit:
+            text = block.text[current_start:current_end]
+            yield Block(text, block.start + current_start, block.start + current_end, current_tokens)
+            current_start = None
+            current_tokens = 0
+            limit = max_tokens
+        if current_start is None:
+            current_start = start
+        current_end = end
+        current_tokens += tokens
+    if current_start is not None:
+        text = block.text[current_start:current_end]
+        yield Block(text, block.start + current_start, block.start + current_end, current_tokens)
+
+
+def chunk_lines(
+    lines: Iterable[str],
+    target_tokens: int | None = None,
+    max_tokens: int | None = None,
+    model: str | None = None,
+) -> Iterator[Chunk]:
+    """Pack paragraphs into chunks of about `target_tokens`, never more than `max_tokens`.
+
+    Headings start a new chunk once the current one is reasonably sized and are never left
+    dangling at the end of a chunk, or emitted on their own: they are held back and open the next
+    chunk. Works in one pass and only holds the chunk being built.
+    """
+    target_tokens = target_tokens or settings.chunk_target_tokens
+    max_tokens = max(max_tokens or settings.chunk_max_tokens, target_tokens)
+    model = model or settings.openai_embedding_model
+    min_tokens = target_tokens // 2
+
+    current: list[Block] = []
+    current_tokens = 0
+
+    def emit(blocks: list[Block]) -> Chunk:
+        text = "\n\n".join(b.text for b in blocks)
+        return Chunk(text, blocks[0].start, blocks[-1].end, sum(b.tokens for b in blocks))
+
+    def held_headings() -> int:
+        count = 0
+        while count < len(current) and current[-1 - count].heading:
+            count += 1
+        return count
+
+    for block in iter_blocks(lines, model, max_tokens):
+        held = sum(b.tokens for b in current[len(current) - held_headings() :])
+        if not block.heading and block.tokens + held > max_tokens:
+            parts = split_block(block, max_tokens, model, max(1, max_tokens - held))
+        else:
+            parts = (block,)
+        for part in parts:
+            total = current_tokens + part.tokens
+            keep = len(current) - held_headings()
+            if keep and (
+                (part.heading and current_tokens >= min_tokens)
+                or total > max_tokens
+                or (total > target_tokens and current_tokens >= min_tokens)
+            ):
+                yield emit(current[:keep])
+                current = current[keep:]
+                current_tokens = sum(b.tokens for b in current)
+            current.append(part)
+            current_tokens += part.tokens
+
+    if current:
+        yield emit(current)
+
+
+def unique_chunks(chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+    """Drop repeats of an earlier chunk (boilerplate headers, footers), keeping only their hashes."""
+    seen: set[str] = set()
+    for chunk in chunks:
+        if chunk.content_hash not in seen:
+            seen.add(chunk.content_hash)
+            yield chunk
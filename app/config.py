@@ -11,12 +11,102 @@ class Settings(BaseSettings):
     azure_sql_connection_string: str = (
         "mssql+pyodbc://@localhost/RAGChatbotDB?driver=ODBC+Driver+18+for+SQL+Server"
     )
+    # Derived from azure_sql_connection_string (pyodbc -> aioodbc) when empty.
+    azure_sql_async_connection_string: str = ""
+    db_async_pool_size: int = 20
+    db_async_max_overflow: int = 20
 
     openai_api_key: str = ""
+    openai_base_url: str = ""
     openai_chat_model: str = "gpt-4.1-mini"
     openai_embedding_model: str = "text-embedding-3-small"
+    # Ask for shortened embeddings (e.g. 512); 0 keeps the model's full size. Changing it needs a full re-ingest.
+    openai_embedding_dimensions: int = 0
+    # Concurrent identical OpenAI requests (same model, input and context) share one upstream call.
+    openai_coalesce_requests: bool = True
+    # Per-worker caps on OpenAI calls in flight and started per second (0: no rate cap) for chat traffic.
+    openai_max_concurrency: int = 32
+    openai_max_requests_per_second: float = 0
+    embedding_storage_dtype: str = "float32"
+    embedding_batch_size: int = 256
+    embedding_batch_max_tokens: int = 100_000
+    embedding_max_concurrency: int = 4
+    embedding_max_retries: int = 6
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 10_000
+    embedding_cache_ttl_seconds: int = 3600
+    # SQLite file for the persistent cache tier; empty keeps the cache in memory only.
+    embedding_cache_path: str = ""
+    # The persistent tier drops rows older than this, and the oldest rows beyond the cap.
+    embedding_cache_persistent_ttl_seconds: int = 30 * 86400
+    embedding_cache_persistent_max_entries: int = 1_000_000
+    # Chunk rows per executemany during ingestion; the writer commits once this many rows are pending.
+    ingest_batch_size: int = 1000
+    # While an ingest refreshed its marker this recently, workers keep serving the published
+    # snapshot even though the database is ahead of it; a quieter run is treated as dead.
+    ingest_heartbeat_timeout_seconds: int = 900
+    chunk_target_tokens: int = 350
+    chunk_max_tokens: int = 512
 
     rag_top_k: int = 4
+    # "exact" scans every embedding; "ivf" searches the ANN index built by ingestion.
+    rag_index_mode: str = "exact"
+    # 0 picks about 4 * sqrt(chunk count) inverted lists.
+    ivf_lists: int = 0
+    ivf_probes: int = 8
+    # "none" keeps float32 vectors in the IVF index, "int8" stores a quarter of that.
+    ivf_quantization: str = "none"
+    # Exact mode can scan compact "int8" codes (1/4 the bytes) or "binary" sign bits (1/32) first,
+    # then rescore the best RAG_RESCORE_CANDIDATES rows with the full-precision vectors.
+    # Codes come from the ingest snapshot, whose float32 rows stay memory-mapped: only the
+    # rescored rows are paged in. int8 saves memory, not latency.
+    rag_compact_codes: str = "none"
+    rag_rescore_candidates: int = 200
+    rag_hybrid_enabled: bool = True
+    # Candidates taken from each of the vector and BM25 rankings before fusion.
+    rag_candidate_pool: int = 50
+    rag_rrf_k: int = 60
+    # Above this many chunks the vector stage only scores the BM25 shortlist.
+    rag_prefilter_min_chunks: int = 200_000
+    rag_prefilter_candidates: int = 2000
+    # Merge retrieved chunks that are adjacent or overlap in their source, drop passages whose
+    # 5-word shingles are mostly in a better-ranked one, and pack the rest into this many tokens.
+    rag_context_packing: bool = True
+    rag_context_token_budget: int = 2000
+    rag_context_duplicate_threshold: float = 0.9
+    # Local directory for persisted retrieval indexes.
+    index_dir: str = "index"
+
+    history_max_messages: int = 20
+    history_token_budget: int = 3000
+    prompt_token_budget: int = 12_000
+    history_summary_enabled: bool = False
+    # Queue finished chat turns and write them in batches off the response path.
+    message_write_behind: bool = False
+    message_write_behind_interval_seconds: float = 0.5
+    message_write_behind_batch_size: int = 200
+    # Turns that could not be written by shutdown are appended here and replayed on the next start.
+    message_write_behind_spill_path: str = "message_spill.jsonl"
+
+    # Signed-in users are cached per worker for this long; 0 looks the user up on every request.
+    user_cache_ttl_seconds: int = 60
+    user_cache_max_entries: int = 10_000
+    # Threads that hash and verify passwords, and how many checks may queue for them before
+    # a login is turned away with 503.
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 64
+
+    metrics_enabled: bool = True
+    metrics_flush_interval_seconds: int = 60
+    metrics_minute_rollup_days: int = 7
+    # USD per million tokens, used to estimate openai_cost_usd.
+    openai_input_usd_per_1m: float = 0.40
+    openai_output_usd_per_1m: float = 1.60
+    openai_embedding_usd_per_1m: float = 0.02
+
+    answer_cache_enabled: bool = False
+    answer_cache_similarity_threshold: float = 0.97
+    answer_cache_max_entries: int = 2000
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,155 @@
+import re
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from app.models import DocumentChunk
+from app.tokens import count_tokens, truncate_tokens
+
+
+# Chunks whose offsets are at most this many characters apart are treated as adjacent.
+ADJACENT_GAP = 4
+# Shortest suffix/prefix match counted as overlapping text, so a shared word is not.
+MIN_OVERLAP = 20
+SHINGLE_WORDS = 5
+WORD = re.compile(r"\w+")
+
+
+@dataclass
+class Passage:
+    """Contiguous text from one source: one retrieved chunk or several merged ones.
+
+    Has the `source` / `chunk_text` pair prompt building reads from a chunk.
+    """
+
+    source: str
+    chunk_text: str
+    chunk_ids: list[int]
+    # best retrieval rank among its chunks; 0 is the top hit
+    rank: int
+    tokens: int = 0
+    shingles: frozenset = field(default=frozenset(), repr=False)
+
+
+@dataclass(frozen=True)
+class PackingStats:
+    chunks: int
+    passages: int
+    duplicates: int
+    input_tokens: int
+    packed_tokens: int
+
+
+def text_overlap(left: str, right: str, limit: int = 2000) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right` (0 below MIN_OVERLAP)."""
+    if len(left) < MIN_OVERLAP or len(right) < MIN_OVERLAP:
+        return 0
+    seed = right[:MIN_OVERLAP]
+    # candidate starts are where the prefix's first characters occur near the end of `left`
+    position = left.find(seed, max(0, len(left) - min(limit, len(right))))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(seed, position + 1)
+    return 0
+
+
+def adjacent(previous: DocumentChunk, chunk: DocumentChunk) -> bool | None:
+    """Whether `chunk` continues `previous` in their document; None when the chunks do not say."""
+    if previous.end_offset is not None and chunk.start_offset is not None:
+        return chunk.start_offset <= previous.end_offset + ADJACENT_GAP
+    if previous.chunk_index is not None and chunk.chunk_index is not None:
+        return chunk.chunk_index == previous.chunk_index + 1
+    return None
+
+
+def shingles(text: str) -> frozenset:
+    words = WORD.findall(text.casefold())
+    if len(words) < SHINGLE_WORDS:
+        return frozenset(words)
+    return frozenset(" ".join(words[i : i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+
+
+def merge_source(chunks: list[tuple[int, DocumentChunk]]) -> list[Passage]:
+    """Coalesce one source's hits that are adjacent in the document, or overlap, into passages."""
+    ordered = sorted(
+        chunks,
+        key=lambda item: (
+            item[1].chunk_index if item[1].chunk_index is not None else -1,
+            item[1].start_offset or 0,
+            item[1].id,
+        ),
+    )
+    passages: list[Passage] = []
+    previous = None
+    for rank, chunk in ordered:
+        text = chunk.chunk_text
+        if previous is not None:
+            passage = passages[-1]
+            follows = adjacent(previous, chunk)
+            overlap = text_overlap(passage.chunk_text, text) if follows is not False else 0
+            # without positions, only text the two chunks share shows they are neighbours
+            if follows or overlap:
+                # overlapping text is kept once; adjacent chunks are joined like paragraphs
+                passage.chunk_text += text[overlap:] if overlap else "\n\n" + text
+                passage.chunk_ids.append(chunk.id)
+                passage.rank = min(passage.rank, rank)
+                previous = chunk
+                continue
+        passages.append(Passage(chunk.source, text, [chunk.id], rank))
+        previous = chunk
+    return passages
+
+
+def pack_context(
+    chunks: Sequence[DocumentChunk],
+    token_budget: int,
+    duplicate_threshold: float = 0.9,
+    model: str = "gpt-4.1-mini",
+) -> tuple[list[Passage], PackingStats]:
+    """Turn ranked chunks into the passages sent to the model.
+
+    Hits from the same source that are adjacent or overlap become one passage; passages
+    whose text is mostly (`duplicate_threshold` of their 5-word shingles) already in a
+    better-ranked passage are dropped; the rest are packed greedily, best rank first, into
+    `token_budget` tokens. A top passage that is larger than the whole budget is truncated
+    rather than dropped.
+    """
+    by_source: dict[str, list[tuple[int, DocumentChunk]]] = {}
+    for rank, chunk in enumerate(chunks):
+        by_source.setdefault(chunk.source, []).append((rank, chunk))
+    passages = sorted(
+        (passage for hits in by_source.values() for passage in merge_source(hits)), key=lambda p: p.rank
+    )
+
+    kept: list[Passage] = []
+    duplicates = 0
+    for passage in passages:
+        passage.shingles = shingles(passage.chunk_text)
+        if passage.shingles and any(
+            len(passage.shingles & other.shingles) >= duplicate_threshold * len(passage.shingles) for other in kept
+        ):
+            duplicates += 1
+            continue
+        kept.append(passage)
+
+    packed: list[Passage] = []
+    used = 0
+    for passage in kept:
+        passage.tokens = count_tokens(passage.chunk_text, model)
+        if used + passage.tokens <= token_budget:
+            packed.append(passage)
+            used += passage.tokens
+        elif not packed:
+            passage.chunk_text = truncate_tokens(passage.chunk_text, token_budget, model)
+            passage.tokens = count_tokens(passage.chunk_text, model)
+            packed.append(passage)
+            used += passage.tokens
+
+    stats = PackingStats(
+        chunks=len(chunks),
+        passages=len(packed),
+        duplicates=duplicates,
+        input_tokens=sum(count_tokens(c.chunk_text, model) for c in chunks),
+        packed_tokens=used,
+    )
+    return packed, stats
@@ -0,0 +1,160 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Sequence
+
+import numpy as np
+
+from app.embeddings import decode_embedding, encode_embedding
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by (model, normalized text hash).
+
+    `model` must name everything that shapes the vector, e.g. "text-embedding-3-small@512"
+    for shortened embeddings, so a change of model or dimensions never returns stale vectors.
+    The in-process tier is a bounded LRU with a TTL. The optional persistent tier is a
+    local SQLite file, so entries survive restarts and are shared by workers on a host;
+    it has its own TTL and size cap, enforced as rows are written.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 3600,
+        path: str | None = None,
+        persistent_ttl_seconds: float = 30 * 86400,
+        persistent_max_entries: int = 1_000_000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent_ttl_seconds = persistent_ttl_seconds
+        self.persistent_max_entries = persistent_max_entries
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        self._db = None
+        # guards the SQLite connection, so memory-tier lookups never wait on disk I/O
+        self._db_lock = threading.Lock()
+        # rows written since the persistent tier was last pruned
+        self._written = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, "
+                "embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_created_at ON embedding_cache (created_at)")
+            self.prune()
+
+    def get(self, model: str, text: str) -> list[float] | None:
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> list[list[float] | None]:
+        keys = [cache_key(model, text) for text in texts]
+        found: dict[str, np.ndarray] = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if now - entry[0] > self.ttl_seconds:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+            self.memory_hits += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self._db is not None:
+            placeholders = ",".join("?" * len(missing))
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT key, dim, embedding FROM embedding_cache WHERE key IN ({placeholders}) "
+                    "AND created_at >= ?",
+                    [*missing, time.time() - self.persistent_ttl_seconds],
+                ).fetchall()
+            with self._lock:
+                for key, dim, blob in rows:
+                    vector = decode_embedding(blob, dim)
+                    found[key] = vector
+                    self._remember(key, vector, now)
+                self.persistent_hits += len(rows)
+
+        with self._lock:
+            self.misses += sum(1 for key in keys if key not in found)
+        return [found[key].tolist() if key in found else None for key in keys]
+
+    def put(self, model: str, text: str, embedding: Sequence[float]) -> None:
+        self.put_many(model, [text], [embedding])
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector, now)
+                rows.append((key, model, len(vector), encode_embedding(vector), time.time()))
+        if self._db is None or not rows:
+            return
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, dim, embedding, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._written += len(rows)
+            # pruning scans the created_at index, so do it every 1% of the cap (at least 1000 rows) written
+            due = self._written >= max(1000, self.persistent_max_entries // 100)
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete expired persistent rows, then the oldest beyond `persistent_max_entries`."""
+        if self._db is None:
+            return 0
+        with self._db_lock:
+            self._written = 0
+            expired = self._db.execute(
+                "DELETE FROM embedding_cache WHERE created_at < ?", (time.time() - self.persistent_ttl_seconds,)
+            ).rowcount
+            overflow = self._db.execute(
+                "DELETE FROM embedding_cache WHERE key IN ("
+                "SELECT key FROM embedding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.persistent_max_entries,),
+            ).rowcount
+        return expired + overflow
+
+    def _remember(self, key: str, vector: np.ndarray, now: float) -> None:
+        self._entries[key] = (now, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.persistent_hits) / lookups if lookups else 0.0,
+        }
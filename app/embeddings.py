@@ -0,0 +1,39 @@
+from typing import Sequence
+
+import numpy as np
+
+
+# Stored embeddings are always little-endian so blobs are portable between hosts.
+STORAGE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+
+def storage_dtype(name: str) -> np.dtype:
+    try:
+        return STORAGE_DTYPES[name]
+    except KeyError:
+        raise ValueError(f"Unsupported embedding dtype: {name!r}") from None
+
+
+def encode_embedding(embedding: Sequence[float], dtype: str = "float32") -> bytes:
+    return np.asarray(embedding, dtype=storage_dtype(dtype)).tobytes()
+
+
+def decode_embedding(blob: bytes, dim: int, dtype: str = "float32") -> np.ndarray:
+    """Zero-copy, read-only view of a stored embedding."""
+    vec = np.frombuffer(blob, dtype=storage_dtype(dtype))
+    if vec.shape[0] != dim:
+        raise ValueError(f"Embedding blob has {vec.shape[0]} values, expected {dim}")
+    return vec
+
+
+def decode_embeddings(blobs: Sequence[bytes], dim: int, dtype: str = "float32") -> np.ndarray:
+    """Decode many same-shaped blobs into one (n, dim) float32 matrix."""
+    if not blobs:
+        return np.empty((0, dim), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(blobs), dtype=storage_dtype(dtype))
+    if matrix.shape[0] != len(blobs) * dim:
+        raise ValueError("Embedding blobs do not all have the expected dimension")
+    return matrix.reshape(len(blobs), dim).astype(np.float32, copy=False)
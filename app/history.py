@@ -0,0 +1,75 @@
+from typing import Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.context_packing import Passage
+from app.models import ChatSummary, DocumentChunk, Message
+from app.tokens import count_tokens
+
+
+# Per-message framing overhead in the chat format.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(message["content"], settings.openai_chat_model) + MESSAGE_OVERHEAD_TOKENS
+
+
+async def load_recent_history(db: AsyncSession, chat_id: int, limit: int) -> list[dict]:
+    result = await db.execute(
+        select(Message.id, Message.role, Message.content)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    return [{"id": row.id, "role": row.role, "content": row.content} for row in reversed(result.all())]
+
+
+async def load_summary(db: AsyncSession, chat_id: int) -> ChatSummary | None:
+    return await db.get(ChatSummary, chat_id)
+
+
+def history_budget(user_message: str, context_chunks: Sequence[DocumentChunk | Passage], summary: str | None) -> int:
+    """Tokens left for history once the question, retrieved context and summary are in the prompt."""
+    used = count_tokens(user_message, settings.openai_chat_model)
+    used += sum(count_tokens(c.chunk_text, settings.openai_chat_model) for c in context_chunks)
+    if summary:
+        used += count_tokens(summary, settings.openai_chat_model)
+    return max(0, min(settings.history_token_budget, settings.prompt_token_budget - used))
+
+
+def trim_history(history: list[dict], budget: int) -> tuple[list[dict], list[dict]]:
+    """Keep the newest messages that fit in `budget` tokens; return (kept, dropped)."""
+    kept_from = len(history)
+    used = 0
+    for i in range(len(history) - 1, -1, -1):
+        used += message_tokens(history[i])
+        if used > budget:
+            break
+        kept_from = i
+    return history[kept_from:], history[:kept_from]
+
+
+async def messages_to_summarize(db: AsyncSession, chat_id: int, before_id: int, limit: int = 50) -> list[dict]:
+    """Messages older than the prompt window that the stored summary does not cover yet."""
+    summary = await load_summary(db, chat_id)
+    after_id = summary.summarized_through_id if summary else 0
+    result = await db.execute(
+        select(Message.id, Message.role, Message.content)
+        .where(Message.chat_id == chat_id, Message.id > after_id, Message.id < before_id)
+        .order_by(Message.id.asc())
+        .limit(limit)
+    )
+    return [{"id": row.id, "role": row.role, "content": row.content} for row in result.all()]
+
+
+async def save_summary(db: AsyncSession, chat_id: int, summary_text: str, through_id: int) -> None:
+    summary = await load_summary(db, chat_id)
+    if summary is None:
+        db.add(ChatSummary(chat_id=chat_id, summary=summary_text, summarized_through_id=through_id))
+    else:
+        summary.summary = summary_text
+        summary.summarized_through_id = through_id
+    await db.commit()
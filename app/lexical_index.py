@@ -0,0 +1,250 @@
+import asyncio
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import anyio
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import DocumentChunk
+from app.snapshots import current_snapshot
+from app.vector_index import alive_version, live_version
+
+
+# keeps skills like "c++" / "c#" as single terms
+TOKEN = re.compile(r"[a-z0-9][a-z0-9+#]*")
+PART = re.compile(r"[a-z]+|[0-9]+")
+INDEX_FILE = "lexical.npz"
+
+
+def normalize_term(term: str) -> str:
+    # candidate ids are written both as "035004" and "35004"
+    return (term.lstrip("0") or "0") if term.isdigit() else term
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased terms; mixed tokens such as "lester35004" also yield "lester" and "35004"."""
+    terms = []
+    for token in TOKEN.findall(text.casefold()):
+        terms.append(normalize_term(token))
+        parts = PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(normalize_term(part) for part in parts)
+    return terms
+
+
+@dataclass(frozen=True)
+class LexicalSnapshot:
+    """BM25 postings in CSR form: rows of term `t` are postings[offsets[t]:offsets[t + 1]]."""
+
+    version: int
+    ids: np.ndarray
+    terms: dict[str, int]
+    offsets: np.ndarray
+    postings: np.ndarray
+    freqs: np.ndarray
+    doc_lengths: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+EMPTY_LEXICAL = LexicalSnapshot(
+    version=-1,
+    ids=np.empty(0, dtype=np.int64),
+    terms={},
+    offsets=np.zeros(1, dtype=np.int64),
+    postings=np.empty(0, dtype=np.int32),
+    freqs=np.empty(0, dtype=np.float32),
+    doc_lengths=np.empty(0, dtype=np.float32),
+)
+
+
+def build_snapshot(version: int, rows: Iterable[tuple[int, str]]) -> LexicalSnapshot:
+    """Build postings from (chunk id, text) rows ordered by id."""
+    terms: dict[str, int] = {}
+    ids: list[int] = []
+    lengths: list[int] = []
+    term_ids: list[int] = []
+    rows_of: list[int] = []
+    counts: list[int] = []
+    for row, (chunk_id, text) in enumerate(rows):
+        tokens = tokenize(text)
+        ids.append(chunk_id)
+        lengths.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            term_ids.append(terms.setdefault(term, len(terms)))
+            rows_of.append(row)
+            counts.append(count)
+
+    term_array = np.asarray(term_ids, dtype=np.int64)
+    order = np.argsort(term_array, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_array, minlength=len(terms)), out=offsets[1:])
+    return LexicalSnapshot(
+        version=version,
+        ids=np.asarray(ids, dtype=np.int64),
+        terms=terms,
+        offsets=offsets,
+        postings=np.asarray(rows_of, dtype=np.int32)[order],
+        freqs=np.asarray(counts, dtype=np.float32)[order],
+        doc_lengths=np.asarray(lengths, dtype=np.float32),
+    )
+
+
+def save_snapshot(snapshot: LexicalSnapshot, index_dir: str | Path) -> Path:
+    """Write the snapshot next to a temp file and rename it into place, so readers never see half a file."""
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    vocabulary = np.array(sorted(snapshot.terms, key=snapshot.terms.__getitem__), dtype=str)
+    fd, tmp = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(
+            f,
+            version=np.int64(snapshot.version),
+            ids=snapshot.ids,
+            vocabulary=vocabulary,
+            offsets=snapshot.offsets,
+            postings=snapshot.postings,
+            freqs=snapshot.freqs,
+            doc_lengths=snapshot.doc_lengths,
+        )
+    os.chmod(tmp, 0o644)
+    path = index_dir / INDEX_FILE
+    os.replace(tmp, path)
+    return path
+
+
+def load_snapshot(index_dir: str | Path) -> LexicalSnapshot | None:
+    path = Path(index_dir) / INDEX_FILE
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return LexicalSnapshot(
+                version=int(data["version"]),
+                ids=data["ids"],
+                terms={term: i for i, term in enumerate(data["vocabulary"].tolist())},
+                offsets=data["offsets"],
+                postings=data["postings"],
+                freqs=data["freqs"],
+                doc_lengths=data["doc_lengths"],
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def load_chunk_texts(db: Session) -> list[tuple[int, str]]:
+    rows = db.execute(select(DocumentChunk.id, DocumentChunk.chunk_text).order_by(DocumentChunk.id))
+    return [(chunk_id, text) for chunk_id, text in rows]
+
+
+class LexicalIndex:
+    """Process-wide BM25 index over `document_chunks.chunk_text`.
+
+    Loaded from the published snapshot under `index_dir` when there is one, otherwise
+    built from the database, tracking versions the same way `VectorIndex` does.
+    """
+
+    def __init__(self, index_dir: str | Path | None = None, k1: float = 1.2, b: float = 0.75):
+        self.index_dir = Path(index_dir or settings.index_dir)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._async_lock = asyncio.Lock()
+        self._snapshot = EMPTY_LEXICAL
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def ensure_current(self, db: Session) -> LexicalSnapshot:
+        version = live_version(db, self.index_dir)
+        if version != self._snapshot.version:
+            with self._lock:
+                if version != self._snapshot.version:
+                    self.refresh(db, version)
+        return self._snapshot
+
+    async def aensure_current(self, db: AsyncSession) -> LexicalSnapshot:
+        version = await alive_version(db, self.index_dir)
+        if version != self._snapshot.version:
+            async with self._async_lock:
+                if version != self._snapshot.version:
+                    # a reload from the database takes seconds on a large corpus; keep it off the event loop
+                    await anyio.to_thread.run_sync(self.reload, version)
+        return self._snapshot
+
+    def reload(self, version: int) -> None:
+        """`refresh` with its own session, for callers that are not holding a sync one."""
+        with self._lock, SessionLocal() as db:
+            if version != self._snapshot.version:
+                self.refresh(db, version)
+
+    def refresh(self, db: Session, version: int) -> None:
+        pointer = current_snapshot(self.index_dir)
+        snapshot = load_snapshot(pointer.path) if pointer is not None else None
+        if snapshot is None or snapshot.version != version:
+            snapshot = build_snapshot(version, load_chunk_texts(db))
+        self._snapshot = snapshot
+
+    def search(self, query: str, top_k: int, allowed_ids: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """BM25 top-k, optionally limited to `allowed_ids` (ascending chunk ids)."""
+        snapshot = self._snapshot
+        if not len(snapshot) or top_k <= 0:
+            return []
+
+        scores = np.zeros(len(snapshot), dtype=np.float32)
+        avg_length = float(snapshot.doc_lengths.mean()) or 1.0
+        n = len(snapshot)
+        matched = False
+        for term in set(tokenize(query)):
+            t = snapshot.terms.get(term)
+            if t is None:
+                continue
+            matched = True
+            start, end = snapshot.offsets[t], snapshot.offsets[t + 1]
+            rows = snapshot.postings[start:end]
+            tf = snapshot.freqs[start:end]
+            idf = np.log1p((n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * snapshot.doc_lengths[rows] / avg_length)
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if not matched:
+            return []
+        if allowed_ids is not None:
+            # ids are ascending here too, so the allowed set maps to rows by binary search
+            rows = np.searchsorted(snapshot.ids, allowed_ids)
+            rows = rows[rows < n]
+            keep = np.zeros(n, dtype=bool)
+            keep[rows[snapshot.ids[rows] == allowed_ids[: len(rows)]]] = True
+            scores[~keep] = 0
+
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        k = min(top_k, len(hits))
+        top = hits[np.argpartition(scores[hits], -k)[-k:]]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(snapshot.ids[i]), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[int]], k: int = 60) -> list[int]:
+    """Merge ranked id lists by summing 1 / (k + rank); ids ranked well by any list float up."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
@@ -1,26 +1,68 @@
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
 from pathlib import Path
+from typing import Sequence
 
-from fastapi import Depends, FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+import anyio
+from fastapi import BackgroundTasks, Depends, FastAPI, Form, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.config import settings
-from app.db import Base, engine, get_db
-from app.models import Chat, Message, User
+from app.context_packing import Passage
+from app.db import AsyncSessionLocal, Base, SessionLocal, async_engine, engine, get_async_db, get_db
+from app.history import (
+    history_budget,
+    load_recent_history,
+    load_summary,
+    messages_to_summarize,
+    save_summary,
+    trim_history,
+)
+from app.message_log import NEW_CHAT_TITLE, MessageWriter, TurnRecord, persist_turns
+from app.metrics import MetricsMiddleware, instrument_engine, metrics
+from app.models import Chat, DocumentChunk, Message, User
+from app.pagination import encode_cursor, older_than
 from app.rag import RAGService
-from app.security import verify_password
+from app.security import PasswordPoolBusy, password_hasher
+from app.user_cache import SessionUser, SessionUserCache, invalidate_on_change
+from app.vector_index import RetrievalFilter
 
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title=settings.app_name)
 app.add_middleware(SessionMiddleware, secret_key=settings.app_secret_key)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 
+user_cache = SessionUserCache(settings.user_cache_ttl_seconds, settings.user_cache_max_entries)
+invalidate_on_change(user_cache)
+message_writer = (
+    MessageWriter(
+        AsyncSessionLocal,
+        batch_size=settings.message_write_behind_batch_size,
+        flush_interval=settings.message_write_behind_interval_seconds,
+        spill_path=settings.message_write_behind_spill_path,
+    )
+    if settings.message_write_behind
+    else None
+)
+
 try:
     rag_service = RAGService()
 except Exception:
@@ -30,17 +72,74 @@ except Exception:
 @app.on_event("startup")
 def startup_event():
     Base.metadata.create_all(bind=engine)
+    if rag_service is not None:
+        # load (or memory-map) the retrieval indexes before the first request needs them
+        with SessionLocal() as db:
+            rag_service.index.ensure_current(db)
+            if rag_service.lexical is not None:
+                rag_service.lexical.ensure_current(db)
+    if settings.metrics_enabled:
+        metrics.start(SessionLocal, settings.metrics_flush_interval_seconds)
+
+
+@app.on_event("startup")
+async def start_message_writer():
+    if message_writer is not None:
+        await message_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if message_writer is not None:
+        # drain queued turns (or spill them) before the engine goes away
+        await message_writer.stop()
+    await anyio.to_thread.run_sync(metrics.stop, SessionLocal)
+    await anyio.to_thread.run_sync(password_hasher.shutdown)
+    await async_engine.dispose()
 
 
-def get_current_user(request: Request, db: Session) -> User:
+def get_current_user(request: Request, db: Session) -> SessionUser:
     user_id = request.session.get("user_id")
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session")
-    return user
+    cached = SessionUser.from_user(user)
+    user_cache.put(cached)
+    return cached
+
+
+async def get_current_user_async(request: Request, db: AsyncSession) -> SessionUser:
+    user_id = request.session.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    cached = SessionUser.from_user(user)
+    user_cache.put(cached)
+    return cached
+
+
+def chat_title(user_message: str) -> str:
+    return (user_message[:60] + "...") if len(user_message) > 60 else user_message
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def iterate_once(text: str):
+    yield text
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -63,17 +162,25 @@ def chat_page(request: Request):
 
 
 @app.post("/api/login")
-def login(
+async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.password_hash):
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
+    try:
+        # hashing runs on the password pool, never on the loop or the request thread pool
+        valid = user is not None and await password_hasher.verify(password, user.password_hash)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Too many logins in progress", headers={"Retry-After": "1"})
+    if not valid:
+        metrics.incr("failed_logins")
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     request.session["user_id"] = user.id
+    user_cache.put(SessionUser.from_user(user))
+    metrics.incr("total_logins")
     return {"ok": True, "username": user.username}
 
 
@@ -83,30 +190,65 @@ def logout(request: Request):
     return {"ok": True}
 
 
+@app.get("/api/me")
+def me(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    return {"id": user.id, "username": user.username, "full_name": user.full_name}
+
+
+@app.get("/api/stats/cache")
+def cache_stats(request: Request, db: Session = Depends(get_db)):
+    get_current_user(request, db)
+    caches = {"users": user_cache.stats(), "embeddings": None, "answers": None}
+    if rag_service is not None:
+        caches["embeddings"] = rag_service.cache.stats() if rag_service.cache is not None else None
+        caches["answers"] = rag_service.answer_cache.stats() if rag_service.answer_cache is not None else None
+    return caches
+
+
+@app.get("/api/stats/retrieval")
+def retrieval_stats(request: Request, db: Session = Depends(get_db)):
+    get_current_user(request, db)
+    return rag_service.retrieval_stats.stats() if rag_service is not None else {}
+
+
 @app.get("/api/chats")
-def list_chats(request: Request, db: Session = Depends(get_db)):
+def list_chats(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    before: str | None = None,
+    db: Session = Depends(get_db),
+):
     user = get_current_user(request, db)
-    chats = (
-        db.query(Chat)
-        .filter(Chat.user_id == user.id)
-        .order_by(Chat.updated_at.desc(), Chat.id.desc())
-        .all()
-    )
-    return [
-        {
-            "id": c.id,
-            "title": c.title,
-            "created_at": c.created_at.isoformat() if c.created_at else None,
-            "updated_at": c.updated_at.isoformat() if c.updated_at else None,
-        }
-        for c in chats
-    ]
+    if message_writer is not None:
+        # a queued first turn renames its chat and moves it up the list
+        anyio.from_thread.run(partial(message_writer.settle, user_id=user.id))
+
+    query = db.query(Chat).filter(Chat.user_id == user.id)
+    if before:
+        query = query.filter(older_than(Chat.updated_at, Chat.id, before))
+    chats = query.order_by(Chat.updated_at.desc(), Chat.id.desc()).limit(limit + 1).all()
+
+    has_more = len(chats) > limit
+    chats = chats[:limit]
+    return {
+        "chats": [
+            {
+                "id": c.id,
+                "title": c.title,
+                "created_at": c.created_at.isoformat() if c.created_at else None,
+                "updated_at": c.updated_at.isoformat() if c.updated_at else None,
+            }
+            for c in chats
+        ],
+        "next_before": encode_cursor(chats[-1].updated_at, chats[-1].id) if has_more else None,
+    }
 
 
 @app.post("/api/chats")
 def create_chat(request: Request, db: Session = Depends(get_db)):
     user = get_current_user(request, db)
-    chat = Chat(user_id=user.id, title="New Chat")
+    chat = Chat(user_id=user.id, title=NEW_CHAT_TITLE)
     db.add(chat)
     db.commit()
     db.refresh(chat)
@@ -114,34 +256,100 @@ def create_chat(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/api/chats/{chat_id}/messages")
-def get_messages(chat_id: int, request: Request, db: Session = Depends(get_db)):
+def get_messages(
+    chat_id: int,
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    before: str | None = None,
+    db: Session = Depends(get_db),
+):
     user = get_current_user(request, db)
     chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user.id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    if message_writer is not None:
+        anyio.from_thread.run(message_writer.settle, chat_id)
 
-    messages = (
-        db.query(Message)
-        .filter(Message.chat_id == chat_id)
-        .order_by(Message.created_at.asc(), Message.id.asc())
-        .all()
-    )
-    return [
-        {
-            "id": m.id,
-            "role": m.role,
-            "content": m.content,
-            "created_at": m.created_at.isoformat() if m.created_at else None,
-        }
-        for m in messages
-    ]
+    query = db.query(Message).filter(Message.chat_id == chat_id)
+    if before:
+        query = query.filter(older_than(Message.created_at, Message.id, before))
+    # Newest page first, returned oldest-to-newest for display.
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit][::-1]
+    return {
+        "messages": [
+            {
+                "id": m.id,
+                "role": m.role,
+                "content": m.content,
+                "created_at": m.created_at.isoformat() if m.created_at else None,
+            }
+            for m in messages
+        ],
+        "next_before": encode_cursor(messages[0].created_at, messages[0].id) if has_more else None,
+    }
 
 
-@app.post("/api/chats/{chat_id}/messages")
-async def send_message(chat_id: int, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+@dataclass
+class ChatTurn:
+    chat_id: int
+    user_message: str
+    history: list[dict]
+    query_embedding: list[float]
+    context_chunks: list[DocumentChunk]
+    # what the prompt carries of context_chunks; answers are still cached by the retrieved chunk ids
+    context: Sequence[DocumentChunk | Passage]
+    use_cache: bool
+    summary: str | None = None
+    # Messages older than this id fell out of the prompt window and should be folded into the summary.
+    fold_before_id: int | None = None
+    # The chat's title once this turn is saved; `renames` when the turn replaces the placeholder.
+    title: str = NEW_CHAT_TITLE
+    renames: bool = False
+    user_id: int | None = None
+
+    def record(self, assistant_text: str | None) -> TurnRecord:
+        messages = (("user", self.user_message),) + ((("assistant", assistant_text),) if assistant_text else ())
+        return TurnRecord(self.chat_id, messages, self.title if self.renames else None, self.user_id)
+
+
+def parse_filters(raw) -> RetrievalFilter | None:
+    """Optional `filters` of a message request: {"sources": name, glob or list, "ingested_after", "ingested_before"}."""
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise HTTPException(status_code=400, detail="filters must be an object")
+
+    sources = raw.get("sources") or ()
+    if isinstance(sources, str):
+        sources = (sources,)
+    if not isinstance(sources, (list, tuple)) or not all(isinstance(s, str) and s for s in sources):
+        raise HTTPException(status_code=400, detail="filters.sources must be a string or a list of strings")
+
+    bounds = {}
+    for key in ("ingested_after", "ingested_before"):
+        value = raw.get(key)
+        try:
+            bounds[key] = datetime.fromisoformat(value) if value else None
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"filters.{key} must be an ISO 8601 date or datetime")
+
+    if not sources and not any(bounds.values()):
+        return None
+    return RetrievalFilter(sources=tuple(sources), **bounds)
+
+
+async def start_turn(chat_id: int, request: Request, db: AsyncSession) -> ChatTurn:
+    """Validate the request, read the chat's history and retrieve context for the reply.
+
+    Nothing is written here: the user message is stored with the reply by `save_turn`.
+    """
+    user = await get_current_user_async(request, db)
     data = await request.json()
     user_message = (data.get("message") or "").strip()
+    filters = parse_filters(data.get("filters"))
 
     if not user_message:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
@@ -149,35 +357,165 @@ async def send_message(chat_id: int, request: Request, db: Session = Depends(get
     if rag_service is None:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured")
 
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user.id).first()
-    if not chat:
+    if message_writer is not None:
+        # an earlier turn of this chat may still be queued
+        await message_writer.settle(chat_id)
+    result = await db.execute(select(Chat.title).where(Chat.id == chat_id, Chat.user_id == user.id))
+    title = result.scalar_one_or_none()
+    if title is None:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    user_msg_row = Message(chat_id=chat_id, role="user", content=user_message)
-    db.add(user_msg_row)
-    db.commit()
-
-    prior_messages = (
-        db.query(Message)
-        .filter(Message.chat_id == chat_id)
-        .order_by(Message.created_at.asc(), Message.id.asc())
-        .all()
+    history = await load_recent_history(db, chat_id, settings.history_max_messages)
+    summary = None
+    if settings.history_summary_enabled:
+        stored = await load_summary(db, chat_id)
+        summary = stored.summary if stored else None
+
+    # Ending the read transaction returns the connection to the pool before the embedding call.
+    await db.commit()
+
+    query_embedding = await rag_service.aembed_text(user_message)
+    context_chunks = await rag_service.afind_relevant_chunks(db, query_embedding, user_message, filters)
+    # Likewise release the connection before the long-running completion call.
+    await db.commit()
+
+    context = rag_service.assemble_context(context_chunks)
+    kept, dropped = trim_history(history, history_budget(user_message, context, summary))
+    fold_before_id = None
+    if settings.history_summary_enabled and (dropped or len(history) >= settings.history_max_messages):
+        fold_before_id = kept[0]["id"] if kept else history[-1]["id"] + 1
+
+    return ChatTurn(
+        chat_id,
+        user_message,
+        kept,
+        query_embedding,
+        context_chunks,
+        context,
+        use_cache=not data.get("bypass_cache"),
+        summary=summary,
+        fold_before_id=fold_before_id,
+        title=chat_title(user_message) if title == NEW_CHAT_TITLE else title,
+        renames=title == NEW_CHAT_TITLE,
+        user_id=user.id,
     )
 
-    history = [{"role": m.role, "content": m.content} for m in prior_messages[:-1]]
-    query_embedding = rag_service.embed_text(user_message)
-    context_chunks = rag_service.find_relevant_chunks(db, query_embedding)
-    assistant_text = rag_service.generate_answer(user_message, context_chunks, history)
 
-    assistant_msg_row = Message(chat_id=chat_id, role="assistant", content=assistant_text)
-    db.add(assistant_msg_row)
+async def fold_into_summary(chat_id: int, before_id: int) -> None:
+    """Summarize messages that left the prompt window; runs after the response is sent."""
+    async with AsyncSessionLocal() as db:
+        pending = await messages_to_summarize(db, chat_id, before_id)
+        if not pending:
+            return
+        stored = await load_summary(db, chat_id)
+        previous = stored.summary if stored else None
+        await db.commit()
+        summary_text = await rag_service.asummarize_history(previous, pending)
+        await save_summary(db, chat_id, summary_text, pending[-1]["id"])
 
-    if chat.title == "New Chat":
-        chat.title = (user_message[:60] + "...") if len(user_message) > 60 else user_message
 
-    db.commit()
+async def save_turn(db: AsyncSession, turn: ChatTurn, assistant_text: str | None) -> None:
+    """Store the user message and reply in one transaction, or queue them for the write-behind writer."""
+    record = turn.record(assistant_text)
+    if message_writer is not None:
+        await message_writer.submit(record)
+    else:
+        await persist_turns(db, [record])
+
+
+@app.post("/api/chats/{chat_id}/messages")
+async def send_message(
+    chat_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
+):
+    turn = await start_turn(chat_id, request, db)
+    assistant_text = (
+        rag_service.cached_answer(turn.query_embedding, turn.context_chunks, turn.history, turn.summary)
+        if turn.use_cache
+        else None
+    )
+    try:
+        if assistant_text is None:
+            assistant_text = await rag_service.agenerate_answer(
+                turn.user_message, turn.context, turn.history, turn.summary
+            )
+            rag_service.remember_answer(
+                turn.user_message, turn.query_embedding, turn.context_chunks, turn.history, turn.summary, assistant_text
+            )
+    except Exception:
+        # the question is kept even when no answer came back, unless saving fails too
+        try:
+            await db.rollback()
+            await save_turn(db, turn, None)
+        except Exception:
+            logger.exception("Could not save the question of chat %s after generation failed", chat_id)
+        raise
+    await save_turn(db, turn, assistant_text)
+    if turn.fold_before_id:
+        background_tasks.add_task(fold_into_summary, chat_id, turn.fold_before_id)
 
     return {
-        "user_message": {"role": "user", "content": user_message},
+        "user_message": {"role": "user", "content": turn.user_message},
         "assistant_message": {"role": "assistant", "content": assistant_text},
     }
+
+
+@app.post("/api/chats/{chat_id}/messages/stream")
+async def stream_message(
+    chat_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
+):
+    turn = await start_turn(chat_id, request, db)
+    cached = (
+        rag_service.cached_answer(turn.query_embedding, turn.context_chunks, turn.history, turn.summary)
+        if turn.use_cache
+        else None
+    )
+    if cached is not None:
+        tokens = iterate_once(cached)
+    else:
+        tokens = rag_service.astream_answer(turn.user_message, turn.context, turn.history, turn.summary)
+
+    async def event_stream():
+        parts: list[str] = []
+        finished = False
+        try:
+            async for delta in tokens:
+                parts.append(delta)
+                yield sse_event("token", {"text": delta})
+            finished = True
+            if cached is None:
+                rag_service.remember_answer(
+                    turn.user_message,
+                    turn.query_embedding,
+                    turn.context_chunks,
+                    turn.history,
+                    turn.summary,
+                    "".join(parts),
+                )
+        except Exception:
+            yield sse_event("error", {"detail": "Failed to generate a response"})
+        finally:
+            # Runs on completion, upstream failure and client disconnect alike, so a
+            # cancelled stream still leaves the question and its partial answer in the chat history.
+            assistant_text = "".join(parts)
+            if finished and not assistant_text:
+                assistant_text = "I could not generate a response."
+            with anyio.CancelScope(shield=True):
+                async with AsyncSessionLocal() as session:
+                    await save_turn(session, turn, assistant_text or None)
+
+        if finished:
+            yield sse_event("done", {"content": assistant_text, "title": turn.title})
+
+    if turn.fold_before_id:
+        background_tasks.add_task(fold_into_summary, chat_id, turn.fold_before_id)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+from collections import Counter, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models import Chat, Message
+
+
+NEW_CHAT_TITLE = "New Chat"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TurnRecord:
+    """The rows one chat turn writes: its messages in order, and the title a new chat takes."""
+
+    chat_id: int
+    # (role, content) pairs
+    messages: tuple[tuple[str, str], ...]
+    title: str | None = None
+    # the chat's owner, so listing their chats can wait for the turn too
+    user_id: int | None = None
+
+
+async def persist_turns(db: AsyncSession, turns: Sequence[TurnRecord]) -> None:
+    """Write turns in one transaction: a single multi-row INSERT, plus an UPDATE per renamed chat."""
+    rows = [
+        {"chat_id": turn.chat_id, "role": role, "content": content} for turn in turns for role, content in turn.messages
+    ]
+    if rows:
+        await db.execute(insert(Message), rows)
+    for turn in turns:
+        if turn.title is not None:
+            # only the placeholder is replaced, so a racing rename keeps the first title
+            await db.execute(
+                update(Chat).where(Chat.id == turn.chat_id, Chat.title == NEW_CHAT_TITLE).values(title=turn.title)
+            )
+    await db.commit()
+
+
+def to_json(turn: TurnRecord) -> str:
+    return json.dumps(
+        {"chat_id": turn.chat_id, "messages": turn.messages, "title": turn.title, "user_id": turn.user_id}
+    )
+
+
+def from_json(line: str) -> TurnRecord:
+    data = json.loads(line)
+    return TurnRecord(
+        data["chat_id"], tuple(tuple(m) for m in data["messages"]), data.get("title"), data.get("user_id")
+    )
+
+
+class MessageWriter:
+    """Write-behind queue for chat turns, flushed in batches by a background task.
+
+    A turn is queued and the response goes out without waiting on the database. Every
+    `flush_interval` seconds (sooner once `batch_size` turns are waiting) the queue is
+    written with `persist_turns`; a failed batch goes back to the front of the queue.
+    `stop()` drains the queue before shutdown, and whatever still cannot be written is
+    appended to `spill_path`, which the next `start()` replays. A hard crash loses at most
+    the turns of the current interval.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_pending: int = 5000,
+        spill_path: str | Path | None = None,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = Path(spill_path) if spill_path else None
+        self._queue: deque[TurnRecord] = deque()
+        # chats and users with queued turns, so their readers can wait for them
+        self._chats: Counter[int] = Counter()
+        self._users: Counter[int] = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def _enqueue(self, turn: TurnRecord) -> None:
+        self._queue.append(turn)
+        self._chats[turn.chat_id] += 1
+        if turn.user_id is not None:
+            self._users[turn.user_id] += 1
+
+    async def submit(self, turn: TurnRecord) -> None:
+        self._enqueue(turn)
+        if len(self._queue) >= self.max_pending:
+            # the database is falling behind: make the caller wait rather than grow without bound
+            await self.flush()
+        elif len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self) -> int:
+        """Write everything queued so far; returns the number of turns written."""
+        written = 0
+        async with self._flush_lock:
+            while self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                try:
+                    async with self.session_factory() as db:
+                        await persist_turns(db, batch)
+                except BaseException:
+                    self._queue.extendleft(reversed(batch))
+                    self.failed_flushes += 1
+                    raise
+                self._chats.subtract(turn.chat_id for turn in batch)
+                self._chats += Counter()
+                self._users.subtract(turn.user_id for turn in batch if turn.user_id is not None)
+                self._users += Counter()
+                written += len(batch)
+        self.flushed += written
+        return written
+
+    async def settle(self, chat_id: int | None = None, *, user_id: int | None = None) -> None:
+        """Flush now if this chat, or any chat of this user, has queued turns, so a read sees them."""
+        if not (self._chats.get(chat_id) or self._users.get(user_id)):
+            return
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush queued messages for chat %s / user %s", chat_id, user_id)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush queued messages; retrying")
+                await asyncio.sleep(min(5.0, self.flush_interval * 4))
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        await self.replay_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, attempts: int = 3) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(attempts):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                logger.exception("Failed to flush queued messages on shutdown (attempt %s)", attempt + 1)
+                await asyncio.sleep(0.5 * (attempt + 1))
+        self.spill()
+
+    def spill(self) -> None:
+        if not self._queue:
+            return
+        if self.spill_path is None:
+            logger.error("Dropping %s unwritten chat turns: no spill path configured", len(self._queue))
+            return
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            f.writelines(to_json(turn) + "\n" for turn in self._queue)
+            f.flush()
+            os.fsync(f.fileno())
+        logger.warning("Spilled %s unwritten chat turns to %s", len(self._queue), self.spill_path)
+        self._queue.clear()
+        self._chats.clear()
+        self._users.clear()
+
+    async def replay_spill(self) -> None:
+        if self.spill_path is None or not self.spill_path.exists():
+            return
+        # claim the file first so only one worker replays it
+        claimed = self.spill_path.with_name(f"{self.spill_path.name}.{os.getpid()}")
+        try:
+            os.replace(self.spill_path, claimed)
+        except FileNotFoundError:
+            return
+        turns = [from_json(line) for line in claimed.read_text(encoding="utf-8").splitlines() if line.strip()]
+        for turn in turns:
+            self._enqueue(turn)
+        # queued now: if the database is still down they are spilled again on shutdown
+        claimed.unlink()
+        logger.info("Replaying %s spilled chat turns from %s", len(turns), self.spill_path)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to write spilled chat turns; they stay queued")
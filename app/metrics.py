@@ -0,0 +1,445 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator
+
+import numpy as np
+from openai import APIError, APITimeoutError
+from sqlalchemy import bindparam, case, delete, distinct, event, func, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Chat, LogMetric, LogMetricRollup, Message, User
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in ms: ~10% apart from 0.05 ms to ~10 minutes.
+BUCKET_BOUNDS: list[float] = np.geomspace(0.05, 600_000, 172).tolist()
+PERCENTILES = (50, 95, 99)
+
+# key -> (label, unit, category, kind). Counters are per flush window and sum across rows;
+# gauges are point-in-time values; latency rows summarize one window of one stage.
+METRICS: dict[str, tuple[str, str, str, str]] = {
+    "http_requests": ("HTTP Requests", "count", "traffic", "counter"),
+    "total_logins": ("Logins", "count", "auth", "counter"),
+    "failed_logins": ("Failed Logins", "count", "auth", "counter"),
+    "active_users_24h": ("Active Users (24h)", "count", "usage", "gauge"),
+    "new_users_7d": ("New Users (7d)", "count", "usage", "gauge"),
+    "total_chats": ("Total Chats", "count", "chat", "gauge"),
+    "messages_24h": ("Messages (24h)", "count", "chat", "gauge"),
+    "avg_messages_per_chat": ("Avg Messages / Chat", "ratio", "chat", "gauge"),
+    "timeout_errors": ("Timeout Errors", "count", "errors", "counter"),
+    "db_errors": ("DB Errors", "count", "errors", "counter"),
+    "api_errors": ("API Errors", "count", "errors", "counter"),
+    "server_errors": ("HTTP 5xx Responses", "count", "errors", "counter"),
+    "retrieval_hits": ("Retrieval Hits", "count", "rag", "counter"),
+    "retrieval_misses": ("Retrieval Misses", "count", "rag", "counter"),
+    "context_chunks": ("Context Chunks", "count", "rag", "counter"),
+    "avg_context_chunks": ("Avg Context Chunks", "count", "rag", "gauge"),
+    "context_tokens_retrieved": ("Context Tokens Retrieved", "count", "rag", "counter"),
+    "context_tokens_packed": ("Context Tokens Sent", "count", "rag", "counter"),
+    "context_duplicates": ("Duplicate Passages Dropped", "count", "rag", "counter"),
+    "embedding_calls": ("Embedding Calls", "count", "openai", "counter"),
+    "embedding_cache_hits": ("Embedding Cache Hits", "count", "openai", "counter"),
+    "chat_completion_calls": ("Chat Completion Calls", "count", "openai", "counter"),
+    "answer_cache_hits": ("Answer Cache Hits", "count", "openai", "counter"),
+    "coalesced_requests": ("Coalesced OpenAI Requests", "count", "openai", "counter"),
+    "openai_cost_usd": ("OpenAI Cost", "usd", "openai", "counter"),
+    "token_input_total": ("Input Tokens", "count", "openai", "counter"),
+    "token_output_total": ("Output Tokens", "count", "openai", "counter"),
+}
+
+# stage -> label; each flushes avg_/p50_/p95_/p99_<stage>_ms plus a <stage>_count counter
+STAGES = {
+    "response": "Response Time",
+    "embedding": "Embedding",
+    "retrieval": "Retrieval",
+    "generation": "Generation",
+    "upstream_queue": "OpenAI Queue Wait",
+    "db": "DB Query",
+}
+
+
+def stage_metrics(stage: str) -> dict[str, tuple[str, str, str, str]]:
+    label = STAGES.get(stage, stage.replace("_", " ").title())
+    metrics = {f"avg_{stage}_ms": (f"Avg {label}", "ms", "latency", "latency")}
+    for p in PERCENTILES:
+        metrics[f"p{p}_{stage}_ms"] = (f"P{p} {label}", "ms", "latency", "latency")
+    metrics[f"{stage}_count"] = (f"{label} Samples", "count", "latency", "counter")
+    return metrics
+
+
+def metric_info(key: str) -> tuple[str, str, str, str]:
+    """(label, unit, category, kind) of a metric key, including per-stage latency keys."""
+    if key in METRICS:
+        return METRICS[key]
+    for stage in STAGES:
+        if (info := stage_metrics(stage).get(key)) is not None:
+            return info
+    return key, "count", "general", "counter"
+
+
+ROLLUP_RESOLUTIONS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1)}
+
+
+def bucket_start(moment: datetime, resolution: str) -> datetime:
+    if resolution == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def rollup_weight(key: str, values: dict[str, float]) -> float:
+    """Latency summaries are weighted by their stage's sample count, everything else counts once."""
+    if metric_info(key)[3] != "latency":
+        return 1.0
+    stage = key.split("_", 1)[1].removesuffix("_ms")
+    return float(values.get(f"{stage}_count") or 1.0)
+
+
+def elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+class Histogram:
+    """Fixed log-spaced buckets: constant memory per stage, percentiles accurate to a bucket (~10%)."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= target:
+                lower = BUCKET_BOUNDS[i - 1] if i else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(lower + (upper - lower) * (target - cumulative) / n, self.max)
+            cumulative += n
+        return self.max
+
+
+def error_metric(error: BaseException) -> str | None:
+    # database errors are counted where they happen, by the engine hook in instrument_engine
+    if isinstance(error, (APITimeoutError, TimeoutError)):
+        return "timeout_errors"
+    if isinstance(error, APIError):
+        return "api_errors"
+    return None
+
+
+def usage_gauges(db: Session, now: datetime) -> dict[str, float]:
+    """Point-in-time usage counts read from the chat tables."""
+    day, week = now - timedelta(days=1), now - timedelta(days=7)
+    total_chats = db.scalar(select(func.count()).select_from(Chat)) or 0
+    total_messages = db.scalar(select(func.count()).select_from(Message)) or 0
+    return {
+        "active_users_24h": db.scalar(
+            select(func.count(distinct(Chat.user_id))).join(Message, Message.chat_id == Chat.id).where(
+                Message.created_at >= day
+            )
+        )
+        or 0,
+        "new_users_7d": db.scalar(select(func.count()).select_from(User).where(User.created_at >= week)) or 0,
+        "total_chats": total_chats,
+        "messages_24h": db.scalar(select(func.count()).select_from(Message).where(Message.created_at >= day)) or 0,
+        "avg_messages_per_chat": total_messages / total_chats if total_chats else 0.0,
+    }
+
+
+def update_rollups(db: Session, values: dict[str, float], moment: datetime) -> None:
+    """Fold one window into its minute and hour buckets: update the keys that exist, insert the rest.
+
+    Two writers inserting the same new bucket hit the unique constraint; the caller retries.
+    """
+    table = LogMetricRollup.__table__
+    for resolution in ROLLUP_RESOLUTIONS:
+        start = bucket_start(moment, resolution)
+        existing = set(
+            db.scalars(
+                select(LogMetricRollup.metric_key).where(
+                    LogMetricRollup.resolution == resolution,
+                    LogMetricRollup.bucket_start == start,
+                    LogMetricRollup.metric_key.in_(list(values)),
+                )
+            )
+        )
+        updates, inserts = [], []
+        for key, value in values.items():
+            weight = rollup_weight(key, values)
+            if key in existing:
+                updates.append({"b_key": key, "b_samples": weight, "b_total": value * weight, "b_value": value})
+            else:
+                label, unit, category, _ = metric_info(key)
+                inserts.append(
+                    {
+                        "resolution": resolution,
+                        "bucket_start": start,
+                        "metric_key": key,
+                        "metric_label": label,
+                        "unit": unit,
+                        "category": category,
+                        "samples": weight,
+                        "total": value * weight,
+                        "max_value": value,
+                        "last_value": value,
+                    }
+                )
+        if updates:
+            db.execute(
+                update(table)
+                .where(
+                    table.c.resolution == resolution,
+                    table.c.bucket_start == start,
+                    table.c.metric_key == bindparam("b_key"),
+                )
+                .values(
+                    samples=table.c.samples + bindparam("b_samples"),
+                    total=table.c.total + bindparam("b_total"),
+                    max_value=case(
+                        (table.c.max_value < bindparam("b_value"), bindparam("b_value")), else_=table.c.max_value
+                    ),
+                    last_value=bindparam("b_value"),
+                ),
+                updates,
+            )
+        if inserts:
+            db.execute(insert(LogMetricRollup), inserts)
+
+
+def write_metrics(db: Session, values: dict[str, float], moment: datetime) -> int:
+    """Store one window as `LogMetric` rows and fold it into the rollups. The caller commits."""
+    rows = []
+    for key, value in values.items():
+        label, unit, category, _ = metric_info(key)
+        rows.append(
+            {
+                "metric_key": key,
+                "metric_label": label,
+                "metric_value": float(value),
+                "unit": unit,
+                "category": category,
+                "created_at": moment,
+            }
+        )
+    if rows:
+        db.execute(insert(LogMetric), rows)
+        update_rollups(db, values, moment)
+    return len(rows)
+
+
+def prune_rollups(db: Session, moment: datetime) -> None:
+    """Minute buckets are only kept for `metrics_minute_rollup_days`; hour buckets are kept."""
+    cutoff = moment - timedelta(days=settings.metrics_minute_rollup_days)
+    db.execute(
+        delete(LogMetricRollup).where(LogMetricRollup.resolution == "minute", LogMetricRollup.bucket_start < cutoff)
+    )
+
+
+class MetricsRecorder:
+    """In-memory counters and per-stage latency histograms, flushed as `LogMetric` rows.
+
+    Recording only takes a lock and bumps numbers. A background thread swaps out the
+    current window every `interval` seconds and writes it in one batch, so nothing on
+    the request path waits on the database. Each process flushes its own window.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: defaultdict[str, float] = defaultdict(float)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def observe(self, stage: str, ms: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(ms)
+
+    def incr(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counters[key] += amount
+
+    def record_error(self, error: BaseException) -> None:
+        if (key := error_metric(error)) is not None:
+            self.incr(key)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Time a block into the `stage` histogram and count the error it raises, if any."""
+        started = time.perf_counter()
+        try:
+            yield
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except BaseException as e:
+            self.record_error(e)
+            raise
+        finally:
+            self.observe(stage, elapsed_ms(started))
+
+    def record_call(self, kind: str, usage) -> None:
+        """Count one upstream OpenAI call ("embedding" or "chat") and its token usage and cost."""
+        input_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        output_tokens = getattr(usage, "completion_tokens", 0) or 0
+        if kind == "embedding":
+            cost = input_tokens * settings.openai_embedding_usd_per_1m
+        else:
+            cost = input_tokens * settings.openai_input_usd_per_1m + output_tokens * settings.openai_output_usd_per_1m
+        with self._lock:
+            self._counters["embedding_calls" if kind == "embedding" else "chat_completion_calls"] += 1
+            self._counters["token_input_total"] += input_tokens
+            self._counters["token_output_total"] += output_tokens
+            self._counters["openai_cost_usd"] += cost / 1_000_000
+
+    def record_retrieval(self, chunk_count: int) -> None:
+        with self._lock:
+            self._counters["retrieval_hits" if chunk_count else "retrieval_misses"] += 1
+            self._counters["context_chunks"] += chunk_count
+
+    def drain(self) -> tuple[dict[str, Histogram], dict[str, float]]:
+        """Take the current window and start a fresh one."""
+        with self._lock:
+            histograms, counters = self._histograms, dict(self._counters)
+            self._histograms, self._counters = {}, defaultdict(float)
+        return histograms, counters
+
+    def window_values(self, histograms: dict[str, Histogram], counters: dict[str, float]) -> dict[str, float]:
+        values = {key: value for key, value in counters.items() if value}
+        turns = counters.get("retrieval_hits", 0) + counters.get("retrieval_misses", 0)
+        if turns:
+            values["avg_context_chunks"] = counters.get("context_chunks", 0) / turns
+        for stage, histogram in histograms.items():
+            if not histogram.count:
+                continue
+            values[f"avg_{stage}_ms"] = histogram.total / histogram.count
+            for p in PERCENTILES:
+                values[f"p{p}_{stage}_ms"] = histogram.percentile(p)
+            values[f"{stage}_count"] = histogram.count
+        return values
+
+    def flush(self, session_factory: Callable[[], Session], gauges: bool = True) -> int:
+        """Write the current window (plus usage gauges) as one batch of `LogMetric` rows."""
+        values = self.window_values(*self.drain())
+        # naive UTC, like the server-side CURRENT_TIMESTAMP default
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        with session_factory() as db:
+            # keep the flusher's own queries out of the "db" histogram
+            db.connection(execution_options={"skip_metrics": True})
+            if gauges:
+                values.update(usage_gauges(db, now))
+            for attempt in range(2):
+                try:
+                    written = write_metrics(db, values, now)
+                    prune_rollups(db, now)
+                    db.commit()
+                    return written
+                except IntegrityError:
+                    # another worker created one of this window's buckets first; its keys now update
+                    db.rollback()
+                    db.connection(execution_options={"skip_metrics": True})
+                    if attempt:
+                        raise
+        return 0
+
+    def _run(self, session_factory: Callable[[], Session], interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.flush(session_factory)
+            except Exception:
+                # the window is dropped rather than retried, so a DB outage can't grow memory
+                logger.exception("Failed to flush metrics")
+
+    def start(self, session_factory: Callable[[], Session], interval: float) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(session_factory, interval), name="metrics-flush", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, session_factory: Callable[[], Session]) -> None:
+        """Stop the flush thread and write whatever the last window holds."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.flush(session_factory, gauges=False)
+        except Exception:
+            logger.exception("Failed to flush metrics on shutdown")
+
+
+metrics = MetricsRecorder()
+
+
+def instrument_engine(sync_engine: Engine, recorder: MetricsRecorder = metrics) -> None:
+    """Time every statement into the "db" histogram and count driver errors."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        if not context.execution_options.get("skip_metrics"):
+            recorder.observe("db", elapsed_ms(started))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def count_error(context):
+        if context.connection is not None and context.connection.info.get("metrics_started"):
+            context.connection.info["metrics_started"].pop()
+        recorder.incr("db_errors")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request until its last body chunk is sent, streams included."""
+
+    def __init__(self, app, recorder: MetricsRecorder = metrics):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/static"):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.recorder.observe("response", elapsed_ms(started))
+            self.recorder.incr("http_requests")
+            if status >= 500:
+                self.recorder.incr("server_errors")
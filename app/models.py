@@ -1,6 +1,18 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, Float, ForeignKey, Integer, String, Text, func
+from sqlalchemy import (
+    BigInteger,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    func,
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db import Base
@@ -20,6 +32,7 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (Index("ix_chats_user_id_updated_at_id", "user_id", "updated_at", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
@@ -33,6 +46,7 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id"), nullable=False, index=True)
@@ -43,16 +57,56 @@ class Message(Base):
     chat = relationship("Chat", back_populates="messages")
 
 
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id"), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    summarized_through_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     source: Mapped[str] = mapped_column(String(500), nullable=False, index=True)
+    chunk_index: Mapped[int | None] = mapped_column(Integer, nullable=True)
     chunk_text: Mapped[str] = mapped_column(Text, nullable=False)
-    embedding_json: Mapped[str] = mapped_column(Text, nullable=False)
+    # sha256 of chunk_text, used to reuse embeddings of unchanged chunks
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    start_offset: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    end_offset: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    token_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    embedding: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    embedding_dim: Mapped[int] = mapped_column(Integer, nullable=False)
+    embedding_dtype: Mapped[str] = mapped_column(String(16), nullable=False, default="float32")
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
 
+class IngestedFile(Base):
+    __tablename__ = "ingested_files"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    source: Mapped[str] = mapped_column(String(500), unique=True, nullable=False, index=True)
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    file_size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    mtime: Mapped[float] = mapped_column(Float, nullable=False)
+    chunk_params: Mapped[str] = mapped_column(String(255), nullable=False)
+    chunk_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # set by replace_file_chunks only, so touching an unchanged file keeps its ingest time
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class IndexState(Base):
+    __tablename__ = "index_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
 class LogMetric(Base):
     __tablename__ = "log_metrics"
 
@@ -63,3 +117,27 @@ class LogMetric(Base):
     unit: Mapped[str] = mapped_column(String(50), nullable=False, default="count")
     category: Mapped[str] = mapped_column(String(100), nullable=False, default="general")
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), index=True)
+
+
+class LogMetricRollup(Base):
+    """Per-minute and per-hour aggregates of `log_metrics`, kept up to date as metrics are flushed.
+
+    `total / samples` is the bucket's (weighted) mean, `last_value` its latest reading.
+    """
+
+    __tablename__ = "log_metric_rollups"
+    __table_args__ = (
+        UniqueConstraint("resolution", "bucket_start", "metric_key", name="uq_log_metric_rollups_bucket"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    resolution: Mapped[str] = mapped_column(String(10), nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    metric_key: Mapped[str] = mapped_column(String(100), nullable=False)
+    metric_label: Mapped[str] = mapped_column(String(255), nullable=False)
+    unit: Mapped[str] = mapped_column(String(50), nullable=False, default="count")
+    category: Mapped[str] = mapped_column(String(100), nullable=False, default="general")
+    samples: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    total: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    max_value: Mapped[float] = mapped_column(Float, nullable=False)
+    last_value: Mapped[float] = mapped_column(Float, nullable=False)
@@ -0,0 +1,52 @@
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, String, and_, literal, or_
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.types import TypeDecorator
+
+
+class CursorTimestamp(TypeDecorator):
+    """Binds a cursor timestamp in the same form the column stores it.
+
+    SQLite keeps datetimes as text and CURRENT_TIMESTAMP has no fractional part, so the
+    default ".000000" bind would sort after an equal stored value.
+    """
+
+    impl = DateTime
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(String())
+        return dialect.type_descriptor(DateTime())
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and dialect.name == "sqlite":
+            return value.isoformat(sep=" ", timespec="microseconds" if value.microsecond else "seconds")
+        return value
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+
+
+def older_than(timestamp_column, id_column, cursor: str) -> ColumnElement[bool]:
+    """Keyset predicate for rows strictly before `cursor` in (timestamp, id) descending order.
+
+    Spelled out with OR/AND because SQL Server has no row-value comparison.
+    """
+    timestamp, row_id = decode_cursor(cursor)
+    bound = literal(timestamp, type_=CursorTimestamp())
+    return or_(timestamp_column < bound, and_(timestamp_column == bound, id_column < row_id))
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+QUANTIZATIONS = ("none", "int8")
+COMPACT_CODES = ("none", "int8", "binary")
+
+
+def quantize_int8(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes, so that row ~= codes * scale. A quarter of float32 storage."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.empty(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Dot products of a float32 query with int8-coded rows."""
+    # einsum widens the codes a buffer at a time instead of materializing a float32 copy of them all;
+    # that keeps the scan's memory at a quarter of float32, but it is no faster than a float32 product
+    return np.einsum("ij,j->i", codes, query, dtype=np.float32, casting="unsafe") * scales
+
+
+def pack_binary(matrix: np.ndarray) -> np.ndarray:
+    """Sign bit of every value, packed into uint64 words per row: 1/32 of float32 storage."""
+    matrix = np.asarray(matrix)
+    words = -(-matrix.shape[1] // 64)
+    bits = np.zeros((len(matrix), words * 64), dtype=bool)
+    bits[:, : matrix.shape[1]] = matrix > 0
+    return np.packbits(bits, axis=1).view(np.uint64)
+
+
+def binary_scores(codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Sign bits each row shares with the query (bits minus Hamming distance); higher is closer."""
+    query_bits = pack_binary(query[None, :])[0]
+    distance = np.bitwise_count(codes ^ query_bits).sum(axis=1, dtype=np.int32)
+    return codes.shape[1] * 64 - distance
+
+
+@dataclass(frozen=True)
+class CompactCodes:
+    """Cheap stand-ins for a matrix's rows, scanned first so only a shortlist needs full-precision scoring."""
+
+    kind: str
+    codes: np.ndarray
+    # per-row scales of int8 codes
+    scales: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query: np.ndarray, rows: slice | np.ndarray = slice(None)) -> np.ndarray:
+        """Approximate similarity of a unit-length query to the given rows; only the order is meaningful."""
+        if self.kind == "int8":
+            return int8_scores(self.codes[rows], self.scales[rows], query)
+        return binary_scores(self.codes[rows], query)
+
+
+def compact_codes(matrix: np.ndarray, kind: str) -> CompactCodes | None:
+    if kind not in COMPACT_CODES:
+        raise ValueError(f"Unsupported compact codes: {kind!r}")
+    if kind == "int8":
+        return CompactCodes(kind, *quantize_int8(matrix))
+    if kind == "binary":
+        return CompactCodes(kind, pack_binary(matrix))
+    return None
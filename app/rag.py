@@ -1,45 +1,381 @@
+import hashlib
 import json
-from typing import Sequence
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Sequence
 
+import anyio
 import numpy as np
-from openai import OpenAI
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from app.answer_cache import SemanticAnswerCache
 from app.config import settings
+from app.context_packing import Passage, pack_context
+from app.embedding_cache import EmbeddingCache
+from app.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from app.metrics import metrics
 from app.models import DocumentChunk
+from app.tokens import count_tokens
+from app.upstream import SingleFlight, upstream
+from app.vector_index import RetrievalFilter, VectorIndex
+
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+def batch_for_embedding(texts: Sequence[str], max_inputs: int, max_tokens: int) -> list[list[str]]:
+    """Group texts into request-sized batches bounded by input count and total tokens."""
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text, settings.openai_embedding_model)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def retry_delay(attempt: int, error: Exception, base: float = 0.5, cap: float = 30.0) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), cap)
+        except ValueError:
+            pass
+    return min(cap, base * 2**attempt) * random.uniform(0.5, 1.0)
+
+
+def embedding_options() -> dict:
+    """Model, and the shortened `dimensions` when configured, for embeddings.create."""
+    options = {"model": settings.openai_embedding_model}
+    if settings.openai_embedding_dimensions:
+        options["dimensions"] = settings.openai_embedding_dimensions
+    return options
+
+
+def embedding_cache_model() -> str:
+    # shortened vectors are cached apart from full-size ones
+    dimensions = settings.openai_embedding_dimensions
+    return f"{settings.openai_embedding_model}@{dimensions}" if dimensions else settings.openai_embedding_model
+
+
+def request_key(*parts) -> str:
+    """Digest identifying an upstream request by everything that shapes its result."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def conversation_key(history: list[dict], summary: str | None) -> str:
+    """Digest of the prompt history and summary an answer depends on besides the question and context."""
+    return request_key([(m["role"], m["content"]) for m in history], summary)
+
+
+def default_embedding_cache() -> EmbeddingCache | None:
+    if not settings.embedding_cache_enabled:
+        return None
+    return EmbeddingCache(
+        max_entries=settings.embedding_cache_max_entries,
+        ttl_seconds=settings.embedding_cache_ttl_seconds,
+        path=settings.embedding_cache_path or None,
+        persistent_ttl_seconds=settings.embedding_cache_persistent_ttl_seconds,
+        persistent_max_entries=settings.embedding_cache_persistent_max_entries,
+    )
+
+
+class StageLatencies:
+    """Rolling per-stage retrieval latencies, reported by /api/stats/retrieval."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, timings: dict[str, float]) -> None:
+        with self._lock:
+            for stage, ms in timings.items():
+                self._samples.setdefault(stage, deque(maxlen=self.window)).append(ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = {stage: np.array(values) for stage, values in self._samples.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "mean_ms": round(float(values.mean()), 3),
+                "p50_ms": round(float(np.percentile(values, 50)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+            }
+            for stage, values in samples.items()
+        }
+
+
+def elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
 
 
 class RAGService:
-    def __init__(self):
-        if not settings.openai_api_key:
-            raise ValueError("OPENAI_API_KEY is not configured")
-        self.client = OpenAI(api_key=settings.openai_api_key)
-
-    def embed_text(self, text: str) -> list[float]:
-        response = self.client.embeddings.create(
-            model=settings.openai_embedding_model,
-            input=text,
+    def __init__(
+        self,
+        client: OpenAI | None = None,
+        async_client: AsyncOpenAI | None = None,
+        cache: EmbeddingCache | None = None,
+    ):
+        if client is None or async_client is None:
+            if not settings.openai_api_key:
+                raise ValueError("OPENAI_API_KEY is not configured")
+        base_url = settings.openai_base_url or None
+        self.client = client or OpenAI(api_key=settings.openai_api_key, base_url=base_url)
+        self.async_client = async_client or AsyncOpenAI(api_key=settings.openai_api_key, base_url=base_url)
+        self.cache = cache if cache is not None else default_embedding_cache()
+        self.answer_cache = (
+            SemanticAnswerCache(settings.answer_cache_similarity_threshold, settings.answer_cache_max_entries)
+            if settings.answer_cache_enabled
+            else None
         )
-        return response.data[0].embedding
+        self.index = VectorIndex()
+        self.lexical = LexicalIndex() if settings.rag_hybrid_enabled else None
+        self.retrieval_stats = StageLatencies()
+        self.in_flight = SingleFlight() if settings.openai_coalesce_requests else None
+
+    async def coalesced(self, key: str, call):
+        """Await `call()`, sharing it with any concurrent caller of the same key."""
+        if self.in_flight is None:
+            return await call()
+        return await self.in_flight.do(key, call)
+
+    async def aembed_text(self, text: str) -> list[float]:
+        if self.cache is not None and (cached := self.cache.get(embedding_cache_model(), text)) is not None:
+            metrics.incr("embedding_cache_hits")
+            return cached
+        return await self.coalesced(request_key("embedding", embedding_options(), text), lambda: self._aembed(text))
 
-    def find_relevant_chunks(self, db: Session, query_embedding: Sequence[float]) -> list[DocumentChunk]:
-        chunks = db.query(DocumentChunk).all()
-        if not chunks:
+    async def _aembed(self, text: str) -> list[float]:
+        async with upstream.slot():
+            with metrics.span("embedding"):
+                response = await self.async_client.embeddings.create(**embedding_options(), input=text)
+        metrics.record_call("embedding", response.usage)
+        embedding = response.data[0].embedding
+        if self.cache is not None:
+            self.cache.put(embedding_cache_model(), text, embedding)
+        return embedding
+
+    def embed_texts(self, texts: Sequence[str], concurrency: int = 1) -> list[list[float]]:
+        """Embed texts in token-bounded batches with at most `concurrency` requests in flight."""
+        batches = batch_for_embedding(texts, settings.embedding_batch_size, settings.embedding_batch_max_tokens)
+        if concurrency <= 1 or len(batches) <= 1:
+            return [embedding for batch in batches for embedding in self.embed_batch(batch)]
+        embeddings: list[list[float]] = []
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for batch_embeddings in pool.map(self.embed_batch, batches):
+                embeddings.extend(batch_embeddings)
+        return embeddings
+
+    def embed_batch(self, batch: list[str]) -> list[list[float]]:
+        model = embedding_cache_model()
+        embeddings = self.cache.get_many(model, batch) if self.cache is not None else [None] * len(batch)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+
+        inputs = [batch[i] for i in missing]
+        for attempt in range(settings.embedding_max_retries + 1):
+            try:
+                with metrics.span("embedding"):
+                    response = self.client.embeddings.create(**embedding_options(), input=inputs)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == settings.embedding_max_retries:
+                    raise
+                time.sleep(retry_delay(attempt, e))
+        metrics.record_call("embedding", response.usage)
+
+        fetched = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        if self.cache is not None:
+            self.cache.put_many(model, inputs, fetched)
+        for i, embedding in zip(missing, fetched):
+            embeddings[i] = embedding
+        return embeddings
+
+    def rank_chunks(
+        self,
+        query_text: str | None,
+        query_embedding: Sequence[float],
+        filters: RetrievalFilter | None = None,
+    ) -> tuple[list[int], dict]:
+        """Top chunk ids, fusing vector and BM25 rankings with RRF, plus per-stage timings in ms.
+
+        `filters` are resolved to the matching sources' chunks first, and both stages score
+        only those. On corpora of at least `rag_prefilter_min_chunks` the vector stage only
+        scores the BM25 shortlist, as long as that shortlist can fill `rag_top_k`.
+        """
+        top_k = settings.rag_top_k
+        pool = settings.rag_candidate_pool
+        timings: dict[str, float] = {}
+
+        allowed = None
+        scope = len(self.index)
+        if filters is not None:
+            started = time.perf_counter()
+            allowed = self.index.filter_ids(filters)
+            timings["filter_ms"] = elapsed_ms(started)
+            scope = len(allowed)
+            if not scope:
+                return [], timings
+        prefilter = scope >= settings.rag_prefilter_min_chunks
+
+        lexical: list[tuple[int, float]] = []
+        if self.lexical is not None and query_text:
+            shortlist = max(pool, settings.rag_prefilter_candidates) if prefilter else pool
+            started = time.perf_counter()
+            lexical = self.lexical.search(query_text, shortlist, allowed)
+            timings["bm25_ms"] = elapsed_ms(started)
+
+        candidates = None
+        if prefilter and len(lexical) >= top_k:
+            candidates = np.fromiter((chunk_id for chunk_id, _ in lexical), dtype=np.int64, count=len(lexical))
+        started = time.perf_counter()
+        vector = self.index.search(query_embedding, pool if lexical else top_k, candidates, filters)
+        timings["vector_ms"] = elapsed_ms(started)
+        if not lexical:
+            return [chunk_id for chunk_id, _ in vector], timings
+
+        started = time.perf_counter()
+        rankings = [[chunk_id for chunk_id, _ in vector], [chunk_id for chunk_id, _ in lexical[:pool]]]
+        ids = reciprocal_rank_fusion(rankings, settings.rag_rrf_k)[:top_k]
+        timings["fusion_ms"] = elapsed_ms(started)
+        return ids, timings
+
+    def find_relevant_chunks(
+        self,
+        db: Session,
+        query_embedding: Sequence[float],
+        query_text: str | None = None,
+        filters: RetrievalFilter | None = None,
+    ) -> list[DocumentChunk]:
+        with metrics.span("retrieval"):
+            chunks = self._find_relevant_chunks(db, query_embedding, query_text, filters)
+        metrics.record_retrieval(len(chunks))
+        return chunks
+
+    def _find_relevant_chunks(
+        self,
+        db: Session,
+        query_embedding: Sequence[float],
+        query_text: str | None,
+        filters: RetrievalFilter | None,
+    ) -> list[DocumentChunk]:
+        self.index.ensure_current(db)
+        if self.lexical is not None:
+            self.lexical.ensure_current(db)
+        ids, timings = self.rank_chunks(query_text, query_embedding, filters)
+        if not ids:
+            self.retrieval_stats.record(timings)
             return []
 
-        query_vec = np.array(query_embedding, dtype=np.float32)
-        scored: list[tuple[float, DocumentChunk]] = []
+        started = time.perf_counter()
+        rows = {c.id: c for c in db.query(DocumentChunk).filter(DocumentChunk.id.in_(ids)).all()}
+        timings["fetch_ms"] = elapsed_ms(started)
+        self.retrieval_stats.record(timings)
+        return [rows[chunk_id] for chunk_id in ids if chunk_id in rows]
 
-        for chunk in chunks:
-            chunk_vec = np.array(json.loads(chunk.embedding_json), dtype=np.float32)
-            denom = np.linalg.norm(query_vec) * np.linalg.norm(chunk_vec)
-            score = float(np.dot(query_vec, chunk_vec) / denom) if denom else 0.0
-            scored.append((score, chunk))
+    async def afind_relevant_chunks(
+        self,
+        db: AsyncSession,
+        query_embedding: Sequence[float],
+        query_text: str | None = None,
+        filters: RetrievalFilter | None = None,
+    ) -> list[DocumentChunk]:
+        with metrics.span("retrieval"):
+            chunks = await self._afind_relevant_chunks(db, query_embedding, query_text, filters)
+        metrics.record_retrieval(len(chunks))
+        return chunks
 
-        scored.sort(key=lambda value: value[0], reverse=True)
-        return [chunk for _, chunk in scored[: settings.rag_top_k]]
+    async def _afind_relevant_chunks(
+        self,
+        db: AsyncSession,
+        query_embedding: Sequence[float],
+        query_text: str | None,
+        filters: RetrievalFilter | None,
+    ) -> list[DocumentChunk]:
+        await self.index.aensure_current(db)
+        if self.lexical is not None:
+            await self.lexical.aensure_current(db)
+        # the matrix product releases the GIL, so keep scoring off the event loop
+        ids, timings = await anyio.to_thread.run_sync(self.rank_chunks, query_text, query_embedding, filters)
+        if not ids:
+            self.retrieval_stats.record(timings)
+            return []
 
-    def generate_answer(self, user_message: str, context_chunks: list[DocumentChunk], history: list[dict]) -> str:
+        started = time.perf_counter()
+        result = await db.execute(select(DocumentChunk).where(DocumentChunk.id.in_(ids)))
+        rows = {c.id: c for c in result.scalars()}
+        timings["fetch_ms"] = elapsed_ms(started)
+        self.retrieval_stats.record(timings)
+        return [rows[chunk_id] for chunk_id in ids if chunk_id in rows]
+
+    def cached_answer(
+        self,
+        query_embedding: Sequence[float],
+        context_chunks: list[DocumentChunk],
+        history: list[dict],
+        summary: str | None = None,
+    ) -> str | None:
+        if self.answer_cache is None:
+            return None
+        answer = self.answer_cache.lookup(
+            query_embedding, [c.id for c in context_chunks], conversation_key(history, summary), self.index.version
+        )
+        if answer is not None:
+            metrics.incr("answer_cache_hits")
+        return answer
+
+    def remember_answer(
+        self,
+        user_message: str,
+        query_embedding: Sequence[float],
+        context_chunks: list[DocumentChunk],
+        history: list[dict],
+        summary: str | None,
+        answer: str,
+    ) -> None:
+        if self.answer_cache is not None:
+            chunk_ids = [c.id for c in context_chunks]
+            conversation = conversation_key(history, summary)
+            self.answer_cache.store(user_message, query_embedding, chunk_ids, conversation, answer, self.index.version)
+
+    def assemble_context(self, context_chunks: list[DocumentChunk]) -> Sequence[DocumentChunk | Passage]:
+        """What the prompt carries of the retrieved chunks: packed passages, or the chunks as they are."""
+        if not settings.rag_context_packing:
+            return context_chunks
+        passages, stats = pack_context(
+            context_chunks,
+            settings.rag_context_token_budget,
+            settings.rag_context_duplicate_threshold,
+            settings.openai_chat_model,
+        )
+        metrics.incr("context_tokens_retrieved", stats.input_tokens)
+        metrics.incr("context_tokens_packed", stats.packed_tokens)
+        metrics.incr("context_duplicates", stats.duplicates)
+        return passages
+
+    def build_messages(
+        self,
+        user_message: str,
+        context_chunks: Sequence[DocumentChunk | Passage],
+        history: list[dict],
+        summary: str | None = None,
+    ) -> list[dict]:
         context = "\n\n".join([f"Source: {c.source}\n{c.chunk_text}" for c in context_chunks])
         system_prompt = (
             "You are a helpful enterprise assistant. Use provided context when relevant. "
@@ -47,6 +383,8 @@ class RAGService:
         )
 
         messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
         for msg in history:
             messages.append({"role": msg["role"], "content": msg["content"]})
 
@@ -62,9 +400,91 @@ class RAGService:
             }
         )
 
-        response = self.client.chat.completions.create(
-            model=settings.openai_chat_model,
-            messages=messages,
-            temperature=0.2,
-        )
+        return messages
+
+    async def agenerate_answer(
+        self,
+        user_message: str,
+        context_chunks: Sequence[DocumentChunk | Passage],
+        history: list[dict],
+        summary: str | None = None,
+    ) -> str:
+        messages = self.build_messages(user_message, context_chunks, history, summary)
+        key = request_key("chat", settings.openai_chat_model, 0.2, messages)
+        return await self.coalesced(key, lambda: self._agenerate(messages))
+
+    async def _agenerate(self, messages: list[dict]) -> str:
+        async with upstream.slot():
+            with metrics.span("generation"):
+                response = await self.async_client.chat.completions.create(
+                    model=settings.openai_chat_model,
+                    messages=messages,
+                    temperature=0.2,
+                )
+        metrics.record_call("chat", response.usage)
         return response.choices[0].message.content or "I could not generate a response."
+
+    async def astream_answer(
+        self,
+        user_message: str,
+        context_chunks: Sequence[DocumentChunk | Passage],
+        history: list[dict],
+        summary: str | None = None,
+    ) -> AsyncIterator[str]:
+        messages = self.build_messages(user_message, context_chunks, history, summary)
+        if self.in_flight is None:
+            deltas = self._astream(messages)
+        else:
+            # readers that join late get the deltas already produced, then follow along
+            key = request_key("chat-stream", settings.openai_chat_model, 0.2, messages)
+            deltas = self.in_flight.stream(key, lambda: self._astream(messages))
+        async for delta in deltas:
+            yield delta
+
+    async def _astream(self, messages: list[dict]) -> AsyncIterator[str]:
+        usage = None
+        async with upstream.slot():
+            with metrics.span("generation"):
+                stream = await self.async_client.chat.completions.create(
+                    model=settings.openai_chat_model,
+                    messages=messages,
+                    temperature=0.2,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                try:
+                    async for event in stream:
+                        usage = event.usage or usage
+                        if event.choices and event.choices[0].delta.content:
+                            yield event.choices[0].delta.content
+                finally:
+                    with anyio.CancelScope(shield=True):
+                        await stream.close()
+                    metrics.record_call("chat", usage)
+
+    async def asummarize_history(self, previous_summary: str | None, messages: list[dict]) -> str:
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        async with upstream.slot():
+            response = await self.async_client.chat.completions.create(
+                model=settings.openai_chat_model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Maintain a concise running summary of a conversation. Keep names, facts, "
+                            "decisions and open questions; drop pleasantries. Reply with the summary only."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": (
+                            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                            f"New messages:\n{transcript}\n\n"
+                            "Updated summary:"
+                        ),
+                    },
+                ],
+                temperature=0,
+            )
+        metrics.record_call("chat", response.usage)
+        return response.choices[0].message.content or previous_summary or ""
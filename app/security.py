@@ -1,5 +1,11 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
+from app.config import settings
+
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
@@ -10,3 +16,53 @@ def hash_password(password: str) -> str:
 
 def verify_password(plain_password: str, password_hash: str) -> bool:
     return pwd_context.verify(plain_password, password_hash)
+
+
+class PasswordPoolBusy(Exception):
+    """More password checks are queued than `password_hash_max_pending` allows."""
+
+
+class PasswordHasher:
+    """A small dedicated pool for password hashing, kept apart from the event loop and request threads.
+
+    pbkdf2 runs in hashlib with the GIL released, so `workers` threads hash in parallel while
+    the loop keeps serving chat traffic; a login burst queues here instead of occupying the
+    shared request thread pool. Beyond `max_pending` queued checks new ones fail fast.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 64):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        with self._lock:
+            if self.max_pending > 0 and self._pending >= self.max_pending:
+                raise PasswordPoolBusy()
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password")
+            future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def verify(self, plain_password: str, password_hash: str) -> bool:
+        return await self._submit(verify_password, plain_password, password_hash)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_pending)
@@ -0,0 +1,162 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from app.quantization import CompactCodes, compact_codes
+
+
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+
+
+@dataclass(frozen=True)
+class SnapshotPointer:
+    version: int
+    path: Path
+
+
+def current_snapshot(index_dir: str | Path) -> SnapshotPointer | None:
+    """The published snapshot, read from the one-line CURRENT file ("<version> <directory>")."""
+    index_dir = Path(index_dir)
+    try:
+        version, name = (index_dir / CURRENT_FILE).read_text().split()
+        return SnapshotPointer(int(version), index_dir / SNAPSHOTS_DIR / name)
+    except (OSError, ValueError):
+        return None
+
+
+def stage_snapshot(index_dir: str | Path) -> Path:
+    """A private directory to write a new snapshot into before it is published."""
+    root = Path(index_dir) / SNAPSHOTS_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(dir=root, prefix=".staging-"))
+
+
+def publish_snapshot(index_dir: str | Path, staging: Path, version: int, keep: int = 2) -> SnapshotPointer:
+    """Move a staged snapshot into place and repoint CURRENT with an atomic rename.
+
+    Workers still reading an older snapshot keep their memory maps: unlinked files stay
+    readable until the last mapping goes away.
+    """
+    index_dir = Path(index_dir)
+    staging.chmod(0o755)
+    target = staging.with_name(f"v{version:010d}-{uuid.uuid4().hex[:8]}")
+    staging.rename(target)
+
+    fd, tmp = tempfile.mkstemp(dir=index_dir, prefix=".CURRENT-")
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{version} {target.name}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, index_dir / CURRENT_FILE)
+
+    published = sorted(p for p in target.parent.iterdir() if p.is_dir() and p.name.startswith("v"))
+    for old in published[:-keep]:
+        if old != target:
+            shutil.rmtree(old, ignore_errors=True)
+    return SnapshotPointer(version, target)
+
+
+MATRIX_ARRAYS = ("matrix", "ids", "source_ids", "source_offsets", "sorted_ids", "id_order", "ingested_at")
+CODE_FILES = {"int8": ("codes_int8", "code_scales"), "binary": ("codes_binary",)}
+
+
+def group_by_source(
+    ids: np.ndarray,
+    matrix: np.ndarray,
+    sources: list[str],
+    ingested_at: dict[str, float],
+) -> tuple[dict[str, np.ndarray], list[str]]:
+    """Order rows by (source, id) so each source is one contiguous slice of the matrix.
+
+    Returns the row-aligned arrays plus the source names; `source_offsets[i]:source_offsets[i + 1]`
+    are the rows of source i, and `ingested_at[i]` its ingest time (epoch seconds, NaN if unknown).
+    """
+    names = sorted(set(sources))
+    codes = {name: i for i, name in enumerate(names)}
+    ids = np.asarray(ids, dtype=np.int64)
+    source_ids = np.fromiter((codes[s] for s in sources), dtype=np.int32, count=len(sources))
+    order = np.lexsort((ids, source_ids))
+    ids = ids[order]
+    source_ids = source_ids[order]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source_ids, minlength=len(names)), out=offsets[1:])
+    id_order = np.argsort(ids, kind="stable")
+    arrays = {
+        "matrix": np.ascontiguousarray(np.asarray(matrix, dtype=np.float32)[order]) if len(order) else matrix,
+        "ids": ids,
+        "source_ids": source_ids,
+        "source_offsets": offsets,
+        "sorted_ids": ids[id_order],
+        "id_order": id_order,
+        "ingested_at": np.array([ingested_at.get(name, np.nan) for name in names], dtype=np.float64),
+    }
+    return arrays, names
+
+
+def write_matrix(
+    directory: Path,
+    ids: np.ndarray,
+    matrix: np.ndarray,
+    sources: list[str],
+    ingested_at: dict[str, float],
+    codes: str = "none",
+) -> None:
+    """Unit-length float32 rows grouped by source, plus the id / source sidecar.
+
+    With `codes` ("int8" or "binary") compact codes of the same rows are saved too.
+    """
+    arrays, names = group_by_source(ids, matrix, sources, ingested_at)
+    for name, array in arrays.items():
+        np.save(directory / f"{name}.npy", array)
+    (directory / "sources.json").write_text(json.dumps(names))
+    compact = compact_codes(arrays["matrix"], codes) if len(arrays["ids"]) else None
+    if compact is not None:
+        for name, array in zip(CODE_FILES[codes], (compact.codes, compact.scales)):
+            np.save(directory / f"{name}.npy", array)
+
+
+def open_matrix(directory: Path) -> tuple[dict[str, np.ndarray], list[str]] | None:
+    """Read-only memory maps of a snapshot's matrix and sidecar, shared through the page cache."""
+    try:
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in MATRIX_ARRAYS}
+        return arrays, json.loads((directory / "sources.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def map_rows(path: Path) -> np.ndarray:
+    """Read-only memory map of a .npy matrix with readahead off, for reading a few scattered rows.
+
+    Looking up a row then pages in just that row instead of the file around it.
+    """
+    with path.open("rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_RANDOM"):
+        mapped.madvise(mmap.MADV_RANDOM)
+    return np.ndarray(shape, dtype, buffer=mapped, offset=offset, order="F" if fortran_order else "C")
+
+
+def open_codes(directory: Path, kind: str) -> CompactCodes | None:
+    """Memory-mapped compact codes of a snapshot, or None when it was written without them."""
+    if kind not in CODE_FILES:
+        return None
+    try:
+        arrays = [np.load(directory / f"{name}.npy", mmap_mode="r") for name in CODE_FILES[kind]]
+    except (OSError, ValueError):
+        return None
+    return CompactCodes(kind, *arrays)
@@ -0,0 +1,164 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+from app.config import settings
+from app.metrics import elapsed_ms, metrics
+
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` starts per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        # waiters queue on the lock, so they are let through in arrival order
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens, self._updated = 1.0, time.monotonic()
+            self._tokens -= 1
+
+
+class UpstreamGate:
+    """Caps OpenAI calls in flight and the rate they start at, for every caller in the process.
+
+    Time spent waiting for a slot is recorded as the `upstream_queue` stage.
+    """
+
+    def __init__(self, max_concurrency: int, rate: float = 0):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.limiter = RateLimiter(rate)
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        async with self._semaphore:
+            await self.limiter.acquire()
+            metrics.observe("upstream_queue", elapsed_ms(started))
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+
+@dataclass
+class Broadcast:
+    """Deltas of one upstream stream, replayed to every reader from the start."""
+
+    parts: list[str] = field(default_factory=list)
+    done: bool = False
+    error: BaseException | None = None
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+@dataclass
+class Flight:
+    task: asyncio.Task
+    # set for streamed calls
+    broadcast: Broadcast | None = None
+    waiters: int = 0
+
+
+async def pump(deltas: AsyncIterator[str], broadcast: Broadcast) -> None:
+    try:
+        async for delta in deltas:
+            broadcast.parts.append(delta)
+            broadcast.notify()
+    except BaseException as e:
+        broadcast.error = e
+        raise
+    finally:
+        broadcast.done = True
+        broadcast.notify()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight upstream call.
+
+    The call runs as its own task rather than inside the first caller, so a caller that
+    disconnects does not fail the others; the task is only cancelled once nobody is
+    waiting for it. An upstream error reaches every waiter, and the key is released as
+    soon as the call finishes, so the next caller starts a fresh one.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def _join(self, key: Hashable, start: Callable[[], Awaitable], broadcast: Broadcast | None = None) -> Flight:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(asyncio.ensure_future(start()), broadcast)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._release(key, flight))
+        else:
+            metrics.incr("coalesced_requests")
+        flight.waiters += 1
+        return flight
+
+    def _release(self, key: Hashable, flight: Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # stream readers get the error from the broadcast; mark it retrieved
+            flight.task.exception()
+
+    @staticmethod
+    def _leave(flight: Flight) -> None:
+        flight.waiters -= 1
+        if not flight.waiters and not flight.task.done():
+            flight.task.cancel()
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        flight = self._join(key, call)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    async def stream(self, key: Hashable, call: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        broadcast = Broadcast()
+        flight = self._join(key, lambda: pump(call(), broadcast), broadcast)
+        shared = flight.broadcast
+        try:
+            sent = 0
+            while True:
+                changed = shared.changed
+                while sent < len(shared.parts):
+                    yield shared.parts[sent]
+                    sent += 1
+                if shared.done:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                await changed.wait()
+        finally:
+            self._leave(flight)
+
+
+upstream = UpstreamGate(settings.openai_max_concurrency, settings.openai_max_requests_per_second)
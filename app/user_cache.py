@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import event
+
+from app.models import User
+
+
+@dataclass(frozen=True)
+class SessionUser:
+    """The fields requests need from a signed-in user, detached from any session."""
+
+    id: int
+    username: str
+    full_name: str | None = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "SessionUser":
+        return cls(id=user.id, username=user.username, full_name=user.full_name)
+
+
+class SessionUserCache:
+    """Bounded LRU of session users with a TTL, so authenticated requests skip the users lookup.
+
+    Changes made through the ORM in this process drop the entry right away; the TTL bounds
+    how long other workers can keep serving a changed or deleted user.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, tuple[float, SessionUser]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, user_id: int) -> SessionUser | None:
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or now - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: SessionUser) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic(), user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def invalidate_on_change(cache: SessionUserCache) -> None:
+    """Drop a user's entry whenever this process updates or deletes the row through the ORM."""
+
+    def forget(mapper, connection, target: User) -> None:
+        if target.id is not None:
+            cache.invalidate(target.id)
+
+    event.listen(User, "after_update", forget)
+    event.listen(User, "after_delete", forget)
@@ -0,0 +1,426 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePath
+from typing import Sequence
+
+import anyio
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.ann_index import IVFIndex, load_ivf
+from app.config import settings
+from app.db import SessionLocal
+from app.embeddings import decode_embedding, decode_embeddings
+from app.models import DocumentChunk, IndexState, IngestedFile
+from app.quantization import COMPACT_CODES, CompactCodes
+from app.snapshots import SnapshotPointer, current_snapshot, group_by_source, map_rows, open_codes, open_matrix
+
+
+INDEX_NAME = "document_chunks"
+# index_state row that is set while an ingest run is writing chunks
+INGEST_MARKER = "document_chunks:ingest"
+INDEX_MODES = ("exact", "ivf")
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow() -> datetime:
+    # naive, like the timestamps the models store
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_index_version(db: Session) -> int:
+    version = db.execute(select(IndexState.version).where(IndexState.name == INDEX_NAME)).scalar()
+    return int(version or 0)
+
+
+def ingest_running(db: Session) -> bool:
+    """Whether an ingest is writing chunks now: its marker is set and was refreshed recently."""
+    state = db.execute(
+        select(IndexState.version, IndexState.updated_at).where(IndexState.name == INGEST_MARKER)
+    ).first()
+    if state is None or not state.version or state.updated_at is None:
+        return False
+    # a run that was killed stops refreshing the marker and counts as ended once it goes quiet
+    return utcnow() - state.updated_at < timedelta(seconds=settings.ingest_heartbeat_timeout_seconds)
+
+
+def mark_ingest(db: Session, running: bool) -> None:
+    """Set (and refresh) or clear the ingest marker. Commit it with the surrounding transaction."""
+    state = db.query(IndexState).filter(IndexState.name == INGEST_MARKER).first()
+    if state is None:
+        state = IndexState(name=INGEST_MARKER, version=0)
+        db.add(state)
+    state.version = int(running)
+    # set here rather than by the database, so every host compares it against its own UTC clock
+    state.updated_at = utcnow()
+
+
+def live_version(db: Session, index_dir: str | Path) -> int:
+    """The version to serve: the database's, which the published snapshot normally matches.
+
+    While an ingest is writing, the database runs ahead of the snapshot and the snapshot
+    keeps being served until the run publishes its own. A snapshot still behind once no
+    ingest is running (the run failed before publishing, or a migration bumped the version)
+    is not served; `refresh` then loads from the database.
+    """
+    pointer = current_snapshot(index_dir)
+    version = get_index_version(db)
+    if pointer is None:
+        return version
+    if pointer.version < version and ingest_running(db):
+        return pointer.version
+    return max(pointer.version, version)
+
+
+async def alive_version(db: AsyncSession, index_dir: str | Path) -> int:
+    return await db.run_sync(live_version, index_dir)
+
+
+def bump_index_version(db: Session) -> int:
+    """Mark the chunk table as changed. Call inside the transaction that changes it."""
+    state = db.query(IndexState).filter(IndexState.name == INDEX_NAME).first()
+    if state is None:
+        state = IndexState(name=INDEX_NAME, version=0)
+        db.add(state)
+    state.version = (state.version or 0) + 1
+    return state.version
+
+
+def decode_rows(rows) -> np.ndarray:
+    dim, dtype = rows[0].embedding_dim, rows[0].embedding_dtype
+    if all(row.embedding_dim == dim and row.embedding_dtype == dtype for row in rows):
+        return decode_embeddings([row.embedding for row in rows], dim, dtype)
+    return np.vstack(
+        [decode_embedding(row.embedding, row.embedding_dim, row.embedding_dtype) for row in rows]
+    ).astype(np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def load_matrix(db: Session, batch_size: int = 10_000) -> tuple[np.ndarray, np.ndarray]:
+    """Chunk ids (ascending) and their unit-length embeddings, decoded batch by batch."""
+    columns = (DocumentChunk.id, DocumentChunk.embedding, DocumentChunk.embedding_dim, DocumentChunk.embedding_dtype)
+    ids: list[np.ndarray] = []
+    blocks: list[np.ndarray] = []
+    last_id = None
+    while True:
+        query = select(*columns).order_by(DocumentChunk.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(DocumentChunk.id > last_id)
+        rows = db.execute(query).all()
+        if not rows:
+            break
+        ids.append(np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows)))
+        blocks.append(np.ascontiguousarray(normalize_rows(decode_rows(rows)), dtype=np.float32))
+        last_id = rows[-1].id
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(ids), np.vstack(blocks)
+
+
+def load_sources(db: Session) -> list[str]:
+    return list(db.execute(select(DocumentChunk.source).order_by(DocumentChunk.id)).scalars())
+
+
+def epoch_seconds(value: datetime) -> float:
+    # naive timestamps are stored in UTC
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def load_ingested_at(db: Session) -> dict[str, float]:
+    """Ingest time of each source file, as epoch seconds."""
+    rows = db.execute(select(IngestedFile.source, IngestedFile.ingested_at))
+    return {source: epoch_seconds(ingested_at) for source, ingested_at in rows if ingested_at is not None}
+
+
+def source_keys(source: str) -> tuple[str, ...]:
+    source = source.casefold()
+    name = PurePath(source).name
+    return (source,) if name == source else (source, name)
+
+
+@dataclass(frozen=True)
+class RetrievalFilter:
+    """Restricts retrieval to some sources before any scoring happens.
+
+    `sources` are paths, file names or case-insensitive glob patterns over either; the ingest window is
+    `ingested_after <= ingested_at < ingested_before`. Sources with no recorded ingest
+    time never match a date bound.
+    """
+
+    sources: tuple[str, ...] = ()
+    ingested_after: datetime | None = None
+    ingested_before: datetime | None = None
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """Embedding rows grouped by source: source i owns rows source_offsets[i]:source_offsets[i + 1]."""
+
+    version: int
+    matrix: np.ndarray
+    ids: np.ndarray
+    # per-row index into source_names
+    source_ids: np.ndarray
+    source_names: list[str]
+    source_offsets: np.ndarray
+    # per-source ingest time, epoch seconds (NaN when unknown)
+    ingested_at: np.ndarray
+    # ids sorted, and their rows, for looking up an explicit candidate set
+    sorted_ids: np.ndarray
+    id_order: np.ndarray
+    ann: IVFIndex | None = None
+    # int8 / binary codes of the rows, scanned before full-precision rescoring
+    codes: CompactCodes | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows_for_ids(self, candidate_ids: np.ndarray) -> np.ndarray:
+        """Rows of the given chunk ids, ascending; ids not in this snapshot are dropped."""
+        found = np.searchsorted(self.sorted_ids, candidate_ids)
+        present = found < len(self.sorted_ids)
+        found = found[present]
+        found = found[self.sorted_ids[found] == candidate_ids[present]]
+        return np.sort(self.id_order[found])
+
+    def matching_sources(self, filters: RetrievalFilter) -> np.ndarray:
+        codes = np.arange(len(self.source_names))
+        if filters.sources:
+            patterns = [pattern.casefold() for pattern in filters.sources]
+            # a pattern may name the stored path or just the file name
+            keep = [
+                i
+                for i, name in enumerate(self.source_names)
+                if any(fnmatchcase(candidate, p) for candidate in source_keys(name) for p in patterns)
+            ]
+            codes = np.array(keep, dtype=np.int64)
+        # NaN compares false, so sources without an ingest time drop out here
+        if filters.ingested_after is not None:
+            codes = codes[self.ingested_at[codes] >= epoch_seconds(filters.ingested_after)]
+        if filters.ingested_before is not None:
+            codes = codes[self.ingested_at[codes] < epoch_seconds(filters.ingested_before)]
+        return codes
+
+    def filter_rows(self, filters: RetrievalFilter) -> np.ndarray:
+        """Rows of the matching sources, read straight off the per-source offset map."""
+        slices = [
+            np.arange(self.source_offsets[code], self.source_offsets[code + 1]) for code in self.matching_sources(filters)
+        ]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+
+EMPTY_SNAPSHOT = IndexSnapshot(
+    version=-1,
+    matrix=np.empty((0, 0), dtype=np.float32),
+    ids=np.empty(0, dtype=np.int64),
+    source_ids=np.empty(0, dtype=np.int32),
+    source_names=[],
+    source_offsets=np.zeros(1, dtype=np.int64),
+    ingested_at=np.empty(0, dtype=np.float64),
+    sorted_ids=np.empty(0, dtype=np.int64),
+    id_order=np.empty(0, dtype=np.int64),
+)
+
+
+class VectorIndex:
+    """Process-wide, pre-normalized embedding matrix for `document_chunks`.
+
+    When ingestion has published a snapshot under `index_dir`, its matrix is
+    memory-mapped read-only, so every worker shares one page-cache copy, and a new
+    CURRENT pointer is picked up on the next request. Without a snapshot, or while it
+    is behind the `index_state` version, the matrix is loaded from the database.
+
+    In "ivf" mode the snapshot's ANN index is searched instead of the full matrix.
+    With compact `codes` the exact mode scans the snapshot's int8 or binary codes first and
+    rescores only the best `rescore_candidates` rows, reading just those pages of the mapped
+    matrix. Codes are only ever mapped from a snapshot; a matrix loaded from the database is
+    scanned at full precision.
+    Rows are grouped by source, so a `RetrievalFilter` narrows the scan to the
+    matching sources' slices before anything is scored.
+    """
+
+    def __init__(
+        self,
+        mode: str | None = None,
+        index_dir: str | Path | None = None,
+        codes: str | None = None,
+        rescore_candidates: int | None = None,
+    ):
+        self.mode = mode or settings.rag_index_mode
+        if self.mode not in INDEX_MODES:
+            raise ValueError(f"Unsupported index mode: {self.mode!r}")
+        self.codes = codes or settings.rag_compact_codes
+        if self.codes not in COMPACT_CODES:
+            raise ValueError(f"Unsupported compact codes: {self.codes!r}")
+        self.rescore_candidates = rescore_candidates or settings.rag_rescore_candidates
+        self.index_dir = Path(index_dir or settings.index_dir)
+        self._lock = threading.Lock()
+        # Async callers must not block the event loop on the thread lock while
+        # another coroutine holds it across awaited DB I/O.
+        self._async_lock = asyncio.Lock()
+        self._snapshot = EMPTY_SNAPSHOT
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        index_dir: str | Path,
+        mode: str | None = None,
+        codes: str | None = None,
+        rescore_candidates: int | None = None,
+    ) -> "VectorIndex":
+        """An index over the snapshot currently published in `index_dir`, opened without a database."""
+        index = cls(mode, index_dir, codes, rescore_candidates)
+        pointer = current_snapshot(index.index_dir)
+        snapshot = index.open_snapshot(pointer) if pointer is not None else None
+        if snapshot is None:
+            raise FileNotFoundError(f"No readable index snapshot in {index.index_dir}")
+        index._snapshot = snapshot
+        return index
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def ensure_current(self, db: Session) -> IndexSnapshot:
+        version = live_version(db, self.index_dir)
+        if version != self._snapshot.version:
+            with self._lock:
+                if version != self._snapshot.version:
+                    self.refresh(db, version)
+        return self._snapshot
+
+    async def aensure_current(self, db: AsyncSession) -> IndexSnapshot:
+        version = await alive_version(db, self.index_dir)
+        if version != self._snapshot.version:
+            async with self._async_lock:
+                if version != self._snapshot.version:
+                    # a reload from the database takes seconds on a large corpus; keep it off the event loop
+                    await anyio.to_thread.run_sync(self.reload, version)
+        return self._snapshot
+
+    def reload(self, version: int) -> None:
+        """`refresh` with its own session, for callers that are not holding a sync one."""
+        with self._lock, SessionLocal() as db:
+            if version != self._snapshot.version:
+                self.refresh(db, version)
+
+    def refresh(self, db: Session, version: int) -> None:
+        pointer = current_snapshot(self.index_dir)
+        snapshot = self.open_snapshot(pointer) if pointer is not None and pointer.version == version else None
+        if snapshot is None:
+            if pointer is not None and pointer.version < version:
+                logger.warning(
+                    "Index snapshot v%s is behind the database (v%s); loading from the database until republished",
+                    pointer.version,
+                    version,
+                )
+            elif self.mode == "ivf":
+                logger.warning("No index snapshot for version %s in %s; using exact search", version, self.index_dir)
+            self._snapshot = self._load(db, version)
+            return
+        self._snapshot = snapshot
+
+    def open_snapshot(self, pointer: SnapshotPointer) -> IndexSnapshot | None:
+        """The snapshot `pointer` names, memory-mapped; None when it cannot be read."""
+        opened = open_matrix(pointer.path)
+        if opened is None:
+            return None
+        arrays, source_names = opened
+        ann = load_ivf(pointer.path) if self.mode == "ivf" else None
+        if self.mode == "ivf" and ann is None:
+            logger.warning("Snapshot %s has no IVF index; using exact search", pointer.path)
+        codes = open_codes(pointer.path, self.codes) if ann is None else None
+        if ann is None and codes is None and self.codes != "none" and len(arrays["ids"]):
+            # codes built here would be a private copy in every worker, on top of the shared rows
+            logger.warning("Snapshot %s has no %s codes; scanning full-precision rows", pointer.path, self.codes)
+        if codes is not None:
+            # the codes take the full scan; the matrix is only read for each query's shortlist
+            arrays["matrix"] = map_rows(pointer.path / "matrix.npy")
+        return IndexSnapshot(version=pointer.version, source_names=source_names, ann=ann, codes=codes, **arrays)
+
+    def _load(self, db: Session, version: int) -> IndexSnapshot:
+        ids, matrix = load_matrix(db)
+        arrays, source_names = group_by_source(ids, matrix, load_sources(db), load_ingested_at(db))
+        # no compact codes here: with the float32 rows already in memory they would only add to it
+        return IndexSnapshot(version=version, source_names=source_names, **arrays)
+
+    def filter_ids(self, filters: RetrievalFilter) -> np.ndarray:
+        """Chunk ids (ascending) of the sources a filter keeps."""
+        snapshot = self._snapshot
+        return np.sort(snapshot.ids[snapshot.filter_rows(filters)])
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int,
+        candidate_ids: np.ndarray | None = None,
+        filters: RetrievalFilter | None = None,
+    ) -> list[tuple[int, float]]:
+        """Top-k chunks by cosine similarity, scoring only `candidate_ids` or the sources `filters` keeps.
+
+        Candidates are assumed to have been filtered already.
+        """
+        snapshot = self._snapshot
+        if not len(snapshot) or top_k <= 0:
+            return []
+
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vec)
+        if not norm:
+            return []
+
+        rows = None
+        if candidate_ids is not None:
+            rows = snapshot.rows_for_ids(candidate_ids)
+        elif filters is not None:
+            rows = snapshot.filter_rows(filters)
+        if rows is not None and not len(rows):
+            return []
+        if snapshot.ann is not None:
+            return snapshot.ann.search(
+                query_vec / norm, top_k, settings.ivf_probes, None if rows is None else snapshot.ids[rows]
+            )
+
+        query_vec = query_vec / norm
+        if rows is None:
+            scope = slice(None)
+        elif len(rows) == rows[-1] - rows[0] + 1:
+            # a single source (or adjacent ones) is one contiguous slice: no gather needed
+            scope = slice(rows[0], rows[-1] + 1)
+        else:
+            scope = rows
+
+        # `rows` maps score positions back to matrix rows (None: they are the same)
+        pool = max(top_k, self.rescore_candidates)
+        if snapshot.codes is not None and (len(snapshot) if rows is None else len(rows)) > pool:
+            # first pass over the compact codes; only the shortlist is read at full precision
+            shortlist = np.argpartition(snapshot.codes.scores(query_vec, scope), -pool)[-pool:]
+            rows = np.sort(shortlist if rows is None else rows[shortlist])
+            scores = snapshot.matrix[rows] @ query_vec
+        else:
+            scores = snapshot.matrix[scope] @ query_vec
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        positions = top if rows is None else rows[top]
+        return [(int(snapshot.ids[p]), float(scores[i])) for p, i in zip(positions, top)]
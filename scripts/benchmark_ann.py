@@ -0,0 +1,98 @@
+"""Recall@k and latency of the IVF index against exact search on a synthetic corpus.
+
+    python -m scripts.benchmark_ann --rows 200000 --dim 256 --queries 200 --probes 1 4 8 16 32
+"""
+
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from app.ann_index import build_ivf, load_ivf, normalize, save_ivf
+
+
+def synthetic_corpus(rows: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random topic centres, which is closer to real embeddings than pure noise."""
+    rng = np.random.default_rng(seed)
+    centres = normalize(rng.standard_normal((clusters, dim)))
+    labels = rng.integers(0, clusters, size=rows)
+    noise = rng.standard_normal((rows, dim)).astype(np.float32) * (1.4 / np.sqrt(dim))
+    return normalize(centres[labels] + noise)
+
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = matrix @ query
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def latency_summary(seconds: list[float]) -> dict:
+    ms = np.array(seconds) * 1000
+    return {"mean_ms": round(float(ms.mean()), 3), "p95_ms": round(float(np.percentile(ms, 95)), 3)}
+
+
+def run(rows: int, dim: int, clusters: int, queries: int, top_k: int, probes: list[int], lists: int | None) -> dict:
+    matrix = synthetic_corpus(rows, dim, clusters)
+    ids = np.arange(1, rows + 1, dtype=np.int64)
+    rng = np.random.default_rng(1)
+    # queries are perturbed corpus rows, so each has genuine near neighbours
+    picks = rng.choice(rows, queries, replace=False)
+    query_matrix = normalize(matrix[picks] + 0.05 * rng.standard_normal((queries, dim)).astype(np.float32))
+
+    exact_times, truth = [], []
+    for query in query_matrix:
+        started = time.perf_counter()
+        truth.append(set((ids[exact_top_k(matrix, query, top_k)]).tolist()))
+        exact_times.append(time.perf_counter() - started)
+
+    results = {
+        "rows": rows,
+        "dim": dim,
+        "queries": queries,
+        "top_k": top_k,
+        "exact": latency_summary(exact_times),
+        "ivf": [],
+    }
+    for quantization in ("none", "int8"):
+        started = time.perf_counter()
+        built = build_ivf(1, ids, matrix, lists, quantization)
+        build_seconds = time.perf_counter() - started
+        with tempfile.TemporaryDirectory() as tmp:
+            save_ivf(built, tmp)
+            index = load_ivf(tmp)
+            for probe_count in probes:
+                times, recalls = [], []
+                for query, expected in zip(query_matrix, truth):
+                    started = time.perf_counter()
+                    hits = index.search(query, top_k, probe_count)
+                    times.append(time.perf_counter() - started)
+                    recalls.append(len(expected & {chunk_id for chunk_id, _ in hits}) / top_k)
+                results["ivf"].append(
+                    {
+                        "quantization": quantization,
+                        "lists": len(index.centroids),
+                        "probes": probe_count,
+                        "build_s": round(build_seconds, 2),
+                        f"recall@{top_k}": round(float(np.mean(recalls)), 4),
+                        **latency_summary(times),
+                    }
+                )
+            del index
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall and latency against exact search.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=500, help="Topic centres in the synthetic corpus.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=None, help="Inverted lists (default: about 4 * sqrt(rows)).")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.rows, args.dim, args.clusters, args.queries, args.top_k, args.probes, args.lists), indent=2))
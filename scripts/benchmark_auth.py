@@ -0,0 +1,120 @@
+"""Login throughput and per-request authentication overhead against a running app.
+
+    uvicorn app.main:app --port 8000
+    python -m scripts.benchmark_auth --username admin --password ... --concurrency 32
+
+Run it again with USER_CACHE_TTL_SECONDS=0 on the app to see the cost of the users lookup,
+or with a different PASSWORD_HASH_WORKERS to see how logins and other traffic trade off.
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+
+from scripts.load_test_chat import percentile
+
+
+def summary(latencies: list[float]) -> dict:
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> int:
+    response = await client.post("/api/login", data={"username": username, "password": password})
+    return response.status_code
+
+
+async def bench_logins(base_url: str, username: str, password: str, concurrency: int, total: int) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    remaining = iter(range(total))
+
+    async def worker() -> None:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            for _ in remaining:
+                started = time.perf_counter()
+                status = await login(client, username, password)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "logins_per_s": round(statuses.get(200, 0) / elapsed, 1),
+        "statuses": statuses,
+        **summary(latencies),
+    }
+
+
+async def timed_gets(client: httpx.AsyncClient, path: str, count: int) -> list[float]:
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await client.get(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def bench_overhead(base_url: str, username: str, password: str, requests: int) -> dict:
+    """`/api/me` signed in versus signed out: the difference is the session user lookup."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as anonymous:
+        await timed_gets(anonymous, "/api/me", 20)
+        unauthenticated = await timed_gets(anonymous, "/api/me", requests)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        if await login(client, username, password) != 200:
+            raise SystemExit("Login failed; check --username / --password")
+        await timed_gets(client, "/api/me", 20)
+        authenticated = await timed_gets(client, "/api/me", requests)
+        users = (await client.get("/api/stats/cache")).json().get("users")
+    return {
+        "unauthenticated": summary(unauthenticated),
+        "authenticated": summary(authenticated),
+        "overhead_p50_ms": round(percentile(authenticated, 50) - percentile(unauthenticated, 50), 2),
+        "user_cache": users,
+    }
+
+
+async def bench_under_logins(base_url: str, username: str, password: str, concurrency: int, requests: int) -> dict:
+    """Latency of ordinary authenticated requests while a login burst is hashing passwords."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await login(client, username, password)
+        idle = await timed_gets(client, "/api/chats?limit=1", requests)
+        storm = asyncio.create_task(bench_logins(base_url, username, password, concurrency, concurrency * 4))
+        busy = await timed_gets(client, "/api/chats?limit=1", requests)
+        logins = await storm
+    return {"idle": summary(idle), "during_logins": summary(busy), "logins": logins}
+
+
+async def run(base_url: str, username: str, password: str, concurrency: int, logins: int, requests: int) -> dict:
+    return {
+        "logins": await bench_logins(base_url, username, password, concurrency, logins),
+        "auth_overhead": await bench_overhead(base_url, username, password, requests),
+        "requests_under_logins": await bench_under_logins(base_url, username, password, concurrency, requests),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark logins and authenticated request overhead.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(args.base_url, args.username, args.password, args.concurrency, args.logins, args.requests)
+    )
+    print(json.dumps(result, indent=2))
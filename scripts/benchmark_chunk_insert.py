@@ -0,0 +1,98 @@
+"""Compare the ORM and bulk write paths for DocumentChunk rows on a scratch SQLite file.
+
+    python -m scripts.benchmark_chunk_insert --rows 20000 --dim 1536 --batch-size 1000
+"""
+
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from app.chunking import Chunk
+from app.db import Base, configure_sqlite
+from app.embeddings import encode_embedding
+from app.models import DocumentChunk
+from scripts.ingest_data import chunk_rows, insert_chunks
+
+
+def synthetic_files(rows: int, dim: int, chunks_per_file: int) -> Iterator[tuple[str, list[Chunk], np.ndarray]]:
+    rng = np.random.default_rng(0)
+    text = "lorem ipsum dolor sit amet " * 37
+    for start in range(0, rows, chunks_per_file):
+        count = min(chunks_per_file, rows - start)
+        chunks = [Chunk(f"{text}{start + i}", 0, len(text), 250) for i in range(count)]
+        yield f"data/file_{start // chunks_per_file:06d}.pdf", chunks, rng.standard_normal((count, dim))
+
+
+def orm_path(db: Session, files, batch_size: int) -> None:
+    """The previous behaviour: one ORM object per chunk and a single commit at the end."""
+    for source, chunks, embeddings in files:
+        for chunk, emb in zip(chunks, embeddings):
+            db.add(
+                DocumentChunk(
+                    source=source,
+                    chunk_text=chunk.text,
+                    embedding=encode_embedding(emb),
+                    embedding_dim=len(emb),
+                    embedding_dtype="float32",
+                )
+            )
+    db.commit()
+
+
+def bulk_path(db: Session, files, batch_size: int) -> None:
+    pending = 0
+    for source, chunks, embeddings in files:
+        insert_chunks(db, chunk_rows(source, chunks, embeddings), batch_size)
+        pending += len(chunks)
+        if pending >= batch_size:
+            db.commit()
+            pending = 0
+    db.commit()
+
+
+def run(name: str, write, rows: int, dim: int, chunks_per_file: int, batch_size: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        configure_sqlite(engine)
+        Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            write(db, synthetic_files(rows, dim, chunks_per_file), batch_size)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stored = db.scalar(select(func.count()).select_from(DocumentChunk))
+        engine.dispose()
+
+    return {
+        "path": name,
+        "rows": stored,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1),
+        "peak_traced_mb": round(peak / 2**20, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark ORM vs bulk inserts of document chunks on SQLite.")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--chunks-per-file", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    results = [
+        run(name, write, args.rows, args.dim, args.chunks_per_file, args.batch_size)
+        for name, write in (("orm", orm_path), ("bulk", bulk_path))
+    ]
+    print(json.dumps(results, indent=2))
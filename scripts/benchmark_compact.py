@@ -0,0 +1,77 @@
+"""Recall@k, latency and memory of compact-code search (int8 / binary + rescoring) against exact search.
+
+    python -m scripts.benchmark_compact --rows 200000 --dim 512 --queries 200 --rescore 50 200 1000
+
+Each configuration searches a published snapshot through `VectorIndex`, exactly as the app does.
+"""
+
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from app.ann_index import normalize
+from app.snapshots import publish_snapshot, stage_snapshot, write_matrix
+from app.vector_index import VectorIndex
+from scripts.benchmark_ann import exact_top_k, latency_summary, synthetic_corpus
+
+
+def publish(index_dir: str, ids: np.ndarray, matrix: np.ndarray, sources: int, codes: str) -> None:
+    names = [f"doc{i % sources}.md" for i in range(len(ids))]
+    staging = stage_snapshot(index_dir)
+    write_matrix(staging, ids, matrix, names, {}, codes)
+    publish_snapshot(index_dir, staging, 1)
+
+
+def run(rows: int, dim: int, clusters: int, queries: int, top_k: int, rescore: list[int], codes: list[str]) -> dict:
+    matrix = synthetic_corpus(rows, dim, clusters)
+    ids = np.arange(1, rows + 1, dtype=np.int64)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(rows, queries, replace=False)
+    query_matrix = normalize(matrix[picks] + 0.05 * rng.standard_normal((queries, dim)).astype(np.float32))
+    truth = [set(ids[exact_top_k(matrix, query, top_k)].tolist()) for query in query_matrix]
+
+    results = {"rows": rows, "dim": dim, "queries": queries, "top_k": top_k, "runs": []}
+    for kind in ["none", *codes]:
+        with tempfile.TemporaryDirectory() as tmp:
+            publish(tmp, ids, matrix, 50, kind)
+            for pool in rescore if kind != "none" else [0]:
+                index = VectorIndex.from_snapshot(tmp, mode="exact", codes=kind, rescore_candidates=pool or None)
+                snapshot = index.snapshot
+                index.search(query_matrix[0], top_k)
+                times, recalls = [], []
+                for query, expected in zip(query_matrix, truth):
+                    started = time.perf_counter()
+                    hits = index.search(query, top_k)
+                    times.append(time.perf_counter() - started)
+                    recalls.append(len(expected & {chunk_id for chunk_id, _ in hits}) / top_k)
+                results["runs"].append(
+                    {
+                        "codes": kind,
+                        "rescore": pool or None,
+                        # bytes read per query by the first pass
+                        "scan_mb": round((snapshot.codes.nbytes if snapshot.codes else matrix.nbytes) / 2**20, 2),
+                        f"recall@{top_k}": round(float(np.mean(recalls)), 4),
+                        **latency_summary(times),
+                    }
+                )
+                del index, snapshot
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark compact-code search against exact search.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=512, help="Try the value you would pass as dimensions.")
+    parser.add_argument("--clusters", type=int, default=500, help="Topic centres in the synthetic corpus.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--codes", nargs="+", default=["int8", "binary"], choices=["int8", "binary"])
+    args = parser.parse_args()
+
+    result = run(args.rows, args.dim, args.clusters, args.queries, args.top_k, args.rescore, args.codes)
+    print(json.dumps(result, indent=2))
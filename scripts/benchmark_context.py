@@ -0,0 +1,87 @@
+"""Prompt tokens per turn with and without context packing, over the ingested corpus.
+
+    python -m scripts.benchmark_context --queries 100 --top-k 4 8 16 --budget 2000
+
+Queries are the opening words of randomly picked chunks (or --query, repeatable), embedded and
+retrieved exactly as a chat turn does. `coverage` is the share of the raw context's distinct
+5-word shingles that are still in the packed context.
+"""
+
+import json
+import random
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.context_packing import pack_context, shingles
+from app.db import SessionLocal
+from app.history import message_tokens
+from app.models import DocumentChunk
+from app.rag import RAGService
+
+
+def sample_queries(db, count: int, words: int = 12) -> list[str]:
+    ids = db.scalars(select(DocumentChunk.id)).all()
+    picks = random.Random(1).sample(ids, min(count, len(ids)))
+    texts = db.scalars(select(DocumentChunk.chunk_text).where(DocumentChunk.id.in_(picks))).all()
+    return [" ".join(text.split()[:words]) for text in texts]
+
+
+def prompt_tokens(rag: RAGService, query: str, context) -> int:
+    return sum(message_tokens(m) for m in rag.build_messages(query, context, []))
+
+
+def run(queries: list[str] | None, count: int, top_ks: list[int], budget: int, threshold: float) -> dict:
+    rag = RAGService()
+    model = settings.openai_chat_model
+    # rankings are fused then cut, so each smaller k is a prefix of the largest one
+    settings.rag_top_k = max(top_ks)
+    with SessionLocal() as db:
+        queries = queries or sample_queries(db, count)
+        embeddings = rag.embed_texts(queries)
+        retrieved = [rag.find_relevant_chunks(db, e, q) for q, e in zip(queries, embeddings)]
+
+    results = {"queries": len(queries), "budget": budget, "duplicate_threshold": threshold, "runs": []}
+    for top_k in top_ks:
+        totals = dict.fromkeys(
+            ("chunks", "passages", "duplicates", "context_raw", "context_packed", "prompt_raw", "prompt_packed"), 0
+        )
+        coverage = []
+        for query, chunks in zip(queries, retrieved):
+            chunks = chunks[:top_k]
+            packed, stats = pack_context(chunks, budget, threshold, model)
+            totals["chunks"] += stats.chunks
+            totals["passages"] += stats.passages
+            totals["duplicates"] += stats.duplicates
+            totals["context_raw"] += stats.input_tokens
+            totals["context_packed"] += stats.packed_tokens
+            totals["prompt_raw"] += prompt_tokens(rag, query, chunks)
+            totals["prompt_packed"] += prompt_tokens(rag, query, packed)
+            raw = frozenset().union(*(shingles(c.chunk_text) for c in chunks))
+            kept = frozenset().union(*(shingles(p.chunk_text) for p in packed))
+            coverage.append(len(raw & kept) / len(raw) if raw else 1.0)
+        turns = max(1, len(queries))
+        results["runs"].append(
+            {
+                "top_k": top_k,
+                **{f"avg_{key}": round(value / turns, 1) for key, value in totals.items()},
+                "prompt_reduction_pct": round(100 * (1 - totals["prompt_packed"] / max(1, totals["prompt_raw"])), 1),
+                "avg_coverage": round(sum(coverage) / turns, 3),
+                "min_coverage": round(min(coverage, default=1.0), 3),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure prompt tokens saved by context packing.")
+    parser.add_argument("--queries", type=int, default=100, help="Queries sampled from chunk texts.")
+    parser.add_argument("--query", action="append", default=None, help="Use this query instead of sampling.")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[settings.rag_top_k, 8, 16])
+    parser.add_argument("--budget", type=int, default=settings.rag_context_token_budget)
+    parser.add_argument("--threshold", type=float, default=settings.rag_context_duplicate_threshold)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.query, args.queries, sorted(set(args.top_k)), args.budget, args.threshold), indent=2))
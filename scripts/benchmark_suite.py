@@ -0,0 +1,363 @@
+"""Offline benchmark of ingestion, retrieval and the chat path, written to JSON.
+
+Runs against a local stub OpenAI server and a throwaway SQLite database, so it needs no
+network or credentials:
+
+    python -m scripts.benchmark_suite --sizes 1000 10000 100000 --output bench.json
+    python -m scripts.benchmark_suite --sizes 1000000 --skip-e2e --compare bench.json
+
+App settings are read when `app.config` is first imported, so app modules are imported
+inside the phases, after the environment has been pointed at the stub and the scratch database.
+"""
+
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from scripts.benchmark_ann import synthetic_corpus
+from scripts.load_test_chat import run as run_load_test
+
+
+USERNAME = "bench"
+PASSWORD = "bench-password"
+WORDS = (
+    "python sql azure kubernetes docker react java spark airflow terraform analytics pipeline "
+    "engineer manager lead senior junior developer consultant architect design testing cloud "
+    "security network finance marketing sales research data science machine learning platform"
+).split()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Peak resident set (VmHWM) of a process and its children, from /proc; None where unavailable."""
+    total = 0.0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            for line in Path(f"/proc/{current}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1]) / 1024
+            pending.extend(int(child) for child in Path(f"/proc/{current}/task/{current}/children").read_text().split())
+    except (OSError, ValueError):
+        return None
+    return round(total, 1)
+
+
+def own_peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_summary(ms: list[float]) -> dict:
+    values = np.asarray(ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def synthetic_text(rng: np.random.Generator, words: int) -> str:
+    picked = rng.choice(WORDS, size=words)
+    return f"Candidate {int(rng.integers(0, 1_000_000)):06d}. " + " ".join(picked.tolist())
+
+
+def write_documents(data_dir: Path, files: int, paragraphs: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        sections = [f"# Resume {i}"]
+        for heading in ("Summary", "Experience", "Skills", "Education"):
+            sections.append(f"## {heading}")
+            sections.extend(synthetic_text(rng, 60) for _ in range(max(1, paragraphs // 4)))
+        (data_dir / f"resume_{i:05d}.md").write_text("\n\n".join(sections) + "\n")
+
+
+def bench_ingestion(work_dir: Path, files: int, paragraphs: int) -> dict:
+    from scripts.ingest_data import ingest_directory
+
+    data_dir = work_dir / "data"
+    write_documents(data_dir, files, paragraphs)
+    started = time.perf_counter()
+    stats = ingest_directory(data_dir, full=True)
+    elapsed = time.perf_counter() - started
+    return {
+        "files": stats.files,
+        "chunks": stats.chunks,
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(stats.files / elapsed, 2),
+        "chunks_per_s": round(stats.chunks / elapsed, 2),
+        "embed_s": round(stats.embed, 3),
+        "write_s": round(stats.write, 3),
+    }
+
+
+def load_corpus(size: int, dim: int, batch_size: int = 10_000, seed: int = 0) -> np.ndarray:
+    """Replace every chunk with `size` synthetic ones; returns their (unit-length) embeddings."""
+    from sqlalchemy import delete, insert
+
+    from app.db import SessionLocal
+    from app.embeddings import encode_embedding
+    from app.models import DocumentChunk, IngestedFile
+    from app.vector_index import bump_index_version
+
+    rng = np.random.default_rng(seed)
+    matrix = synthetic_corpus(size, dim, clusters=max(10, size // 200), seed=seed)
+    with SessionLocal() as db:
+        db.execute(delete(DocumentChunk))
+        db.execute(delete(IngestedFile))
+        for start in range(0, size, batch_size):
+            rows = [
+                {
+                    "source": f"synthetic/doc_{i // 8:07d}.md",
+                    "chunk_index": i % 8,
+                    "chunk_text": synthetic_text(rng, 40),
+                    "embedding": encode_embedding(matrix[i]),
+                    "embedding_dim": dim,
+                    "embedding_dtype": "float32",
+                }
+                for i in range(start, min(start + batch_size, size))
+            ]
+            db.execute(insert(DocumentChunk), rows)
+        bump_index_version(db)
+        db.commit()
+    return matrix
+
+
+def bench_retrieval(size: int, dim: int, queries: int) -> dict:
+    from app.db import SessionLocal
+    from app.rag import RAGService, StageLatencies
+    from scripts.ingest_data import write_index_snapshot
+
+    started = time.perf_counter()
+    matrix = load_corpus(size, dim)
+    load_s = time.perf_counter() - started
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        write_index_snapshot(db)
+        snapshot_s = time.perf_counter() - started
+
+        rag = RAGService()
+        started = time.perf_counter()
+        rag.find_relevant_chunks(db, matrix[0], "warm up")
+        first_query_ms = (time.perf_counter() - started) * 1000
+        rag.retrieval_stats = StageLatencies()
+
+        rng = np.random.default_rng(1)
+        picks = rng.choice(size, min(queries, size), replace=False)
+        vectors = matrix[picks] + 0.05 * rng.standard_normal((len(picks), dim)).astype(np.float32)
+        totals = []
+        for vector in vectors:
+            text = synthetic_text(rng, 6)
+            started = time.perf_counter()
+            rag.find_relevant_chunks(db, vector, text)
+            totals.append((time.perf_counter() - started) * 1000)
+            db.rollback()
+    return {
+        "chunks": size,
+        "dim": dim,
+        "corpus_load_s": round(load_s, 3),
+        "snapshot_build_s": round(snapshot_s, 3),
+        "first_query_ms": round(first_query_ms, 3),
+        "total": latency_summary(totals),
+        "stages": rag.retrieval_stats.stats(),
+        "peak_rss_mb": own_peak_rss_mb(),
+    }
+
+
+def bench_e2e(env: dict, users: int, messages: int, workers: int, stream: bool) -> dict:
+    from scripts.seed_user import seed_user
+
+    seed_user(USERNAME, PASSWORD)
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        # unauthenticated API call: a 401 means the app is serving
+        wait_for(f"{base_url}/api/chats", server)
+        result = asyncio.run(run_load_test(base_url, users, messages, USERNAME, PASSWORD, stream))
+        result["server_peak_rss_mb"] = peak_rss_mb(server.pid)
+        result["workers"] = workers
+        return result
+    finally:
+        stop(server)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    """Numeric leaves keyed by path; retrieval runs are keyed by corpus size so runs line up."""
+    flat: dict[str, float] = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, list):
+            for item in value:
+                flat.update(flatten(item, f"{path}[{item.get('chunks')}]."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(previous: dict, current: dict) -> None:
+    before, after = flatten(previous), flatten(current)
+    for path in sorted(before.keys() & after.keys()):
+        if path.startswith("meta.") or not before[path]:
+            continue
+        change = (after[path] - before[path]) / abs(before[path]) * 100
+        if abs(change) >= 5:
+            print(f"{path}: {before[path]:.6g} -> {after[path]:.6g} ({change:+.1f}%)")
+
+
+def run(args) -> dict:
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="rag-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    stub_port = free_port()
+    env = {
+        **os.environ,
+        "AZURE_SQL_CONNECTION_STRING": f"sqlite:///{work_dir / 'bench.db'}",
+        "AZURE_SQL_ASYNC_CONNECTION_STRING": "",
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "INDEX_DIR": str(work_dir / "index"),
+        "RAG_INDEX_MODE": args.index_mode,
+        "METRICS_ENABLED": "false",
+    }
+    # this process imports app modules too, so it must see the same settings
+    os.environ.update(env)
+
+    stub = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "scripts.stub_openai_server",
+            "--port",
+            str(stub_port),
+            "--embedding-dim",
+            str(args.dim),
+            "--latency-ms",
+            str(args.latency_ms),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    results: dict = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "index_mode": args.index_mode,
+            "dim": args.dim,
+            "stub_latency_ms": args.latency_ms,
+        }
+    }
+    try:
+        wait_for(f"http://127.0.0.1:{stub_port}/stats", stub)
+        from app.db import Base, engine
+
+        Base.metadata.create_all(bind=engine)
+
+        if not args.skip_ingest:
+            print("ingestion...", file=sys.stderr)
+            results["ingestion"] = bench_ingestion(work_dir, args.ingest_files, args.paragraphs)
+        if not args.skip_e2e:
+            print("end to end...", file=sys.stderr)
+            results["e2e"] = bench_e2e(env, args.users, args.messages, args.workers, args.stream)
+        results["retrieval"] = []
+        for size in args.sizes:
+            print(f"retrieval over {size} chunks...", file=sys.stderr)
+            results["retrieval"].append(bench_retrieval(size, args.dim, args.queries))
+        results["peak_rss_mb"] = own_peak_rss_mb()
+    finally:
+        stop(stub)
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and chat turns offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000], help="Corpus sizes (chunks).")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension served by the stub.")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per corpus size.")
+    parser.add_argument("--index-mode", choices=["exact", "ivf"], default="exact")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated upstream latency per stub call.")
+    parser.add_argument("--ingest-files", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per synthetic document.")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent simulated chat users.")
+    parser.add_argument("--messages", type=int, default=3, help="Messages per simulated user.")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the end-to-end run.")
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoint end to end.")
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--work-dir", default=None, help="Keep the scratch database and index here.")
+    parser.add_argument("--output", default=None, help="Write results JSON to this file.")
+    parser.add_argument("--compare", default=None, help="Print metrics that moved 5%% or more against this JSON.")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), results)
@@ -1,9 +1,36 @@
-import json
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterator, Sequence
 
+import numpy as np
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.ann_index import build_ivf, save_ivf
+from app.chunking import Chunk, chunk_lines, chunk_params, unique_chunks
+from app.config import settings
 from app.db import Base, SessionLocal, engine
-from app.models import DocumentChunk
+from app.embeddings import decode_embedding, encode_embedding
+from app.lexical_index import build_snapshot as build_lexical, load_chunk_texts, save_snapshot as save_lexical
+from app.metrics import metrics
+from app.models import DocumentChunk, IngestedFile
 from app.rag import RAGService
+from app.snapshots import SnapshotPointer, current_snapshot, publish_snapshot, stage_snapshot, write_matrix
+from app.vector_index import (
+    bump_index_version,
+    get_index_version,
+    load_ingested_at,
+    load_matrix,
+    load_sources,
+    mark_ingest,
+)
 
 try:
     from PyPDF2 import PdfReader
@@ -11,74 +38,451 @@ except Exception:
     PdfReader = None
 
 
-def split_text(text: str, chunk_size: int = 1000, overlap: int = 150) -> list[str]:
-    chunks = []
-    start = 0
-    text = text.strip()
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return [chunk for chunk in chunks if chunk.strip()]
+SUPPORTED_SUFFIXES = {".txt", ".md", ".csv", ".json", ".pdf"}
+# full-size output widths, so the usual models need no request to learn them
+MODEL_WIDTHS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
 
 
-def ingest_directory(data_dir: Path):
-    Base.metadata.create_all(bind=engine)
-    rag = RAGService()
-    db = SessionLocal()
+def read_file_lines(file_path: Path) -> Iterator[str] | None:
+    """Lines of a file, with line endings, read lazily. None when the file cannot be read."""
+    if file_path.suffix.lower() == ".pdf":
+        if PdfReader is None:
+            print("Skipping PDF ingestion: PyPDF2 is not installed.")
+            return None
+        try:
+            reader = PdfReader(str(file_path))
+        except Exception as e:
+            print(f"Failed to read PDF {file_path}: {e}")
+            return None
+        return pdf_lines(reader)
+    return text_lines(file_path)
 
-    try:
-        db.query(DocumentChunk).delete()
-        db.commit()
-
-        files = [
-            p
-            for p in data_dir.rglob("*")
-            if p.is_file() and p.suffix.lower() in {".txt", ".md", ".csv", ".json", ".pdf"}
-        ]
-
-        processed = 0
-        for file_path in files:
-            suffix = file_path.suffix.lower()
+
+def pdf_lines(reader) -> Iterator[str]:
+    for page in reader.pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception:
             text = ""
-            if suffix == ".pdf":
-                if PdfReader is None:
-                    print("Skipping PDF ingestion: PyPDF2 is not installed.")
+        yield from text.splitlines(keepends=True)
+        # page breaks also end a paragraph
+        yield "\n"
+
+
+def text_lines(file_path: Path) -> Iterator[str]:
+    with file_path.open(encoding="utf-8", errors="ignore", newline="") as f:
+        yield from f
+
+
+def extract_chunks(file_path: Path) -> tuple[list[Chunk] | None, float]:
+    """Read and chunk one file. Runs in a worker process; returns the chunks and CPU time spent.
+
+    Repeated chunks within a file (boilerplate headers, footers) are kept only once. The file is
+    streamed through the chunker; the list is the one copy sent back to the parent process.
+    """
+    started = time.process_time()
+    lines = read_file_lines(file_path)
+    if lines is None:
+        return None, time.process_time() - started
+    chunks = list(unique_chunks(chunk_lines(lines)))
+    return chunks, time.process_time() - started
+
+
+def file_hash(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_rows(source: str, chunks: list[Chunk], embeddings: list[Sequence[float]]) -> list[dict]:
+    dtype = settings.embedding_storage_dtype
+    return [
+        {
+            "source": source,
+            "chunk_index": i,
+            "chunk_text": chunk.text,
+            "content_hash": chunk.content_hash,
+            "start_offset": chunk.start,
+            "end_offset": chunk.end,
+            "token_count": chunk.token_count,
+            "embedding": encode_embedding(emb, dtype),
+            "embedding_dim": len(emb),
+            "embedding_dtype": dtype,
+        }
+        for i, (chunk, emb) in enumerate(zip(chunks, embeddings))
+    ]
+
+
+def embedding_width(rag: RAGService, probe: bool = True) -> int | None:
+    """Width of the vectors the configured model and dimensions produce.
+
+    Read from the settings for known models; any other model costs an embedding request, made only with `probe`.
+    """
+    width = settings.openai_embedding_dimensions or MODEL_WIDTHS.get(settings.openai_embedding_model)
+    if width is None and probe:
+        width = len(rag.embed_texts(["embedding width"])[0])
+    return width
+
+
+def stored_embeddings(db: Session, hashes: set[str], dim: int, batch_size: int = 500) -> dict[str, np.ndarray]:
+    """Stored embeddings of width `dim` for these chunk hashes, reused for unchanged chunks of an edited file."""
+    found: dict[str, np.ndarray] = {}
+    pending = list(hashes)
+    for start in range(0, len(pending), batch_size):
+        rows = db.execute(
+            select(DocumentChunk.content_hash, DocumentChunk.embedding, DocumentChunk.embedding_dtype).where(
+                DocumentChunk.content_hash.in_(pending[start : start + batch_size]),
+                DocumentChunk.embedding_dim == dim,
+            )
+        )
+        for content_hash, blob, dtype in rows:
+            found.setdefault(content_hash, decode_embedding(blob, dim, dtype))
+    return found
+
+
+def insert_chunks(db: Session, rows: list[dict], batch_size: int | None = None) -> None:
+    """Core executemany inserts, so no ORM objects pile up in the session."""
+    batch_size = batch_size or settings.ingest_batch_size
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(DocumentChunk.__table__), rows[start : start + batch_size])
+
+
+def replace_file_chunks(
+    db: Session,
+    source: str,
+    chunks: list[Chunk],
+    embeddings: list[Sequence[float]],
+    manifest: IngestedFile | None,
+    content_hash: str,
+    stat: os.stat_result,
+) -> None:
+    """Swap one file's chunks and manifest entry. The caller commits, never mid-file."""
+    db.query(DocumentChunk).filter(DocumentChunk.source == source).delete(synchronize_session=False)
+    insert_chunks(db, chunk_rows(source, chunks, embeddings))
+
+    if manifest is None:
+        manifest = IngestedFile(source=source)
+        db.add(manifest)
+    manifest.content_hash = content_hash
+    manifest.file_size = stat.st_size
+    manifest.mtime = stat.st_mtime
+    manifest.chunk_params = chunk_params()
+    manifest.chunk_count = len(chunks)
+    manifest.ingested_at = func.now()
+
+
+def remove_source(db: Session, source: str, manifest: IngestedFile | None) -> None:
+    db.query(DocumentChunk).filter(DocumentChunk.source == source).delete(synchronize_session=False)
+    if manifest is not None:
+        db.delete(manifest)
+    bump_index_version(db)
+    db.commit()
+
+
+@dataclass
+class PipelineStats:
+    files: int = 0
+    chunks: int = 0
+    reused: int = 0
+    extract_cpu: float = 0.0
+    embed: float = 0.0
+    write: float = 0.0
+
+
+@dataclass
+class ExtractedFile:
+    source: str
+    content_hash: str
+    stat: os.stat_result
+    chunks: list[Chunk]
+    embeddings: list[Sequence[float]] = field(default_factory=list)
+
+
+_DONE = object()
+
+
+def run_pipeline(
+    rag: RAGService,
+    changed: list[tuple[str, Path, str, os.stat_result]],
+    concurrency: int,
+    workers: int,
+    reuse_dim: int | None = None,
+) -> PipelineStats:
+    """Extract, embed and write changed files as three overlapping stages.
+
+    A process pool reads and splits files, the calling thread embeds them in groups large
+    enough to keep `concurrency` batches in flight, and a writer thread swaps each file's
+    chunks in with its own session. Stages are joined by bounded queues, so a slow stage
+    applies backpressure instead of buffering the whole directory in memory.
+    Stored embeddings of width `reuse_dim` are reused for unchanged chunks; None embeds every chunk.
+    """
+    stats = PipelineStats()
+    depth = max(2, workers * 2)
+    extracted: queue.Queue = queue.Queue()
+    to_write: queue.Queue = queue.Queue(maxsize=depth)
+    in_flight = threading.BoundedSemaphore(depth)
+    stop = threading.Event()
+    writer_error: list[BaseException] = []
+
+    def submit_all(pool: ProcessPoolExecutor) -> None:
+        for source, file_path, content_hash, stat in changed:
+            while not in_flight.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            future = pool.submit(extract_chunks, file_path)
+            future.add_done_callback(lambda f, item=(source, content_hash, stat): extracted.put((item, f)))
+
+    def write_all() -> None:
+        try:
+            db = SessionLocal()
+        except BaseException as e:
+            writer_error.append(e)
+            return
+        pending_rows = 0
+
+        def commit() -> None:
+            bump_index_version(db)
+            mark_ingest(db, running=True)
+            db.commit()
+            # drop the committed manifests so the identity map stays small
+            db.expunge_all()
+
+        try:
+            while (item := to_write.get()) is not _DONE:
+                if writer_error:
                     continue
                 try:
-                    reader = PdfReader(str(file_path))
-                    pages = []
-                    for p in reader.pages:
-                        try:
-                            pages.append(p.extract_text() or "")
-                        except Exception:
-                            pages.append("")
-                    text = "\n".join(pages)
-                except Exception as e:
-                    print(f"Failed to read PDF {file_path}: {e}")
-                    continue
-            else:
-                text = file_path.read_text(encoding="utf-8", errors="ignore")
+                    started = time.perf_counter()
+                    manifest = db.query(IngestedFile).filter(IngestedFile.source == item.source).one_or_none()
+                    replace_file_chunks(
+                        db, item.source, item.chunks, item.embeddings, manifest, item.content_hash, item.stat
+                    )
+                    pending_rows += max(1, len(item.chunks))
+                    if pending_rows >= settings.ingest_batch_size:
+                        commit()
+                        pending_rows = 0
+                    stats.write += time.perf_counter() - started
+                except BaseException as e:
+                    db.rollback()
+                    writer_error.append(e)
+            if pending_rows and not writer_error:
+                started = time.perf_counter()
+                commit()
+                stats.write += time.perf_counter() - started
+        except BaseException as e:
+            db.rollback()
+            writer_error.append(e)
+        finally:
+            db.close()
 
-            if not text or not text.strip():
-                # nothing to index for this file
+    def hand_off(item) -> bool:
+        """Queue `item` for the writer; False if the writer thread has exited, so nothing would drain it."""
+        while writer.is_alive():
+            try:
+                to_write.put(item, timeout=0.1)
+                return True
+            except queue.Full:
                 continue
+        return False
+
+    def embed_group(group: list[ExtractedFile]) -> None:
+        started = time.perf_counter()
+        chunks = [chunk for item in group for chunk in item.chunks]
+        known = stored_embeddings(lookup_db, {c.content_hash for c in chunks}, reuse_dim) if reuse_dim else {}
+        lookup_db.rollback()
+        missing = list({c.content_hash: c.text for c in chunks if c.content_hash not in known}.items())
+        fetched = rag.embed_texts([text for _, text in missing], concurrency)
+        known.update((content_hash, emb) for (content_hash, _), emb in zip(missing, fetched))
+        stats.reused += len(chunks) - len(missing)
+        stats.embed += time.perf_counter() - started
+        for item in group:
+            item.embeddings = [known[chunk.content_hash] for chunk in item.chunks]
+            if not hand_off(item) and not writer_error:
+                raise RuntimeError("ingest writer exited unexpectedly")
+            if writer_error:
+                raise writer_error[0]
+
+    group_size = settings.embedding_batch_size * max(1, concurrency)
+    lookup_db = SessionLocal()
+    writer = threading.Thread(target=write_all, name="ingest-writer", daemon=True)
+    writer.start()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        producer = threading.Thread(target=submit_all, args=(pool,), name="ingest-extract", daemon=True)
+        producer.start()
+        try:
+            group: list[ExtractedFile] = []
+            pending_chunks = 0
+            for _ in range(len(changed)):
+                (source, content_hash, stat), future = extracted.get()
+                in_flight.release()
+                chunks, cpu = future.result()
+                stats.extract_cpu += cpu
+                if chunks is None:
+                    continue
+                stats.files += 1
+                stats.chunks += len(chunks)
+                group.append(ExtractedFile(source, content_hash, stat, chunks))
+                pending_chunks += len(chunks)
+                if pending_chunks >= group_size:
+                    embed_group(group)
+                    group, pending_chunks = [], 0
+            if group:
+                embed_group(group)
+        finally:
+            stop.set()
+            producer.join()
+            hand_off(_DONE)
+            writer.join()
+            lookup_db.close()
+
+    if writer_error:
+        raise writer_error[0]
+    return stats
+
+
+def snapshot_outdated(db: Session) -> bool:
+    pointer = current_snapshot(settings.index_dir)
+    return pointer is None or pointer.version != get_index_version(db)
+
+
+def write_index_snapshot(db: Session) -> SnapshotPointer:
+    """Publish the embedding matrix, lexical index and (in ivf mode) ANN index for the current chunks."""
+    version = get_index_version(db)
+    ids, matrix = load_matrix(db)
+    sources = load_sources(db)
+    ingested_at = load_ingested_at(db)
+    texts = load_chunk_texts(db) if settings.rag_hybrid_enabled else None
+    db.rollback()
 
-            for chunk in split_text(text):
-                emb = rag.embed_text(chunk)
-                row = DocumentChunk(
-                    source=str(file_path.relative_to(data_dir.parent)),
-                    chunk_text=chunk,
-                    embedding_json=json.dumps(emb),
-                )
-                db.add(row)
-            processed += 1
-
-        db.commit()
-        print(f"Ingestion complete. Indexed {processed} files.")
+    staging = stage_snapshot(settings.index_dir)
+    try:
+        write_matrix(staging, ids, matrix, sources, ingested_at, settings.rag_compact_codes)
+        if texts is not None:
+            save_lexical(build_lexical(version, texts), staging)
+        if settings.rag_index_mode == "ivf":
+            save_ivf(build_ivf(version, ids, matrix, settings.ivf_lists or None, settings.ivf_quantization), staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return publish_snapshot(settings.index_dir, staging, version)
+
+
+def changed_files(
+    db: Session, files: dict[str, Path], manifests: dict[str, IngestedFile], full: bool
+) -> tuple[list[tuple[str, Path, str, os.stat_result]], int]:
+    """Files whose content or chunking changed since their manifest entry, and the count of the rest."""
+    changed: list[tuple[str, Path, str, os.stat_result]] = []
+    unchanged = 0
+    params = chunk_params()
+    for source, file_path in files.items():
+        stat = file_path.stat()
+        manifest = manifests.get(source)
+        same_params = manifest is not None and manifest.chunk_params == params
+        if not full and same_params and manifest.file_size == stat.st_size and manifest.mtime == stat.st_mtime:
+            unchanged += 1
+            continue
+
+        content_hash = file_hash(file_path)
+        if not full and same_params and manifest.content_hash == content_hash:
+            # touched but identical: refresh the stat fields so the next run takes the fast path
+            manifest.file_size = stat.st_size
+            manifest.mtime = stat.st_mtime
+            db.commit()
+            unchanged += 1
+            continue
+        changed.append((source, file_path, content_hash, stat))
+    return changed, unchanged
+
+
+def ingest_directory(
+    data_dir: Path,
+    concurrency: int | None = None,
+    rag: RAGService | None = None,
+    full: bool = False,
+    workers: int | None = None,
+) -> PipelineStats:
+    Base.metadata.create_all(bind=engine)
+    rag = rag or RAGService()
+    concurrency = concurrency or settings.embedding_max_concurrency
+    db = SessionLocal()
+    started = time.perf_counter()
+    # workers keep serving the published snapshot while this run's commits put the database ahead of it
+    mark_ingest(db, running=True)
+    db.commit()
+
+    try:
+        files = {
+            str(p.relative_to(data_dir.parent)): p
+            for p in sorted(data_dir.rglob("*"))
+            if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES
+        }
+        manifests = {m.source: m for m in db.query(IngestedFile).all()}
+
+        # also sweeps chunks left by runs that predate the manifest
+        indexed_sources = {source for (source,) in db.query(DocumentChunk.source).distinct()}
+        removed = sorted((indexed_sources | manifests.keys()) - files.keys())
+        for source in removed:
+            remove_source(db, source, manifests.get(source))
+
+        changed, unchanged = changed_files(db, files, manifests, full)
+
+        width = None
+        if not full and indexed_sources:
+            # a request to learn the width only pays off when there is something to embed
+            width = embedding_width(rag, probe=bool(changed))
+            if (
+                width is not None
+                and db.scalar(select(DocumentChunk.id).where(DocumentChunk.embedding_dim != width).limit(1)) is not None
+            ):
+                # the model or dimensions changed; one width per index, so nothing stored can stay
+                print(f"Stored embeddings are not {width}-dimensional; re-embedding every file.")
+                full = True
+                changed, unchanged = changed_files(db, files, manifests, full)
+
+        discovered = time.perf_counter()
+        try:
+            stats = run_pipeline(rag, changed, concurrency, workers or os.cpu_count() or 1, None if full else width)
+        except Exception:
+            # batches committed before the failure are live in the database; publish them if we still can
+            db.rollback()
+            try:
+                if snapshot_outdated(db):
+                    write_index_snapshot(db)
+            except Exception as e:
+                print(f"snapshot: not republished after the failed run: {e}")
+            raise
+        snapshot_seconds = 0.0
+        pointer = current_snapshot(settings.index_dir)
+        if full or snapshot_outdated(db):
+            snapshot_started = time.perf_counter()
+            pointer = write_index_snapshot(db)
+            snapshot_seconds = time.perf_counter() - snapshot_started
+        total = time.perf_counter() - started
+
+        print(f"discover: {discovered - started:.2f}s")
+        print(f"extract:  {stats.extract_cpu:.2f}s CPU across workers, {stats.files} files")
+        rate = stats.chunks / stats.embed if stats.embed else 0.0
+        print(f"embed:    {stats.embed:.2f}s, {stats.chunks} chunks ({rate:.1f} chunks/sec, {stats.reused} reused)")
+        print(f"write:    {stats.write:.2f}s")
+        print(f"snapshot: {snapshot_seconds:.2f}s, version {pointer.version} at {pointer.path}")
+        print(f"total:    {total:.2f}s")
+        print(
+            f"Ingestion complete. Indexed {stats.files} changed files, "
+            f"skipped {unchanged} unchanged, removed {len(removed)}."
+        )
+        if settings.metrics_enabled:
+            # the embedding calls and tokens this run spent
+            metrics.flush(SessionLocal, gauges=False)
+        return stats
     finally:
+        try:
+            db.rollback()
+            mark_ingest(db, running=False)
+            db.commit()
+        except Exception as e:
+            print(f"ingest marker not cleared; workers wait {settings.ingest_heartbeat_timeout_seconds}s for it: {e}")
         db.close()
 
 
@@ -87,6 +491,15 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Ingest files from data directory into embeddings table.")
     parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--concurrency", type=int, default=None, help="Embedding batches in flight at once.")
+    parser.add_argument("--full", action="store_true", help="Re-embed every file even if unchanged.")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count).")
+    parser.add_argument("--batch-size", type=int, default=None, help="Chunk rows per insert batch and commit.")
     args = parser.parse_args()
 
-    ingest_directory(Path(args.data_dir).resolve())
+    if args.batch_size:
+        settings.ingest_batch_size = args.batch_size
+
+    ingest_directory(
+        Path(args.data_dir).resolve(), concurrency=args.concurrency, full=args.full, workers=args.workers
+    )
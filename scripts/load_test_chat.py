@@ -0,0 +1,84 @@
+"""Concurrent chat load test against a running app.
+
+    python -m scripts.stub_openai_server --port 8100 --latency-ms 500
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub uvicorn app.main:app --port 8000
+    python -m scripts.load_test_chat --users 200 --messages 3 --username admin --password ...
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def simulate_user(
+    base_url: str, username: str, password: str, messages: int, stream: bool, latencies: list[float], errors: list[str]
+) -> None:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        try:
+            response = await client.post("/api/login", data={"username": username, "password": password})
+            response.raise_for_status()
+            response = await client.post("/api/chats")
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+            return
+
+        chat_id = response.json()["id"]
+        path = f"/api/chats/{chat_id}/messages" + ("/stream" if stream else "")
+
+        for i in range(messages):
+            started = time.perf_counter()
+            try:
+                async with client.stream("POST", path, json={"message": f"Load test question {i}"}) as response:
+                    await response.aread()
+                    response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+            except httpx.HTTPError as e:
+                errors.append(str(e))
+
+
+async def run(base_url: str, users: int, messages: int, username: str, password: str, stream: bool) -> dict:
+    latencies: list[float] = []
+    errors: list[str] = []
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(simulate_user(base_url, username, password, messages, stream, latencies, errors) for _ in range(users))
+    )
+    elapsed = time.perf_counter() - started
+    return {
+        "users": users,
+        "messages_per_user": messages,
+        "completed": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms_p50": round(percentile(latencies, 50), 1),
+        "latency_ms_p95": round(percentile(latencies, 95), 1),
+        "latency_ms_max": round(max(latencies, default=0.0), 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fire concurrent chat turns at a running app instance.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoint.")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.base_url, args.users, args.messages, args.username, args.password, args.stream))
+    print(json.dumps(result, indent=2))
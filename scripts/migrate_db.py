@@ -0,0 +1,167 @@
+import json
+
+from sqlalchemy import LargeBinary, column, inspect, select, table, text, update
+
+from app.config import settings
+from app.db import Base, SessionLocal, engine
+from app.embeddings import encode_embedding
+from app.metrics import update_rollups
+from app.models import LogMetric, LogMetricRollup
+from app.vector_index import bump_index_version
+
+
+def column_names(table_name: str) -> set[str]:
+    return {column["name"] for column in inspect(engine).get_columns(table_name)}
+
+
+def add_column(table_name: str, ddl: str) -> None:
+    # SQL Server does not accept the COLUMN keyword in ADD.
+    keyword = "ADD" if engine.dialect.name == "mssql" else "ADD COLUMN"
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table_name} {keyword} {ddl}"))
+
+
+def migrate_embeddings_to_binary(batch_size: int = 500) -> None:
+    """Convert `document_chunks.embedding_json` text into binary embedding columns."""
+    existing = column_names("document_chunks")
+    if "embedding_json" not in existing:
+        print("document_chunks: embeddings already binary.")
+        return
+
+    blob_type = LargeBinary().compile(dialect=engine.dialect)
+    if "embedding" not in existing:
+        add_column("document_chunks", f"embedding {blob_type} NULL")
+    if "embedding_dim" not in existing:
+        add_column("document_chunks", "embedding_dim INTEGER NULL")
+    if "embedding_dtype" not in existing:
+        add_column("document_chunks", "embedding_dtype VARCHAR(16) NULL")
+
+    chunks = table(
+        "document_chunks",
+        column("id"),
+        column("embedding_json"),
+        column("embedding"),
+        column("embedding_dim"),
+        column("embedding_dtype"),
+    )
+    dtype = settings.embedding_storage_dtype
+    converted = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            rows = db.execute(
+                select(chunks.c.id, chunks.c.embedding_json)
+                .where(chunks.c.embedding.is_(None), chunks.c.id > last_id)
+                .order_by(chunks.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            for row in rows:
+                vector = json.loads(row.embedding_json)
+                db.execute(
+                    update(chunks)
+                    .where(chunks.c.id == row.id)
+                    .values(
+                        embedding=encode_embedding(vector, dtype),
+                        embedding_dim=len(vector),
+                        embedding_dtype=dtype,
+                    )
+                )
+            db.commit()
+            converted += len(rows)
+            last_id = rows[-1].id
+            print(f"document_chunks: converted {converted} embeddings...")
+
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE document_chunks DROP COLUMN embedding_json"))
+
+        bump_index_version(db)
+        db.commit()
+        print(f"document_chunks: migrated {converted} embeddings to {dtype} binary storage.")
+    finally:
+        db.close()
+
+
+def add_chunk_metadata_columns() -> None:
+    """Offsets and hashes from the token-aware chunker. Legacy rows keep NULLs until re-ingested."""
+    existing = column_names("document_chunks")
+    for name, ddl in (
+        ("chunk_index", "chunk_index INTEGER NULL"),
+        ("content_hash", "content_hash VARCHAR(64) NULL"),
+        ("start_offset", "start_offset INTEGER NULL"),
+        ("end_offset", "end_offset INTEGER NULL"),
+        ("token_count", "token_count INTEGER NULL"),
+    ):
+        if name not in existing:
+            add_column("document_chunks", ddl)
+            print(f"document_chunks: added {name}.")
+
+
+def create_missing_indexes() -> None:
+    """create_all only builds indexes for new tables; add ones introduced since."""
+    existing = inspect(engine)
+    for mapped_table in Base.metadata.sorted_tables:
+        names = {index["name"] for index in existing.get_indexes(mapped_table.name)}
+        for index in mapped_table.indexes:
+            if index.name not in names:
+                index.create(bind=engine)
+                print(f"{mapped_table.name}: created index {index.name}.")
+
+
+def backfill_metric_rollups(batch_size: int = 5000) -> None:
+    """Build `log_metric_rollups` from metrics recorded before the table existed."""
+    db = SessionLocal()
+    try:
+        if db.scalar(select(LogMetricRollup.id).limit(1)) is not None:
+            return
+        # one flush window = consecutive rows sharing created_at; a repeated key starts the next window
+        window: dict[str, float] = {}
+        window_at = None
+        windows = 0
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(LogMetric.id, LogMetric.metric_key, LogMetric.metric_value, LogMetric.created_at)
+                .where(LogMetric.id > last_id)
+                .order_by(LogMetric.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                if window and (row.created_at != window_at or row.metric_key in window):
+                    update_rollups(db, window, window_at)
+                    windows += 1
+                    window = {}
+                window_at = row.created_at
+                window[row.metric_key] = row.metric_value
+            last_id = rows[-1].id
+        if window:
+            update_rollups(db, window, window_at)
+            windows += 1
+        db.commit()
+        if windows:
+            print(f"log_metric_rollups: backfilled from {windows} metric windows.")
+    finally:
+        db.close()
+
+
+MIGRATIONS = [
+    migrate_embeddings_to_binary,
+    add_chunk_metadata_columns,
+    create_missing_indexes,
+    backfill_metric_rollups,
+]
+
+
+def migrate() -> None:
+    Base.metadata.create_all(bind=engine)
+    for migration in MIGRATIONS:
+        migration()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,54 +1,67 @@
+"""Insert one sample reading of every dashboard metric.
+
+    python -m scripts.seed_metrics [--reset]
+
+Samples are written like recorded metrics, under the same keys, and add to the existing history.
+--reset first deletes all of log_metrics and log_metric_rollups, recorded metrics included.
+"""
+
+from datetime import datetime, timezone
+
 from app.db import Base, SessionLocal, engine
-from app.models import LogMetric
-
-
-METRICS = [
-    ("total_logins", "Total Logins", 1240, "count", "auth"),
-    ("failed_logins", "Failed Logins", 74, "count", "auth"),
-    ("active_users_24h", "Active Users (24h)", 317, "count", "usage"),
-    ("new_users_7d", "New Users (7d)", 92, "count", "usage"),
-    ("total_chats", "Total Chats", 2860, "count", "chat"),
-    ("messages_24h", "Messages (24h)", 1482, "count", "chat"),
-    ("avg_messages_per_chat", "Avg Messages / Chat", 8.4, "ratio", "chat"),
-    ("avg_response_ms", "Avg Response Time", 1260, "ms", "latency"),
-    ("p95_response_ms", "P95 Response Time", 2910, "ms", "latency"),
-    ("timeout_errors", "Timeout Errors", 12, "count", "errors"),
-    ("db_errors", "DB Errors", 4, "count", "errors"),
-    ("api_errors", "API Errors", 9, "count", "errors"),
-    ("retrieval_hits", "Retrieval Hits", 1112, "count", "rag"),
-    ("retrieval_misses", "Retrieval Misses", 198, "count", "rag"),
-    ("avg_context_chunks", "Avg Context Chunks", 3.6, "count", "rag"),
-    ("embedding_calls", "Embedding Calls", 1675, "count", "openai"),
-    ("chat_completion_calls", "Chat Completion Calls", 1320, "count", "openai"),
-    ("openai_cost_usd", "OpenAI Cost", 48.27, "usd", "openai"),
-    ("token_input_total", "Input Tokens", 943200, "count", "openai"),
-    ("token_output_total", "Output Tokens", 422450, "count", "openai"),
-]
-
-
-def seed_metrics() -> None:
+from app.metrics import write_metrics
+from app.models import LogMetric, LogMetricRollup
+
+
+SAMPLE_VALUES = {
+    "total_logins": 1240,
+    "failed_logins": 74,
+    "active_users_24h": 317,
+    "new_users_7d": 92,
+    "total_chats": 2860,
+    "messages_24h": 1482,
+    "avg_messages_per_chat": 8.4,
+    "avg_response_ms": 1260,
+    "p95_response_ms": 2910,
+    "timeout_errors": 12,
+    "db_errors": 4,
+    "api_errors": 9,
+    "retrieval_hits": 1112,
+    "retrieval_misses": 198,
+    "avg_context_chunks": 3.6,
+    "embedding_calls": 1675,
+    "chat_completion_calls": 1320,
+    "openai_cost_usd": 48.27,
+    "token_input_total": 943200,
+    "token_output_total": 422450,
+}
+
+
+def seed_metrics(reset: bool = False) -> None:
     Base.metadata.create_all(bind=engine)
     db = SessionLocal()
     try:
-        db.query(LogMetric).delete()
-        db.commit()
-
-        for key, label, value, unit, category in METRICS:
-            db.add(
-                LogMetric(
-                    metric_key=key,
-                    metric_label=label,
-                    metric_value=float(value),
-                    unit=unit,
-                    category=category,
-                )
-            )
+        if reset:
+            db.query(LogMetric).delete()
+            db.query(LogMetricRollup).delete()
+            db.commit()
 
+        # labels, units and categories come from app.metrics, like recorded metrics
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        write_metrics(db, {key: float(value) for key, value in SAMPLE_VALUES.items()}, now)
         db.commit()
-        print("Inserted 20 log metrics into log_metrics table.")
+        print(f"Inserted {len(SAMPLE_VALUES)} log metrics into log_metrics table.")
     finally:
         db.close()
 
 
 if __name__ == "__main__":
-    seed_metrics()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Insert sample dashboard metrics.")
+    parser.add_argument(
+        "--reset", action="store_true", help="Delete every stored metric and rollup first, not just add samples."
+    )
+    args = parser.parse_args()
+
+    seed_metrics(reset=args.reset)
@@ -0,0 +1,170 @@
+"""Offline OpenAI-compatible stub for ingestion, load tests and benchmarks.
+
+    python -m scripts.stub_openai_server --port 8100 --latency-ms 50
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub python -m scripts.ingest_data
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class StubConfig:
+    embedding_dim: int = 1536
+    latency_ms: float = 0.0
+    token_latency_ms: float = 0.0
+    fail_every: int = 0
+
+
+config = StubConfig()
+request_counter = itertools.count(1)
+stats = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0, "rate_limited": 0}
+
+app = FastAPI(title="OpenAI stub")
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+    return vec.tolist()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+async def simulate_upstream() -> JSONResponse | None:
+    if config.latency_ms:
+        await asyncio.sleep(config.latency_ms / 1000)
+    if config.fail_every and next(request_counter) % config.fail_every == 0:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": "0.05"},
+            content={"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+        )
+    return None
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    if (error := await simulate_upstream()) is not None:
+        return error
+
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dim = int(body.get("dimensions") or config.embedding_dim)
+
+    stats["embedding_requests"] += 1
+    stats["embedding_inputs"] += len(inputs)
+    return {
+        "object": "list",
+        "model": body.get("model", "stub-embedding"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, dim)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {
+            "prompt_tokens": sum(estimate_tokens(text) for text in inputs),
+            "total_tokens": sum(estimate_tokens(text) for text in inputs),
+        },
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    if (error := await simulate_upstream()) is not None:
+        return error
+
+    body = await request.json()
+    question = body["messages"][-1]["content"]
+    answer = f"Stub answer based on {len(body['messages'])} messages."
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in body["messages"])
+
+    completion_id = f"chatcmpl-stub-{hashlib.md5(question.encode()).hexdigest()[:12]}"
+    stats["chat_requests"] += 1
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(completion_id, body, answer), media_type="text/event-stream")
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub-chat"),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(answer),
+            "total_tokens": prompt_tokens + estimate_tokens(answer),
+        },
+    }
+
+
+async def stream_completion(completion_id: str, body: dict, answer: str):
+    words = answer.split(" ")
+    for i, word in enumerate(words):
+        if config.token_latency_ms:
+            await asyncio.sleep(config.token_latency_ms / 1000)
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "stub-chat"),
+            "choices": [
+                {"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "stub-chat"),
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    if (body.get("stream_options") or {}).get("include_usage"):
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in body["messages"])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(answer),
+            "total_tokens": prompt_tokens + estimate_tokens(answer),
+        }
+        yield f"data: {json.dumps({**final, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Delay between streamed tokens.")
+    parser.add_argument("--fail-every", type=int, default=0, help="Return HTTP 429 on every Nth request.")
+    args = parser.parse_args()
+
+    config.embedding_dim = args.embedding_dim
+    config.latency_ms = args.latency_ms
+    config.token_latency_ms = args.token_latency_ms
+    config.fail_every = args.fail_every
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
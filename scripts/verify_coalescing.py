@@ -0,0 +1,172 @@
+"""Concurrent checks of request coalescing and the upstream gate, against a stub client that counts calls.
+
+    python -m scripts.verify_coalescing
+
+Runs offline and exits non-zero on the first failed check.
+"""
+
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+# small limits so the concurrency cap is visible; set before the app reads its settings
+os.environ.setdefault("OPENAI_MAX_CONCURRENCY", "4")
+os.environ.setdefault("OPENAI_MAX_REQUESTS_PER_SECOND", "0")
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+
+from app.metrics import metrics  # noqa: E402
+from app.rag import RAGService  # noqa: E402
+from app.upstream import RateLimiter, upstream  # noqa: E402
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CountingClient:
+    """Just enough of AsyncOpenAI for RAGService: every call is counted, and can be slowed or failed."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls: list[str] = []
+        self.fail_next = 0
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+        self.embeddings = SimpleNamespace(create=self.create_embedding)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_completion))
+
+    async def _upstream(self, kind: str) -> None:
+        self.calls.append(kind)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+        if self.fail_next:
+            self.fail_next -= 1
+            raise UpstreamError(f"{kind} failed upstream")
+
+    async def create_embedding(self, model: str, input: str, **options):
+        await self._upstream("embedding")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(input)), 1.0])], usage=None)
+
+    async def create_completion(self, model: str, messages: list[dict], stream: bool = False, **options):
+        await self._upstream("chat")
+        text = f"answer to {messages[-1]['content'][-20:]}"
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+        return StubStream(text.split(" "))
+
+
+class StubStream:
+    def __init__(self, words: list[str]):
+        self.words = words
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        for i, word in enumerate(self.words):
+            await asyncio.sleep(0.01)
+            delta = SimpleNamespace(content=word if i == 0 else f" {word}")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+    async def close(self):
+        pass
+
+
+def chunk(chunk_id: int, text: str = "context") -> SimpleNamespace:
+    return SimpleNamespace(id=chunk_id, source="doc.md", chunk_text=text)
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise SystemExit(f"FAIL: {message}")
+    print(f"ok   {message}")
+
+
+async def collect(deltas) -> str:
+    return "".join([delta async for delta in deltas])
+
+
+async def main() -> None:
+    client = CountingClient()
+    rag = RAGService(client=SimpleNamespace(), async_client=client)
+    context = [chunk(1), chunk(2)]
+
+    vectors = await asyncio.gather(*(rag.aembed_text("popular question") for _ in range(50)))
+    check(client.calls.count("embedding") == 1, "50 identical embeddings share one upstream call")
+    check(all(v == vectors[0] for v in vectors), "every waiter gets the leader's embedding")
+
+    client.calls.clear()
+    answers = await asyncio.gather(*(rag.agenerate_answer("popular question", context, []) for _ in range(50)))
+    check(client.calls == ["chat"], "50 identical completions share one upstream call")
+    check(len(set(answers)) == 1, "every waiter gets the same answer")
+
+    client.calls.clear()
+    await asyncio.gather(
+        rag.agenerate_answer("popular question", context, []),
+        rag.agenerate_answer("popular question", [chunk(3)], []),
+        rag.agenerate_answer("popular question", context, [{"role": "user", "content": "earlier"}]),
+    )
+    check(client.calls == ["chat"] * 3, "different context ids or history are not coalesced")
+
+    client.calls.clear()
+    streams = await asyncio.gather(*(collect(rag.astream_answer("streamed question", context, [])) for _ in range(20)))
+    check(client.calls == ["chat"], "20 identical streams share one upstream stream")
+    check(len(set(streams)) == 1 and streams[0], "every stream reader receives the full text")
+
+    client.calls.clear()
+    leader = asyncio.create_task(rag.agenerate_answer("leader leaves", context, []))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(rag.agenerate_answer("leader leaves", context, [])) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    results = await asyncio.gather(*followers)
+    check(leader.cancelled() and len(set(results)) == 1, "followers still get the answer when the leader is cancelled")
+    check(client.calls == ["chat"] and client.cancelled == 0, "the leader's cancellation does not cancel the call")
+
+    client.calls.clear()
+    client.fail_next = 1
+    outcomes = await asyncio.gather(
+        *(rag.agenerate_answer("leader fails", context, []) for _ in range(10)), return_exceptions=True
+    )
+    check(all(isinstance(o, UpstreamError) for o in outcomes), "an upstream failure reaches every waiter")
+    retry = await rag.agenerate_answer("leader fails", context, [])
+    check(client.calls == ["chat", "chat"] and retry, "the next caller after a failure starts a fresh call")
+    check(len(rag.in_flight) == 0, "no in-flight entries are left behind")
+
+    client.calls.clear()
+    waiters = [asyncio.create_task(rag.agenerate_answer("everyone leaves", context, [])) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0.01)
+    check(client.cancelled == 1, "the upstream call is cancelled once every waiter has gone")
+
+    client.peak = 0
+    client.calls.clear()
+    await asyncio.gather(*(rag.agenerate_answer(f"distinct {i}", context, []) for i in range(20)))
+    check(len(client.calls) == 20, "distinct requests each make their own call")
+    check(client.peak == upstream.max_concurrency, f"at most {upstream.max_concurrency} upstream calls in flight")
+    queue = metrics.drain()[0].get("upstream_queue")
+    check(queue is not None and queue.max > 0, f"queue wait is recorded (max {queue.max:.0f} ms)")
+
+    limiter = RateLimiter(20, burst=1)
+    started = time.perf_counter()
+    for _ in range(11):
+        await limiter.acquire()
+    elapsed = time.perf_counter() - started
+    check(0.45 <= elapsed <= 0.8, f"rate limiter spaces 11 starts at 20/s over {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,54 +5,189 @@ const input = document.getElementById("message-input");
 const newChatBtn = document.getElementById("new-chat-btn");
 const logoutBtn = document.getElementById("logout-btn");
 
+const PAGE_SIZE = 50;
+
 let currentChatId = null;
+let chatsCursor = null;
+let messagesCursor = null;
+let loadingChats = false;
+let loadingMessages = false;
 
-function addMessage(role, content) {
+function createMessageElement(role, content) {
   const div = document.createElement("div");
   div.className = `message ${role}`;
   div.textContent = content;
+  return div;
+}
+
+function addMessage(role, content) {
+  const div = createMessageElement(role, content);
   messagesBox.appendChild(div);
   messagesBox.scrollTop = messagesBox.scrollHeight;
+  return div;
+}
+
+function parseSseEvent(block) {
+  let event = "message";
+  const data = [];
+  block.split("\n").forEach((line) => {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      data.push(line.slice(5).trimStart());
+    }
+  });
+  return { event, data: data.length ? JSON.parse(data.join("\n")) : {} };
+}
+
+// Returns the payload of the final "done" event, or null if the stream ended without one.
+async function streamReply(response, bubble) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const { event, data } = parseSseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      if (event === "token") {
+        bubble.textContent += data.text;
+        messagesBox.scrollTop = messagesBox.scrollHeight;
+      } else if (event === "done") {
+        bubble.textContent = data.content;
+        result = data;
+      } else if (event === "error") {
+        bubble.textContent += `${bubble.textContent ? "\n" : ""}Error: ${data.detail}`;
+      }
+    }
+  }
+  return result;
+}
+
+function markActiveChat() {
+  chatList.querySelectorAll(".chat-item").forEach((item) => {
+    item.classList.toggle("active", Number(item.dataset.chatId) === currentChatId);
+  });
+}
+
+function createChatItem(chat) {
+  const item = document.createElement("div");
+  item.className = `chat-item ${chat.id === currentChatId ? "active" : ""}`;
+  item.dataset.chatId = chat.id;
+  item.textContent = chat.title;
+  item.onclick = () => selectChat(chat.id);
+  return item;
+}
+
+// Chats are listed most recently updated first, and a rename bumps updated_at on the server,
+// so a new or renamed chat moves to the top; other loaded pages are left as they are.
+function showChatAtTop(chat) {
+  chatList.querySelector(`.chat-item[data-chat-id="${chat.id}"]`)?.remove();
+  chatList.prepend(createChatItem(chat));
 }
 
-async function loadChats() {
-  const response = await fetch("/api/chats");
-  if (response.status === 401) {
-    window.location.href = "/login";
+async function loadChats({ append = false } = {}) {
+  if (loadingChats || (append && !chatsCursor)) {
     return;
   }
+  loadingChats = true;
+
+  let page;
+  try {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (append) {
+      params.set("before", chatsCursor);
+    }
+    const response = await fetch(`/api/chats?${params}`);
+    if (response.status === 401) {
+      window.location.href = "/login";
+      return;
+    }
+
+    page = await response.json();
+    chatsCursor = page.next_before;
+    if (!append) {
+      chatList.innerHTML = "";
+    }
+
+    page.chats.forEach((chat) => chatList.appendChild(createChatItem(chat)));
+  } finally {
+    loadingChats = false;
+  }
 
-  const chats = await response.json();
-  chatList.innerHTML = "";
+  if (!currentChatId && page.chats.length > 0) {
+    await selectChat(page.chats[0].id);
+  }
+  // A list that does not overflow never fires scroll events, so keep paging until it does.
+  if (chatsCursor && chatList.scrollHeight <= chatList.clientHeight) {
+    await loadChats({ append: true });
+  }
+}
 
-  chats.forEach((chat) => {
-    const item = document.createElement("div");
-    item.className = `chat-item ${chat.id === currentChatId ? "active" : ""}`;
-    item.textContent = chat.title;
-    item.onclick = () => selectChat(chat.id);
-    chatList.appendChild(item);
-  });
+async function loadMessages({ older = false } = {}) {
+  if (loadingMessages || (older && !messagesCursor)) {
+    return;
+  }
+  loadingMessages = true;
+  const chatId = currentChatId;
+
+  try {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (older) {
+      params.set("before", messagesCursor);
+    }
+    const response = await fetch(`/api/chats/${chatId}/messages?${params}`);
+    const page = await response.json();
+    if (chatId !== currentChatId) {
+      return;
+    }
+    messagesCursor = page.next_before;
+
+    if (!older) {
+      messagesBox.innerHTML = "";
+      page.messages.forEach((m) => addMessage(m.role, m.content));
+    } else {
+      // Prepend the older page without moving what the user is looking at.
+      const previousHeight = messagesBox.scrollHeight;
+      const fragment = document.createDocumentFragment();
+      page.messages.forEach((m) => fragment.appendChild(createMessageElement(m.role, m.content)));
+      messagesBox.prepend(fragment);
+      messagesBox.scrollTop += messagesBox.scrollHeight - previousHeight;
+    }
+  } finally {
+    loadingMessages = false;
+  }
 
-  if (!currentChatId && chats.length > 0) {
-    await selectChat(chats[0].id);
+  // Same for a short history: without overflow there is no scroll to load the rest.
+  if (chatId === currentChatId && messagesCursor && messagesBox.scrollHeight <= messagesBox.clientHeight) {
+    await loadMessages({ older: true });
   }
 }
 
 async function selectChat(chatId) {
   currentChatId = chatId;
-  await loadChats();
-
-  const response = await fetch(`/api/chats/${chatId}/messages`);
-  const messages = await response.json();
-  messagesBox.innerHTML = "";
-  messages.forEach((m) => addMessage(m.role, m.content));
+  messagesCursor = null;
+  markActiveChat();
+  await loadMessages();
 }
 
 async function createChat() {
   const response = await fetch("/api/chats", { method: "POST" });
   const chat = await response.json();
   currentChatId = chat.id;
-  await loadChats();
+  messagesCursor = null;
+  showChatAtTop(chat);
+  markActiveChat();
   messagesBox.innerHTML = "";
 }
 
@@ -70,9 +205,9 @@ form?.addEventListener("submit", async (event) => {
   addMessage("user", text);
   input.value = "";
 
-  const response = await fetch(`/api/chats/${currentChatId}/messages`, {
+  const response = await fetch(`/api/chats/${currentChatId}/messages/stream`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
     body: JSON.stringify({ message: text }),
   });
 
@@ -82,13 +217,29 @@ form?.addEventListener("submit", async (event) => {
     return;
   }
 
-  const payload = await response.json();
-  addMessage("assistant", payload.assistant_message.content);
-  await loadChats();
+  const chatId = currentChatId;
+  const bubble = addMessage("assistant", "");
+  const result = await streamReply(response, bubble);
+  const item = chatList.querySelector(`.chat-item[data-chat-id="${chatId}"]`);
+  if (result?.title && item?.textContent !== result.title) {
+    showChatAtTop({ id: chatId, title: result.title });
+  }
 });
 
 newChatBtn?.addEventListener("click", createChat);
 
+messagesBox?.addEventListener("scroll", () => {
+  if (messagesBox.scrollTop < 80) {
+    loadMessages({ older: true });
+  }
+});
+
+chatList?.addEventListener("scroll", () => {
+  if (chatList.scrollTop + chatList.clientHeight >= chatList.scrollHeight - 80) {
+    loadChats({ append: true });
+  }
+});
+
 logoutBtn?.addEventListener("click", async () => {
   await fetch("/api/logout", { method: "POST" });
   window.location.href = "/login";
@@ -1,79 +1,195 @@
-from collections import defaultdict
+import threading
+from datetime import datetime, timedelta, timezone
 
 import pandas as pd
 import streamlit as st
-from sqlalchemy import desc
+from sqlalchemy import func, select
 
 from app.db import Base, SessionLocal, engine
-from app.models import LogMetric
+from app.metrics import PERCENTILES, STAGES, metric_info
+from app.models import LogMetric, LogMetricRollup
+
+
+# label -> (span, rollup resolution)
+RANGES = {
+    "Last hour": (timedelta(hours=1), "minute"),
+    "Last 6 hours": (timedelta(hours=6), "minute"),
+    "Last 24 hours": (timedelta(hours=24), "hour"),
+    "Last 7 days": (timedelta(days=7), "hour"),
+    "Last 30 days": (timedelta(days=30), "hour"),
+}
+# the widest range read at each resolution, which is all the incremental store keeps
+RETAIN = {"minute": timedelta(hours=6), "hour": timedelta(days=30)}
+COLUMNS = [
+    "bucket_start",
+    "metric_key",
+    "metric_label",
+    "unit",
+    "category",
+    "samples",
+    "total",
+    "max_value",
+    "last_value",
+]
 
 
 st.set_page_config(page_title="RAG Metrics Dashboard", layout="wide")
 st.title("RAG Chatbot Metrics Dashboard")
-st.caption("Live metrics from the `log_metrics` table")
+st.caption("Rolled-up metrics from the `log_metric_rollups` table")
 
 Base.metadata.create_all(bind=engine)
 
-db = SessionLocal()
-try:
-    metrics = db.query(LogMetric).order_by(desc(LogMetric.created_at), LogMetric.id).all()
-finally:
-    db.close()
 
-if not metrics:
-    st.warning("No metrics found. Run: python -m scripts.seed_metrics")
-    st.stop()
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
-rows = [
-    {
-        "metric_key": metric.metric_key,
-        "metric_label": metric.metric_label,
-        "metric_value": metric.metric_value,
-        "unit": metric.unit,
-        "category": metric.category,
-        "created_at": metric.created_at,
-    }
-    for metric in metrics
-]
-df = pd.DataFrame(rows)
 
-latest_by_key = df.sort_values(by=["created_at"], ascending=False).drop_duplicates(subset=["metric_key"])
-latest_by_key = latest_by_key.sort_values(by=["category", "metric_label"])
+class RollupStore:
+    """Rollup rows already read, per resolution.
+
+    A refresh only asks for buckets from the newest one held onwards, since that bucket may still be growing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames: dict[str, pd.DataFrame] = {}
+
+    def refresh(self, resolution: str) -> pd.DataFrame:
+        with self._lock:
+            held = self._frames.get(resolution)
+            oldest = utc_now() - RETAIN[resolution]
+            since = held["bucket_start"].max() if held is not None and len(held) else oldest
+            with SessionLocal() as db:
+                rows = db.execute(
+                    select(*(getattr(LogMetricRollup, column) for column in COLUMNS))
+                    .where(LogMetricRollup.resolution == resolution, LogMetricRollup.bucket_start >= since)
+                    .order_by(LogMetricRollup.bucket_start)
+                ).all()
+            fresh = pd.DataFrame(rows, columns=COLUMNS)
+            if held is not None and len(held):
+                held = held[(held["bucket_start"] < since) & (held["bucket_start"] >= oldest)]
+                fresh = pd.concat([held, fresh], ignore_index=True)
+            self._frames[resolution] = fresh
+            return fresh
+
+
+@st.cache_resource
+def rollup_store() -> RollupStore:
+    return RollupStore()
+
+
+@st.cache_data(ttl=30)
+def load_rollups(resolution: str, since: datetime) -> pd.DataFrame:
+    frame = rollup_store().refresh(resolution)
+    return frame[frame["bucket_start"] >= since].copy()
+
+
+@st.cache_data(ttl=300)
+def stored_row_count() -> int:
+    # max(id) is an index seek; an exact COUNT(*) would scan millions of rows
+    with SessionLocal() as db:
+        return int(db.scalar(select(func.max(LogMetric.id))) or 0)
+
+
+def bucket_values(frame: pd.DataFrame) -> pd.Series:
+    """One value per bucket and key: counters sum, gauges keep their last reading, latencies average."""
+    kinds = frame["metric_key"].map(lambda key: metric_info(key)[3])
+    mean = frame["total"] / frame["samples"].where(frame["samples"] > 0, 1)
+    return mean.where(kinds == "latency", frame["last_value"].where(kinds == "gauge", frame["total"]))
+
+
+def summarize(frame: pd.DataFrame) -> pd.DataFrame:
+    """One row per metric key over the whole range."""
+    kinds = frame["metric_key"].map(lambda key: metric_info(key)[3])
+    ordered = frame.assign(kind=kinds).sort_values("bucket_start")
+    grouped = ordered.groupby("metric_key")
+    summary = grouped[["metric_label", "unit", "category", "kind"]].last()
+    summary["total"] = grouped["total"].sum()
+    summary["samples"] = grouped["samples"].sum()
+    summary["last_value"] = grouped["last_value"].last()
+    summary["updated_at"] = grouped["bucket_start"].max()
+    summary["metric_value"] = summary["total"].where(summary["kind"] == "counter", summary["last_value"])
+    latency = summary["kind"] == "latency"
+    summary.loc[latency, "metric_value"] = summary.loc[latency, "total"] / summary.loc[latency, "samples"]
+    return summary.reset_index()
+
+
+def display_value(value: float, unit: str) -> str:
+    if unit == "ms":
+        return f"{value:,.0f} ms"
+    if unit == "usd":
+        return f"${value:,.2f}"
+    if unit == "ratio":
+        return f"{value:,.2f}"
+    return f"{value:,.0f}"
+
+
+range_label = st.selectbox("Time range", options=list(RANGES), index=2)
+span, resolution = RANGES[range_label]
+# round down to the bucket so reruns within a bucket hit the cache
+since = (utc_now() - span).replace(second=0, microsecond=0)
+if resolution == "hour":
+    since = since.replace(minute=0)
+rollups = load_rollups(resolution, since)
+
+if rollups.empty:
+    st.warning(
+        "No metrics in this range. Metrics are recorded by the running app; "
+        "for sample data run: python -m scripts.seed_metrics"
+    )
+    st.stop()
+
+summary = summarize(rollups).sort_values(by=["category", "metric_label"])
 
 st.subheader("KPI Cards")
+st.caption("Counters are totals over the range, gauges their latest reading, latencies sample-weighted means.")
 card_columns = st.columns(4)
-for index, (_, row) in enumerate(latest_by_key.iterrows()):
-    column = card_columns[index % 4]
-    value = row["metric_value"]
-    if row["unit"] == "ms":
-        display = f"{value:,.0f} ms"
-    elif row["unit"] == "usd":
-        display = f"${value:,.2f}"
-    elif row["unit"] == "ratio":
-        display = f"{value:,.2f}"
-    else:
-        display = f"{value:,.0f}"
-    column.metric(label=row["metric_label"], value=display)
+for index, (_, row) in enumerate(summary.iterrows()):
+    card_columns[index % 4].metric(label=row["metric_label"], value=display_value(row["metric_value"], row["unit"]))
+
+st.subheader("Latency Percentiles")
+stages = [stage for stage in STAGES if f"p50_{stage}_ms" in set(rollups["metric_key"])]
+if stages:
+    stage = st.selectbox("Stage", options=stages, format_func=STAGES.get)
+    keys = {f"avg_{stage}_ms": "avg", **{f"p{p}_{stage}_ms": f"p{p}" for p in PERCENTILES}}
+    latency = rollups[rollups["metric_key"].isin(keys)]
+    chart = (
+        latency.assign(value=bucket_values(latency), series=latency["metric_key"].map(keys))
+        .pivot_table(index="bucket_start", columns="series", values="value", aggfunc="mean")
+        .sort_index()
+    )
+    st.line_chart(chart)
+    st.caption(f"Per-{resolution} buckets; percentiles are averaged over the flush windows in each bucket.")
+else:
+    st.info("No latency samples in this range.")
 
 st.subheader("Metrics by Category")
-categories = sorted(latest_by_key["category"].unique().tolist())
+categories = sorted(summary["category"].unique().tolist())
 selected_category = st.selectbox("Filter Category", options=["all"] + categories, index=0)
+filtered = summary if selected_category == "all" else summary[summary["category"] == selected_category]
+st.bar_chart(filtered[["metric_label", "metric_value"]].set_index("metric_label"))
 
-filtered = latest_by_key if selected_category == "all" else latest_by_key[latest_by_key["category"] == selected_category]
-chart_df = filtered[["metric_label", "metric_value"]].set_index("metric_label")
-st.bar_chart(chart_df)
+if selected_category != "all":
+    series = rollups[rollups["category"] == selected_category]
+    over_time = (
+        series.assign(value=bucket_values(series))
+        .pivot_table(index="bucket_start", columns="metric_label", values="value", aggfunc="sum")
+        .sort_index()
+    )
+    st.line_chart(over_time)
 
 st.subheader("All Log Metrics (Table)")
 st.dataframe(
-    latest_by_key[["metric_key", "metric_label", "metric_value", "unit", "category", "created_at"]],
+    summary[["metric_key", "metric_label", "metric_value", "unit", "category", "updated_at"]],
     use_container_width=True,
 )
 
 st.subheader("Metric Counts")
-summary = defaultdict(int)
-summary["total_saved_metrics"] = int(len(metrics))
-summary["unique_metric_keys"] = int(latest_by_key["metric_key"].nunique())
 summary_df = pd.DataFrame(
-    [{"name": key, "value": value} for key, value in summary.items()]
+    [
+        {"name": "total_saved_metrics", "value": stored_row_count()},
+        {"name": "unique_metric_keys", "value": int(summary["metric_key"].nunique())},
+        {"name": f"{resolution}_buckets_in_range", "value": int(rollups["bucket_start"].nunique())},
+    ]
 )
 st.table(summary_df)